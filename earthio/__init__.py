@@ -1,10 +1,25 @@
 '''Package of readers from common satellite and weather data formats'''
+import sys
+
 # The modules below use __all__
 from earthio.hdf4 import *
 from earthio.hdf5 import *
+from earthio.http_range import *
 from earthio.netcdf import *
 from earthio.tif import *
 from earthio.util import *
+from earthio.meta_index import *
+from earthio.meta_parser import *
 from earthio.load_layers import *
+from earthio.filename_parsers import *
 from earthio.local_file_iterators import *
+from earthio.layer_sources import *
+from earthio.dask_load import *
+from earthio.sampling import *
+from earthio.regrid import *
+from earthio.mosaic import *
+from earthio.spatial_index import *
+from earthio.catalog import *
 
+if sys.version_info >= (3, 5):
+    from earthio.async_load import *
@@ -0,0 +1,150 @@
+'''
+------------------------
+
+``earthio.async_load``
+~~~~~~~~~~~~~~~~~~~~~~
+
+asyncio coroutines wrapping :func:`earthio.load_layers` and
+:func:`earthio.load_meta`.  The blocking GDAL / rasterio / netCDF4
+opens and reads run in a (configurable) executor so that the event
+loop is not blocked.  When layer_specs are given, layers are read one
+at a time, so a cancelled task stops before reading the next layer.
+
+'''
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import copy
+from functools import partial
+import logging
+
+import xarray as xr
+
+from earthio.load_layers import (load_layers, load_meta,
+                                 _find_file_type, _load_meta)
+from earthio.tif import _landsat_mtl
+
+__all__ = ['aload_layers', 'aload_meta', 'configure_executor']
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_WORKERS = 4
+
+_EXECUTOR = None
+
+
+def configure_executor(executor=None, max_workers=None):
+    '''Set the default executor used by aload_layers / aload_meta
+
+    Parameters:
+        :executor:    concurrent.futures.Executor instance or None
+        :max_workers: if executor is None, the maximum number of
+                      concurrent blocking reads in a new ThreadPoolExecutor
+                      (default: DEFAULT_MAX_WORKERS)
+
+    Returns:
+        :executor: the executor now used by default
+    '''
+    global _EXECUTOR
+    if executor is None:
+        executor = ThreadPoolExecutor(max_workers=max_workers or DEFAULT_MAX_WORKERS)
+    old, _EXECUTOR = _EXECUTOR, executor
+    if old is not None and old is not executor:
+        old.shutdown(wait=False)
+    return executor
+
+
+def _get_executor(executor=None):
+    if executor is not None:
+        return executor
+    if _EXECUTOR is None:
+        configure_executor()
+    return _EXECUTOR
+
+
+# called from coroutines: the running loop (get_event_loop before 3.7)
+_get_running_loop = getattr(asyncio, 'get_running_loop', asyncio.get_event_loop)
+
+
+def _run_blocking(executor, func, *args, **kwargs):
+    loop = _get_running_loop()
+    return loop.run_in_executor(_get_executor(executor),
+                                partial(func, *args, **kwargs))
+
+
+def _meta_for_layer(meta, ftype, idx):
+    '''Metadata to read only the idx'th layer_spec - the TIF reader
+    reads every layer in meta["layer_order_info"]'''
+    if ftype != 'tif':
+        return meta
+    meta = copy.copy(meta)
+    meta['layer_order_info'] = meta['layer_order_info'][idx:idx + 1]
+    meta['layer_meta'] = copy.deepcopy(meta['layer_meta'][idx:idx + 1])
+    return meta
+
+
+async def aload_meta(filename, executor=None, **kwargs):
+    '''Coroutine version of :func:`earthio.load_meta`
+
+    Parameters:
+        :filename: filename (HDF4 / 5 and NetCDF) or directory (TIF)
+        :executor: executor for the blocking read (default: see configure_executor)
+        :kwargs:   passed to earthio.load_meta
+
+    Returns:
+        :meta:     dict
+    '''
+    return await _run_blocking(executor, load_meta, filename, **kwargs)
+
+
+async def aload_layers(filename, meta=None, layer_specs=None, reader=None,
+                       executor=None, calibration=None, mtl=None):
+    '''Coroutine version of :func:`earthio.load_layers`
+
+    Parameters:
+        :filename:    filename (HDF4 / 5 or NetCDF) or directory name (TIF)
+        :meta:        meta data from "filename" already loaded
+        :layer_specs: list of strings or earthio.LayerSpec objects
+        :reader:      named reader from earthio - one of:  ('tif', 'hdf4', 'hdf5', 'netcdf')
+        :executor:    executor for the blocking reads (default: see configure_executor)
+        :calibration: Landsat TIF directories only: "radiance" or
+                      "reflectance" (see earthio.load_layers)
+        :mtl:         MTL file used with calibration (see earthio.load_layers)
+
+    Returns:
+        :dset:        xr.Dataset as returned by earthio.load_layers
+
+    With a list of layer_specs each layer is read in its own executor
+    call, so cancelling the task stops it between layers.
+    '''
+    ftype = reader or _find_file_type(filename)
+    if meta is None:
+        if ftype == 'tif':
+            meta = await _run_blocking(executor, _load_meta, filename, ftype,
+                                       layer_specs=layer_specs)
+        else:
+            meta = await _run_blocking(executor, _load_meta, filename, ftype)
+    if calibration is not None and ftype == 'tif':
+        # parsed once, not for each layer
+        mtl = await _run_blocking(executor, _landsat_mtl, filename, mtl=mtl)
+    if not isinstance(layer_specs, (list, tuple)) or len(layer_specs) < 2:
+        return await _run_blocking(executor, load_layers, filename, meta=meta,
+                                   layer_specs=layer_specs, reader=ftype,
+                                   calibration=calibration, mtl=mtl)
+    data = OrderedDict()
+    for idx, layer_spec in enumerate(layer_specs):
+        logger.debug('aload_layers: {} layer {}'.format(filename, idx))
+        dset = await _run_blocking(executor, load_layers, filename,
+                                   meta=_meta_for_layer(meta, ftype, idx),
+                                   layer_specs=[layer_spec],
+                                   reader=ftype, calibration=calibration,
+                                   mtl=mtl)
+        for name in dset.data_vars:
+            data[name] = dset[name]
+    attrs = copy.copy(dset.attrs)
+    attrs['layer_order'] = list(data)
+    if ftype == 'tif':
+        attrs['meta'] = meta
+    return xr.Dataset(data, attrs=attrs)
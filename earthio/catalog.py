@@ -0,0 +1,299 @@
+'''
+-------------------
+
+``earthio.catalog``
+~~~~~~~~~~~~~~~~~~~
+
+SQLite catalog of the metadata of the files under a directory tree, to
+answer "which files have a layer matching this LayerSpec" (and where /
+when) without opening the files again.
+
+Tables:
+
+    - **files**: path, reader, mtime, size, bounds and time range
+    - **layers**: one row per layer (subdataset, variable or GeoTiff)
+    - **meta_keys**: distinct metadata keys
+    - **layer_meta**: flattened layer metadata (layer, key, value); keys
+      of nested dicts are joined with "."
+
+:meth:`Catalog.refresh` re-reads only files that are new or whose
+mtime / size changed, and drops files that are gone.  For a directory of
+GeoTiffs these are the latest mtime and the total size of its files, so a
+TIF rewritten in place is seen as a change.
+
+'''
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import logging
+import os
+import re
+import sqlite3
+
+import numpy as np
+from six import string_types
+
+from earthio.layer_sources import _file_stat, layer_sources, sources_bounds
+from earthio.load_layers import _find_file_type, _load_meta
+from earthio.local_file_iterators import (iter_dirs_of_dirs,
+                                          iter_files_recursively)
+from earthio.metadata_selection import layer_spec_matcher
+from earthio.spatial_index import _time_range
+
+__all__ = ['Catalog']
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 1
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    reader TEXT,
+    mtime REAL,
+    size INTEGER,
+    left REAL, bottom REAL, right REAL, top REAL,
+    start_time TEXT, end_time TEXT
+);
+CREATE INDEX IF NOT EXISTS files_x ON files (left, right);
+CREATE INDEX IF NOT EXISTS files_time ON files (start_time, end_time);
+CREATE TABLE IF NOT EXISTS layers (
+    id INTEGER PRIMARY KEY,
+    file_id INTEGER NOT NULL REFERENCES files (id) ON DELETE CASCADE,
+    layer_idx INTEGER NOT NULL,
+    name TEXT
+);
+CREATE INDEX IF NOT EXISTS layers_file ON layers (file_id);
+CREATE TABLE IF NOT EXISTS meta_keys (
+    id INTEGER PRIMARY KEY,
+    key TEXT UNIQUE NOT NULL
+);
+CREATE TABLE IF NOT EXISTS layer_meta (
+    layer_id INTEGER NOT NULL REFERENCES layers (id) ON DELETE CASCADE,
+    key_id INTEGER NOT NULL REFERENCES meta_keys (id),
+    nested INTEGER NOT NULL,
+    is_text INTEGER NOT NULL,
+    value TEXT
+);
+CREATE INDEX IF NOT EXISTS layer_meta_key ON layer_meta (key_id, nested);
+CREATE INDEX IF NOT EXISTS layer_meta_layer ON layer_meta (layer_id);
+'''
+
+_REGEXES = {}
+
+
+def _regexp(pattern, value):
+    '''SQLite REGEXP: "value REGEXP pattern" is re.search(pattern, value)'''
+    if not isinstance(value, string_types):
+        return False
+    regex = _REGEXES.get(pattern)
+    if regex is None:
+        if len(_REGEXES) > 1000:
+            _REGEXES.clear()
+        regex = _REGEXES[pattern] = re.compile(pattern)
+    return regex.search(value) is not None
+
+
+def _flatten(meta, prefix=''):
+    '''Yield (key, nested, value) of meta, with keys of nested dicts
+    joined by "."'''
+    for key, value in meta.items():
+        full_key = '{}{}'.format(prefix, key)
+        if isinstance(value, dict):
+            for item in _flatten(value, full_key + '.'):
+                yield item
+        else:
+            yield full_key, bool(prefix), value
+
+
+def _layers(meta, ftype):
+    '''(name, layer meta) of the layers in meta from load_meta'''
+    layer_metas = meta.get('layer_meta') or []
+    if ftype == 'netcdf':
+        names = meta['variables']
+    elif 'sub_datasets' in meta:
+        names = [sd[0] for sd in meta['sub_datasets']]
+    else:
+        names = [layer_meta.get('name') for layer_meta in layer_metas]
+    return list(zip(names, layer_metas))
+
+
+def _iso(value):
+    return None if np.isnat(value) else str(value)
+
+
+class Catalog(object):
+    '''SQLite metadata catalog
+
+    Parameters:
+        :path: SQLite database file (created if needed), or ":memory:"
+    '''
+    def __init__(self, path=':memory:'):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.create_function('REGEXP', 2, _regexp)
+        # registered once: _where sets the LayerSpec matcher they call
+        self._matcher = None
+        self.conn.create_function('earthio_match_key', 1,
+                                  lambda key: self._matcher.match_key(key))
+        self.conn.create_function('earthio_match_value', 1,
+                                  lambda value: self._matcher.match_value(value))
+        self.conn.execute('PRAGMA foreign_keys = ON')
+        version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+        if version not in (0, SCHEMA_VERSION):
+            raise ValueError('Expected catalog schema version {}, got {} ({})'.format(SCHEMA_VERSION, version, path))
+        with self.conn:
+            self.conn.executescript(SCHEMA)
+            self.conn.execute('PRAGMA user_version = {}'.format(SCHEMA_VERSION))
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _key_id(self, key):
+        row = self.conn.execute('SELECT id FROM meta_keys WHERE key = ?', (key,)).fetchone()
+        if row:
+            return row[0]
+        return self.conn.execute('INSERT INTO meta_keys (key) VALUES (?)', (key,)).lastrowid
+
+    def add_file(self, filename, reader=None, time_func=None):
+        '''Read the metadata of filename (or TIF directory) and replace
+        its rows in the catalog
+
+        Parameters:
+            :filename:  filename (HDF4 / 5 or NetCDF) or directory name (TIF)
+            :reader:    named reader from earthio - one of:  ('tif', 'hdf4', 'hdf5', 'netcdf')
+            :time_func: function of filename returning its time, (start, end)
+                        times, or None
+        '''
+        ftype = reader or _find_file_type(filename)
+        mtime, size = _file_stat(filename)
+        meta = _load_meta(filename, ftype)
+        try:
+            bounds = sources_bounds(layer_sources(filename, meta=meta, reader=ftype))
+        except Exception as e:
+            logger.debug('Catalog: no bounds for {} ({})'.format(filename, repr(e)))
+            bounds = (None,) * 4
+        start, end = _time_range(time_func(filename) if time_func else None)
+        with self.conn:
+            self.conn.execute('DELETE FROM files WHERE path = ?', (filename,))
+            file_id = self.conn.execute(
+                'INSERT INTO files (path, reader, mtime, size, left, bottom, right, top, '
+                'start_time, end_time) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (filename, ftype, mtime, size) + tuple(bounds) +
+                (_iso(start), _iso(end))).lastrowid
+            for layer_idx, (name, layer_meta) in enumerate(_layers(meta, ftype)):
+                layer_id = self.conn.execute(
+                    'INSERT INTO layers (file_id, layer_idx, name) VALUES (?, ?, ?)',
+                    (file_id, layer_idx, name)).lastrowid
+                rows = []
+                for key, nested, value in _flatten(layer_meta):
+                    is_text = isinstance(value, string_types)
+                    rows.append((layer_id, self._key_id(key), nested, is_text,
+                                 value if is_text else repr(value)))
+                self.conn.executemany(
+                    'INSERT INTO layer_meta (layer_id, key_id, nested, is_text, value) '
+                    'VALUES (?, ?, ?, ?, ?)', rows)
+
+    def remove_file(self, filename):
+        with self.conn:
+            self.conn.execute('DELETE FROM files WHERE path = ?', (filename,))
+
+    def refresh(self, top_dir, file_pattern=None, reader=None, time_func=None):
+        '''Add new and changed files under top_dir, remove missing ones
+
+        Parameters:
+            :top_dir:      directory to walk
+            :file_pattern: regex filenames must match (optional)
+            :reader:       named reader from earthio.  With "tif",
+                           directories of GeoTiffs are cataloged
+            :time_func:    see add_file
+
+        Returns:
+            :counts:       dict of the number of files "added", "updated",
+                           "removed", "unchanged" and "failed"
+        '''
+        kw = dict(top_dir=top_dir, file_pattern=file_pattern)
+        if reader == 'tif':
+            files = iter_dirs_of_dirs(**kw)
+        else:
+            files = iter_files_recursively(**kw)
+        known = {path: (mtime, size) for path, mtime, size in
+                 self.conn.execute('SELECT path, mtime, size FROM files')}
+        counts = dict(added=0, updated=0, removed=0, unchanged=0, failed=0)
+        seen = set()
+        for filename in files:
+            seen.add(filename)
+            if known.get(filename) == _file_stat(filename):
+                counts['unchanged'] += 1
+                continue
+            try:
+                self.add_file(filename, reader=reader, time_func=time_func)
+            except Exception as e:
+                logger.warning('Catalog: failed to read {} ({})'.format(filename, repr(e)))
+                counts['failed'] += 1
+                continue
+            counts['updated' if filename in known else 'added'] += 1
+        prefix = os.path.join(top_dir, '')
+        for path in known:
+            if path.startswith(prefix) and path not in seen:
+                self.remove_file(path)
+                counts['removed'] += 1
+        return counts
+
+    def files(self):
+        '''Paths of all cataloged files'''
+        return [row[0] for row in self.conn.execute('SELECT path FROM files ORDER BY path')]
+
+    def _where(self, layer_spec, bounds, time_range):
+        clauses, params = [], []
+        if layer_spec is not None:
+            # keys are matched on the (small) meta_keys table, then
+            # values only for rows of the matching keys (layer_meta_key index)
+            self._matcher = layer_spec_matcher(layer_spec)
+            clauses.append('l.id IN (SELECT layer_id FROM layer_meta WHERE nested = 0 '
+                           'AND key_id IN (SELECT id FROM meta_keys WHERE earthio_match_key(key)) '
+                           'AND is_text = 1 AND earthio_match_value(value))')
+        if bounds is not None:
+            left, bottom, right, top = bounds
+            left, right = min(left, right), max(left, right)
+            bottom, top = min(bottom, top), max(bottom, top)
+            clauses.append('f.left <= ? AND f.right >= ? AND f.bottom <= ? AND f.top >= ?')
+            params.extend([right, left, top, bottom])
+        if time_range is not None:
+            start, end = _time_range(time_range)
+            clauses.append('f.start_time IS NOT NULL AND f.end_time IS NOT NULL')
+            if not np.isnat(start):
+                clauses.append('f.end_time >= ?')
+                params.append(_iso(start))
+            if not np.isnat(end):
+                clauses.append('f.start_time <= ?')
+                params.append(_iso(end))
+        return ' AND '.join(clauses) or '1', params
+
+    def layers_matching(self, layer_spec, bounds=None, time_range=None):
+        '''(path, layer index, layer name) of layers matching layer_spec
+        (as in earthio.metadata_selection.match_meta)
+
+        Parameters:
+            :layer_spec: earthio.LayerSpec
+            :bounds:     (left, bottom, right, top) the file must intersect
+            :time_range: (start, end) the file's time range must intersect
+        '''
+        where, params = self._where(layer_spec, bounds, time_range)
+        return self.conn.execute(
+            'SELECT f.path, l.layer_idx, l.name FROM layers l JOIN files f ON l.file_id = f.id '
+            'WHERE {} ORDER BY f.path, l.layer_idx'.format(where), params).fetchall()
+
+    def files_matching(self, layer_spec=None, bounds=None, time_range=None):
+        '''Paths of files with a layer matching layer_spec, intersecting
+        bounds and time_range (each optional; see layers_matching)'''
+        where, params = self._where(layer_spec, bounds, time_range)
+        return [row[0] for row in self.conn.execute(
+            'SELECT DISTINCT f.path FROM files f LEFT JOIN layers l ON l.file_id = f.id '
+            'WHERE {} ORDER BY f.path'.format(where), params)]
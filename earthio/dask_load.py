@@ -0,0 +1,144 @@
+'''
+---------------------
+
+``earthio.dask_load``
+~~~~~~~~~~~~~~~~~~~~~
+
+Build dask graphs that read many files on a dask (distributed) cluster.
+
+:func:`load_layers_dask` makes one metadata task per file and one read task
+per layer or window.  Tasks carry only picklable
+:class:`earthio.LayerSource` descriptors and windows - never open
+file handles - so any worker that can see the files can run them.
+
+'''
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from collections import OrderedDict
+import logging
+
+import numpy as np
+import xarray as xr
+
+from earthio.layer_sources import _layer_specs_key, layer_sources, read_window
+from earthio.util import (geotransform_to_bounds,
+                          geotransform_to_coords,
+                          layers_to_dataset)
+
+__all__ = ['load_layers_dask', 'layer_source_tasks', 'layer_source_to_dask_array']
+
+logger = logging.getLogger(__name__)
+
+
+def layer_source_tasks(files, layer_specs=None, reader=None):
+    '''One dask.delayed metadata task per file
+
+    Parameters:
+        :files:       list of filenames (HDF4 / 5 or NetCDF) or TIF directories
+        :layer_specs: list of strings or earthio.LayerSpec objects
+        :reader:      named reader from earthio - one of:  ('tif', 'hdf4', 'hdf5', 'netcdf')
+
+    Returns:
+        :tasks:       list of dask.delayed objects returning lists of LayerSource
+    '''
+    from dask import delayed
+    from dask.base import tokenize
+    specs_key = _layer_specs_key(layer_specs)
+    return [delayed(layer_sources, pure=True)(filename,
+                                              layer_specs=layer_specs,
+                                              reader=reader,
+                                              dask_key_name='layer-sources-{}'.format(tokenize(filename, specs_key, reader)))
+            for filename in files]
+
+
+def _chunk_bounds(size, chunk):
+    starts = list(range(0, size, chunk))
+    return [(start, min(start + chunk, size)) for start in starts]
+
+
+def layer_source_to_dask_array(source, chunks=None):
+    '''Lazy dask.array for one layer, with one read task per window
+
+    Parameters:
+        :source: LayerSource
+        :chunks: (rows, cols) of each window, "blocks" to use the
+                 storage block shape, or None for one task per layer
+
+    Returns:
+        :arr:    dask.array.Array with dims ("y", "x")
+    '''
+    import dask.array as da
+    from dask.base import tokenize
+    if chunks is None:
+        chunks = (source.height, source.width)
+    elif chunks == 'blocks':
+        chunks = source.block_shape
+    row_bounds = _chunk_bounds(source.height, int(chunks[0]))
+    col_bounds = _chunk_bounds(source.width, int(chunks[1]))
+    name = 'read-window-{}'.format(tokenize(source, row_bounds, col_bounds))
+    dsk = {(name, i, j): (read_window, source, (rows, cols))
+           for i, rows in enumerate(row_bounds)
+           for j, cols in enumerate(col_bounds)}
+    chunks = (tuple(r1 - r0 for r0, r1 in row_bounds),
+              tuple(c1 - c0 for c0, c1 in col_bounds))
+    return da.Array(dsk, name, chunks=chunks, dtype=np.dtype(source.dtype))
+
+
+def _sources_to_dataset(sources, chunks):
+    data = OrderedDict()
+    for source in sources:
+        coords_x, coords_y = geotransform_to_coords(source.width,
+                                                    source.height,
+                                                    source.geo_transform)
+        attrs = dict(geo_transform=np.array(source.geo_transform),
+                     buf_xsize=source.width,
+                     buf_ysize=source.height,
+                     dims=('y', 'x'),
+                     bounds=geotransform_to_bounds(source.width,
+                                                   source.height,
+                                                   source.geo_transform),
+                     ravel_order='C',
+                     sub_dataset_name=source.path)
+        data[source.name] = xr.DataArray(layer_source_to_dask_array(source, chunks=chunks),
+                                         coords=[('y', coords_y), ('x', coords_x)],
+                                         dims=('y', 'x'),
+                                         attrs=attrs)
+    return layers_to_dataset(data, attrs={'layer_order': list(data)})
+
+
+def load_layers_dask(files, layer_specs=None, reader=None, chunks=None,
+                     concat_dim='file', sources=None):
+    '''Lazy xr.Dataset of layers from many files, backed by a dask graph
+
+    Parameters:
+        :files:       list of filenames (HDF4 / 5 or NetCDF) or TIF directories
+        :layer_specs: list of strings or earthio.LayerSpec objects
+        :reader:      named reader from earthio - one of:  ('tif', 'hdf4', 'hdf5', 'netcdf')
+        :chunks:      (rows, cols) per read task, "blocks" for the storage
+                      block shape, or None for one read task per layer
+        :concat_dim:  name of the new dimension the files are stacked on,
+                      or None to return a list of xr.Dataset (one per file)
+        :sources:     lists of LayerSource per file, if already computed
+
+    Returns:
+        :dset:        xr.Dataset (or list of them) of dask arrays
+
+    The metadata tasks run when this function is called (with the
+    default dask scheduler - a distributed.Client if one is active),
+    because the array shapes are needed to build the graph.  The read
+    tasks run when the returned Dataset is computed.  Files stacked on
+    concat_dim are expected to share a grid.
+    '''
+    import dask
+    files = list(files)
+    if sources is None:
+        sources = dask.compute(*layer_source_tasks(files,
+                                                   layer_specs=layer_specs,
+                                                   reader=reader))
+    dsets = [_sources_to_dataset(file_sources, chunks)
+             for file_sources in sources]
+    if concat_dim is None:
+        return dsets
+    dset = xr.concat(dsets, dim=concat_dim)
+    dset[concat_dim] = files
+    return dset
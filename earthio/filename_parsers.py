@@ -0,0 +1,258 @@
+'''
+----------------------------
+
+``earthio.filename_parsers``
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Parsers of the time and tile encoded in file names, used to select
+files by time range and tile from their names alone:
+
+    - Landsat scene IDs (``LC80150332013207LGN00``) and collection product
+      IDs (``LC08_L1TP_015033_20130726_20170309_01_T1``): acquisition date,
+      (path, row) tile
+    - MODIS names (``MOD09GA.A2016001.h08v05.006.2016012044419.hdf``):
+      date, (h, v) tile (None for global products)
+    - IMERG names (``3B-HHR-E.MS.MRG.3IMERG.20160101-S000000-E002959...``):
+      (start, end) times, no tile
+
+and of date directories (``.../2016/01/01/``, ``.../2016/001/``,
+``.../2016.01.01/``) giving the time range of the files below them.
+
+Parsers are functions of a file (or directory) base name returning a
+:class:`FileNameInfo` or None when the name is not of their format.
+More can be added to FILENAME_PARSERS.
+
+'''
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from collections import namedtuple, OrderedDict
+import calendar
+import datetime
+import os
+import re
+
+import numpy as np
+from six import string_types
+
+from earthio.spatial_index import _time_range
+
+__all__ = ['FileNameInfo', 'FILENAME_PARSERS', 'parse_landsat_name',
+           'parse_modis_name', 'parse_imerg_name', 'parse_filename',
+           'dir_time_range', 'filename_filter']
+
+FileNameInfo = namedtuple('FileNameInfo', 'time tile')
+FileNameInfo.__doc__ = '''Time and tile parsed from a file name
+
+    - **time**: datetime.datetime, or (start, end) datetimes
+    - **tile**: tuple of ints (Landsat (path, row), MODIS (h, v)) or None
+'''
+
+LANDSAT_SCENE_ID = re.compile(r'L[COTEM]\d(\d{3})(\d{3})(\d{4})(\d{3})[A-Z]{3}\d{2}')
+LANDSAT_PRODUCT_ID = re.compile(r'L[COTEM]\d{2}_[A-Z0-9]{4}_(\d{3})(\d{3})_(\d{4})(\d{2})(\d{2})_\d{8}_\d{2}_[A-Z0-9]{2}')
+MODIS_NAME = re.compile(r'\.A(\d{4})(\d{3})(?:\.h(\d{2})v(\d{2}))?\.')
+IMERG_NAME = re.compile(r'3IMERG[A-Z]*\.(\d{8})-S(\d{6})-E(\d{6})')
+
+DIR_YEAR = re.compile(r'^(?:19|20)\d{2}$')
+DIR_DATE = re.compile(r'^((?:19|20)\d{2})[-._]?(\d{2})[-._]?(\d{2})$')
+DIR_YEAR_DAY = re.compile(r'^((?:19|20)\d{2})[-._](\d{3})$')
+
+
+def _year_day(year, day):
+    return datetime.datetime(int(year), 1, 1) + datetime.timedelta(days=int(day) - 1)
+
+
+def parse_landsat_name(name):
+    '''FileNameInfo(acquisition date, (path, row)) of a name containing a
+    Landsat scene ID or collection product ID, else None'''
+    match = LANDSAT_PRODUCT_ID.search(name)
+    if match:
+        path, row, year, month, day = map(int, match.groups())
+        try:
+            return FileNameInfo(datetime.datetime(year, month, day), (path, row))
+        except ValueError:
+            return None
+    match = LANDSAT_SCENE_ID.search(name)
+    if match:
+        path, row, year, day = map(int, match.groups())
+        if 1 <= day <= 366:
+            return FileNameInfo(_year_day(year, day), (path, row))
+    return None
+
+
+def parse_modis_name(name):
+    '''FileNameInfo(date, (h, v) or None) of a MODIS name like
+    "MOD09GA.A2016001.h08v05.006.2016012044419.hdf", else None'''
+    match = MODIS_NAME.search(name)
+    if not match:
+        return None
+    year, day, h, v = match.groups()
+    if not 1 <= int(day) <= 366:
+        return None
+    tile = (int(h), int(v)) if h is not None else None
+    return FileNameInfo(_year_day(year, day), tile)
+
+
+def parse_imerg_name(name):
+    '''FileNameInfo((start, end), None) of an IMERG name like
+    "3B-HHR-E.MS.MRG.3IMERG.20160101-S000000-E002959.0000.V03E.nc", else
+    None.  Monthly ("3B-MO") files end at the end of the month'''
+    match = IMERG_NAME.search(name)
+    if not match:
+        return None
+    date, start, end = match.groups()
+    try:
+        start = datetime.datetime.strptime(date + start, '%Y%m%d%H%M%S')
+        end = datetime.datetime.strptime(date + end, '%Y%m%d%H%M%S')
+    except ValueError:
+        return None
+    if name.startswith('3B-MO'):
+        days = calendar.monthrange(start.year, start.month)[1]
+        end = end.replace(day=days)
+    elif end < start:
+        end += datetime.timedelta(days=1)
+    return FileNameInfo((start, end), None)
+
+
+FILENAME_PARSERS = OrderedDict([('landsat', parse_landsat_name),
+                                ('modis', parse_modis_name),
+                                ('imerg', parse_imerg_name)])
+
+
+def _get_parser(parser):
+    if parser is None:
+        return parse_filename
+    if isinstance(parser, string_types):
+        if parser not in FILENAME_PARSERS:
+            raise ValueError('Expected parser in {}, got {}'.format(tuple(FILENAME_PARSERS), parser))
+        return FILENAME_PARSERS[parser]
+    if not callable(parser):
+        raise ValueError('Expected parser to be a name in FILENAME_PARSERS or a function, got {}'.format(parser))
+    return parser
+
+
+def parse_filename(name, parsers=None):
+    '''FileNameInfo of name from the first parser recognizing it
+
+    Parameters:
+        :name:    file name (the base name is parsed)
+        :parsers: names in FILENAME_PARSERS or functions (default: all
+                  of FILENAME_PARSERS)
+
+    Returns:
+        :info:    FileNameInfo or None
+    '''
+    name = os.path.basename(name)
+    for parser in (parsers or FILENAME_PARSERS.values()):
+        info = _get_parser(parser)(name)
+        if info is not None:
+            return info
+    return None
+
+
+def dir_time_range(path):
+    '''(start, end) datetimes of a date directory path, from its last
+    year component and the month / day or day of year after it:
+    ".../2016" (the year), ".../2016/01", ".../2016/01/01",
+    ".../2016/001", ".../2016.01.01" or ".../20160101".  None if path
+    has no year component'''
+    parts = os.path.normpath(path).split(os.sep)
+    for idx in range(len(parts) - 1, -1, -1):
+        part = parts[idx]
+        after = parts[idx + 1:idx + 3]
+        try:
+            match = DIR_DATE.match(part)
+            if match:
+                start = datetime.datetime(*map(int, match.groups()))
+                return start, start + datetime.timedelta(days=1, seconds=-1)
+            match = DIR_YEAR_DAY.match(part)
+            if match:
+                year, day = match.groups()
+                if 1 <= int(day) <= 366:
+                    start = _year_day(year, day)
+                    return start, start + datetime.timedelta(days=1, seconds=-1)
+                continue
+            if not DIR_YEAR.match(part):
+                continue
+            year = int(part)
+            if after and re.match(r'^\d{3}$', after[0]) and 1 <= int(after[0]) <= 366:
+                start = _year_day(year, after[0])
+                return start, start + datetime.timedelta(days=1, seconds=-1)
+            if after and re.match(r'^\d{2}$', after[0]) and 1 <= int(after[0]) <= 12:
+                month = int(after[0])
+                if len(after) > 1 and re.match(r'^\d{2}$', after[1]):
+                    start = datetime.datetime(year, month, int(after[1]))
+                    return start, start + datetime.timedelta(days=1, seconds=-1)
+                days = calendar.monthrange(year, month)[1]
+                start = datetime.datetime(year, month, 1)
+                return start, start + datetime.timedelta(days=days, seconds=-1)
+            return datetime.datetime(year, 1, 1), datetime.datetime(year, 12, 31, 23, 59, 59)
+        except ValueError:
+            # e.g. day 31 of a 30 day month: not a date directory
+            continue
+    return None
+
+
+def _intersects(time_range, query):
+    start, end = _time_range(time_range)
+    q_start, q_end = query
+    if not np.isnat(q_start) and not np.isnat(end) and end < q_start:
+        return False
+    if not np.isnat(q_end) and not np.isnat(start) and start > q_end:
+        return False
+    return True
+
+
+def filename_filter(time_range=None, tiles=None, parser=None, dir_parser=dir_time_range):
+    '''Functions selecting file names and directories by the time and
+    tile parsed from their names
+
+    Parameters:
+        :time_range: (start, end) datetimes (or datetime64 / strings, None
+                     for open ended) files' times must intersect
+        :tiles:      tiles (as parsed, e.g. Landsat (path, row) or MODIS
+                     (h, v) tuples) files must be in
+        :parser:     name in FILENAME_PARSERS or function of a base name
+                     returning a FileNameInfo or None (default: try all
+                     of FILENAME_PARSERS)
+        :dir_parser: function of a directory path returning its (start,
+                     end) time range or None (default: dir_time_range)
+
+    Returns:
+        :(keep_file, keep_dir): functions of a base name / a directory path
+                     returning False for names to skip, or (None, None)
+                     when neither time_range nor tiles is given
+
+    File names that cannot be parsed are skipped.  Directories are
+    skipped when their date (from dir_parser) is outside time_range,
+    or when their base name parses (e.g. a Landsat scene directory)
+    to a time or tile that is not selected.
+    '''
+    if time_range is None and tiles is None:
+        return None, None
+    parse = _get_parser(parser)
+    query = _time_range(time_range) if time_range is not None else None
+    if tiles is not None:
+        tiles = set(tuple(tile) if isinstance(tile, list) else tile for tile in tiles)
+
+    def keep_info(info):
+        if query is not None and not _intersects(info.time, query):
+            return False
+        if tiles is not None and info.tile not in tiles:
+            return False
+        return True
+
+    def keep_file(name):
+        info = parse(name)
+        return info is not None and keep_info(info)
+
+    def keep_dir(path):
+        info = parse(os.path.basename(path))
+        if info is not None and not keep_info(info):
+            return False
+        if query is not None and dir_parser is not None:
+            dir_range = dir_parser(path)
+            if dir_range is not None and not _intersects(dir_range, query):
+                return False
+        return True
+
+    return keep_file, keep_dir
@@ -29,7 +29,8 @@ from earthio.util import (geotransform_to_bounds,
                           READ_ARRAY_KWARGS,
                           take_geo_transform_from_meta,
                           window_to_gdal_read_kwargs,
-                          meta_strings_to_dict)
+                          meta_strings_to_dict,
+                          layers_to_dataset)
 
 __all__ = [
     'load_hdf4_meta',
@@ -75,7 +76,7 @@ def load_hdf4_array(datafile, meta, layer_specs=None):
     '''
     import gdal
     from gdalconst import GA_ReadOnly
-    from earthio.metadata_selection import match_meta
+    from earthio.metadata_selection import match_layers
     logger.debug('load_hdf4_array: {}'.format(datafile))
     f = gdal.Open(datafile, GA_ReadOnly)
 
@@ -83,12 +84,10 @@ def load_hdf4_array(datafile, meta, layer_specs=None):
     layer_metas = meta['layer_meta']
     layer_order_info = []
     if layer_specs:
-        for layer_meta, s in zip(layer_metas, sds):
-            #layer_meta['name'] = s[0]
-            for idx, layer_spec in enumerate(layer_specs):
-                if match_meta(layer_meta, layer_spec):
-                    layer_order_info.append((idx, layer_meta, s, layer_spec))
-                    break
+        matches = match_layers(layer_metas, layer_specs)
+        for idx, layer_meta, s in zip(matches, layer_metas, sds):
+            if idx is not None:
+                layer_order_info.append((idx, layer_meta, s, layer_specs[idx]))
 
         layer_order_info.sort(key=lambda x:x[0])
         if len(layer_order_info) != len(layer_specs):
@@ -136,4 +135,4 @@ def load_hdf4_array(datafile, meta, layer_specs=None):
     attrs = copy.deepcopy(attrs)
     attrs['layer_order'] = layer_order
     gc.collect()
-    return xr.Dataset(elm_store_data, attrs=attrs)
+    return layers_to_dataset(elm_store_data, attrs=attrs)
@@ -29,9 +29,11 @@ from earthio.util import (geotransform_to_bounds,
                           READ_ARRAY_KWARGS,
                           take_geo_transform_from_meta,
                           window_to_gdal_read_kwargs,
-                          meta_strings_to_dict)
+                          meta_strings_to_dict,
+                          layers_to_dataset)
 
-from earthio.metadata_selection import match_meta
+from earthio.metadata_selection import match_layers
+from earthio.meta_parser import LazyMetaDict
 
 __all__ = [
     'load_hdf5_meta',
@@ -41,11 +43,6 @@ __all__ = [
 logger = logging.getLogger(__name__)
 
 
-def _nc_str_to_dict(nc_str):
-    str_list = [g.split('=') for g in nc_str.split(';\n')]
-    return dict([g for g in str_list if len(g) == 2])
-
-
 def load_hdf5_meta(datafile):
     '''Load dataset and subdataset metadata from HDF5 file'''
     import gdal
@@ -56,17 +53,12 @@ def load_hdf5_meta(datafile):
     layer_metas = []
     for s in sds:
         f2 = gdal.Open(s[0], GA_ReadOnly)
-        bm = dict()
-        for k, v in f2.GetMetadata().items():
-            vals = _nc_str_to_dict(v)
-            bm.update(vals)
+        bm = LazyMetaDict.from_merged_strings(f2.GetMetadata().values())
         layer_metas.append(bm)
         layer_metas[-1]['sub_dataset_name'] = s[0]
 
-    meta = dict()
-    for k, v in f.GetMetadata().items():
-        vals = _nc_str_to_dict(v)
-        meta.update(vals)
+    # "key=value;\n" strings are tokenized when first read
+    meta = LazyMetaDict.from_merged_strings(f.GetMetadata().values())
 
     return meta_strings_to_dict(dict(meta=meta,
                                 layer_meta=layer_metas,
@@ -113,13 +105,13 @@ def load_hdf5_array(datafile, meta, layer_specs):
     sds = meta['sub_datasets']
     layer_metas = meta['layer_meta']
     layer_order_info = []
-    for layer_idx, (layer_meta, sd) in enumerate(zip(layer_metas, sds)):
-        if layer_specs:
-            for idx, bs in enumerate(layer_specs):
-                if match_meta(layer_meta, bs):
-                    layer_order_info.append((idx, layer_meta, sd, bs))
-                    break
-        else:
+    if layer_specs:
+        matches = match_layers(layer_metas, layer_specs)
+        for idx, layer_meta, sd in zip(matches, layer_metas, sds):
+            if idx is not None:
+                layer_order_info.append((idx, layer_meta, sd, layer_specs[idx]))
+    else:
+        for layer_idx, (layer_meta, sd) in enumerate(zip(layer_metas, sds)):
             layer_order_info.append((layer_idx, layer_meta, sd, 'layer_{}'.format(layer_idx)))
 
     if layer_specs and len(layer_order_info) != len(layer_specs):
@@ -147,4 +139,4 @@ def load_hdf5_array(datafile, meta, layer_specs):
     attrs = copy.deepcopy(attrs)
     attrs['layer_order'] = layer_order
     gc.collect()
-    return xr.Dataset(elm_store_data, attrs=attrs)
+    return layers_to_dataset(elm_store_data, attrs=attrs)
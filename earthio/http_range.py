@@ -0,0 +1,299 @@
+'''
+----------------------
+
+``earthio.http_range``
+~~~~~~~~~~~~~~~~~~~~~~
+
+Windowed reads of remote (http / https) GeoTiffs with HTTP range
+requests, so that reading a window fetches the file's header and the
+blocks of the window instead of the whole file.
+
+:class:`HTTPRangeFile` is a read-only file object over a URL.  It
+fetches aligned blocks of ``block_size`` bytes (contiguous missing
+blocks in one request), keeps recent blocks in memory and, with a
+``cache_dir``, on disk, keyed by URL, ETag (or Last-Modified and size)
+and block.  Blocks of a file that changed on the server are not reused.
+
+:func:`rio_open` opens local paths with rasterio and remote ones through
+an :class:`HTTPRangeFile` (rasterio >= 1.4 ``opener``), or GDAL
+``/vsicurl/`` with older rasterio.
+
+The cache directory defaults to the ``EARTHIO_HTTP_CACHE`` environment
+variable (no persistent cache if unset).
+
+'''
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from collections import OrderedDict
+import errno
+import hashlib
+import io
+import logging
+import os
+import re
+import threading
+import time
+
+from six.moves.urllib.parse import urljoin
+
+__all__ = ['HTTPRangeFile', 'http_opener', 'is_remote', 'list_remote_tifs',
+           'rio_open']
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BLOCK_SIZE = 1 << 16
+MAX_MEMORY_BLOCKS = 256
+HTTP_TIMEOUT = 60
+STAT_TTL = 60.
+
+REMOTE_PREFIXES = ('http://', 'https://')
+
+_THREAD_LOCAL = threading.local()
+
+# url -> (time, size, validator)
+_STATS = OrderedDict()
+_STATS_LOCK = threading.Lock()
+MAX_CACHED_STATS = 4096
+
+
+def is_remote(path):
+    return path.lower().startswith(REMOTE_PREFIXES)
+
+
+def _cache_dir(cache_dir):
+    if cache_dir is None:
+        cache_dir = os.environ.get('EARTHIO_HTTP_CACHE')
+    return os.path.expanduser(cache_dir) if cache_dir else None
+
+
+def _session():
+    session = getattr(_THREAD_LOCAL, 'session', None)
+    if session is None:
+        import requests
+        session = _THREAD_LOCAL.session = requests.Session()
+    return session
+
+
+def _not_found(url, status):
+    return IOError(errno.ENOENT, 'HTTP {} for {}'.format(status, url))
+
+
+def _stat(url, session):
+    '''(size, validator) of url from a HEAD request (or a 1 byte range
+    request if HEAD is not allowed), cached for STAT_TTL seconds'''
+    now = time.time()
+    with _STATS_LOCK:
+        cached = _STATS.get(url)
+    if cached and now - cached[0] < STAT_TTL:
+        return cached[1:]
+    resp = session.head(url, allow_redirects=True, timeout=HTTP_TIMEOUT)
+    if resp.status_code in (404, 410):
+        raise _not_found(url, resp.status_code)
+    size = resp.headers.get('Content-Length') if resp.ok else None
+    headers = resp.headers
+    if size is None:
+        resp = session.get(url, headers={'Range': 'bytes=0-0'}, timeout=HTTP_TIMEOUT)
+        if resp.status_code in (404, 410):
+            raise _not_found(url, resp.status_code)
+        resp.raise_for_status()
+        headers = resp.headers
+        size = headers.get('Content-Range', '').rpartition('/')[-1]
+        if resp.status_code == 200 or not size.isdigit():
+            size = len(resp.content)
+    size = int(size)
+    validator = headers.get('ETag')
+    if not validator and headers.get('Last-Modified'):
+        validator = '{}:{}'.format(headers['Last-Modified'], size)
+    with _STATS_LOCK:
+        _STATS[url] = (now, size, validator)
+        while len(_STATS) > MAX_CACHED_STATS:
+            _STATS.popitem(last=False)
+    return size, validator
+
+
+class HTTPRangeFile(io.RawIOBase):
+    '''Read-only, seekable file object reading a URL with HTTP range
+    requests
+
+    Parameters:
+        :url:        http(s) URL
+        :block_size: bytes fetched (and cached) per block
+        :cache_dir:  directory of the persistent block cache (default:
+                     EARTHIO_HTTP_CACHE environment variable, else none)
+        :session:    requests.Session (default: one per thread)
+
+    Attributes ``bytes_fetched`` and ``n_requests`` count the bytes and
+    range requests sent for this file object.
+    '''
+    def __init__(self, url, block_size=DEFAULT_BLOCK_SIZE, cache_dir=None,
+                 session=None):
+        super(HTTPRangeFile, self).__init__()
+        self.url = url
+        self.block_size = int(block_size)
+        self.session = session or _session()
+        self.size, self.validator = _stat(url, self.session)
+        self.cache_dir = _cache_dir(cache_dir)
+        if self.cache_dir and self.validator:
+            key = '{}\0{}\0{}'.format(url, self.validator, self.block_size)
+            digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+            self._block_dir = os.path.join(self.cache_dir, digest[:2], digest)
+        else:
+            self._block_dir = None
+        self._blocks = OrderedDict()
+        self._pos = 0
+        self.bytes_fetched = self.n_requests = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError('Did not expect whence: {}'.format(whence))
+        if pos < 0:
+            raise ValueError('Negative seek position {}'.format(pos))
+        self._pos = pos
+        return pos
+
+    def _block_file(self, idx):
+        return os.path.join(self._block_dir, str(idx))
+
+    def _cached_block(self, idx):
+        data = self._blocks.pop(idx, None)
+        if data is not None:
+            self._blocks[idx] = data
+            return data
+        if self._block_dir:
+            try:
+                with open(self._block_file(idx), 'rb') as f:
+                    data = f.read()
+            except IOError:
+                return None
+            self._keep(idx, data)
+        return data
+
+    def _keep(self, idx, data):
+        self._blocks[idx] = data
+        while len(self._blocks) > MAX_MEMORY_BLOCKS:
+            self._blocks.popitem(last=False)
+
+    def _store(self, idx, data):
+        self._keep(idx, data)
+        if not self._block_dir:
+            return
+        try:
+            if not os.path.isdir(self._block_dir):
+                os.makedirs(self._block_dir)
+            tmp = '{}.{}.tmp'.format(self._block_file(idx), threading.current_thread().ident)
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            getattr(os, 'replace', os.rename)(tmp, self._block_file(idx))
+        except OSError as e:
+            logger.debug('Cannot cache block {} of {} ({})'.format(idx, self.url, repr(e)))
+
+    def _fetch(self, first, last):
+        '''Fetch blocks first to last (inclusive) in one request and
+        return them'''
+        start = first * self.block_size
+        end = min((last + 1) * self.block_size, self.size) - 1
+        resp = self.session.get(self.url, headers={'Range': 'bytes={}-{}'.format(start, end)},
+                                timeout=HTTP_TIMEOUT)
+        resp.raise_for_status()
+        data = resp.content
+        if resp.status_code != 206:
+            # range ignored: the whole file was sent
+            data = data[start:end + 1]
+        if len(data) != end + 1 - start:
+            raise IOError('Expected {} bytes from {} (range {}-{}), got {}'.format(end + 1 - start, self.url, start, end, len(data)))
+        self.n_requests += 1
+        self.bytes_fetched += len(data)
+        blocks = []
+        for idx in range(first, last + 1):
+            offset = (idx - first) * self.block_size
+            blocks.append(data[offset:offset + self.block_size])
+            self._store(idx, blocks[-1])
+        return blocks
+
+    def _blocks_for(self, first, last):
+        # blocks are kept here, not looked up again: a read of more than
+        # MAX_MEMORY_BLOCKS blocks evicts its own first blocks
+        blocks = {idx: self._cached_block(idx) for idx in range(first, last + 1)}
+        missing = [idx for idx in range(first, last + 1) if blocks[idx] is None]
+        # one request per run of contiguous missing blocks
+        runs = []
+        for idx in missing:
+            if runs and runs[-1][1] == idx - 1:
+                runs[-1][1] = idx
+            else:
+                runs.append([idx, idx])
+        for run_first, run_last in runs:
+            fetched = self._fetch(run_first, run_last)
+            blocks.update(zip(range(run_first, run_last + 1), fetched))
+        return [blocks[idx] for idx in range(first, last + 1)]
+
+    def readinto(self, b):
+        n = min(len(b), max(self.size - self._pos, 0))
+        if n <= 0:
+            return 0
+        first = self._pos // self.block_size
+        last = (self._pos + n - 1) // self.block_size
+        data = b''.join(self._blocks_for(first, last))
+        offset = self._pos - first * self.block_size
+        b[:n] = data[offset:offset + n]
+        self._pos += n
+        return n
+
+
+def http_opener(block_size=DEFAULT_BLOCK_SIZE, cache_dir=None):
+    '''rasterio opener (function of path, mode) returning an
+    HTTPRangeFile for remote paths'''
+    def opener(path, mode='rb'):
+        if 'r' not in mode:
+            raise ValueError('Remote files are read-only, got mode {}'.format(mode))
+        if not is_remote(path):
+            # rasterio checks the opener with a relative path
+            raise IOError(errno.ENOENT, 'Not an http(s) URL: {}'.format(path))
+        return HTTPRangeFile(path, block_size=block_size, cache_dir=cache_dir)
+    return opener
+
+
+def rio_open(path, block_size=DEFAULT_BLOCK_SIZE, cache_dir=None, **kwargs):
+    '''rasterio.open(path, **kwargs), reading remote (http / https)
+    paths with range requests
+
+    Parameters:
+        :path:       local path or http(s) URL
+        :block_size: see HTTPRangeFile
+        :cache_dir:  see HTTPRangeFile
+        :kwargs:     passed to rasterio.open
+    '''
+    import rasterio as rio
+    if not is_remote(path):
+        return rio.open(path, **kwargs)
+    try:
+        return rio.open(path, opener=http_opener(block_size=block_size,
+                                                 cache_dir=cache_dir), **kwargs)
+    except TypeError:
+        # rasterio < 1.4: no opener keyword
+        logger.debug('Reading {} with /vsicurl/ (rasterio < 1.4)'.format(path))
+        return rio.open('/vsicurl/' + path, **kwargs)
+
+
+def list_remote_tifs(url):
+    '''URLs of the GeoTiffs linked from a directory listing / index
+    page (e.g. a landsat-pds scene's index.html)'''
+    resp = _session().get(url, timeout=HTTP_TIMEOUT)
+    resp.raise_for_status()
+    names = set(re.findall(r'([\w.-]+\.tiff?)\b', resp.text, re.IGNORECASE))
+    return [urljoin(url, name) for name in sorted(names)]
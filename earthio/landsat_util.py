@@ -10,11 +10,208 @@ An example MTL file:
 
 Can be parsed with:
     landsat_metadata(filename)
+
+or, as nested groups and typed fields, with:
+    parse_mtl(filename)
+    parse_mtl_many(filenames, cache_file='mtl_cache.sqlite')
+
+The MTL rescaling coefficients convert band DNs to TOA radiance or
+reflectance with calibrate (see also the "calibration" option of
+earthio.load_dir_of_tifs_array).
 '''
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+from collections import OrderedDict
 from datetime import datetime
+import io
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+
+import numpy as np
+try:
+    import numba
+except ImportError:
+    numba = None
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['MTLRecord', 'band_number', 'calibrate', 'calibration_coefficients',
+           'landsat_metadata', 'parse_mtl', 'parse_mtl_many']
+
+MTL_CACHE_VERSION = 1
+
+
+def _mtl_value(key, value):
+    '''Quoted values and DATE / TIME fields as strings (without quotes),
+    others as floats when they parse as numbers'''
+    if value.startswith('"'):
+        return value.strip('"')
+    if 'DATE' in key or 'TIME' in key:
+        return value
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def _parse_mtl_text(text):
+    '''(nested OrderedDict of GROUPs and fields, OrderedDict of all
+    fields) of MTL text, in one pass over its "KEY = value" lines'''
+    root, fields = OrderedDict(), OrderedDict()
+    stack = [root]
+    group = root
+    for line in text.splitlines():
+        key, sep, value = line.partition('=')
+        if not sep:
+            continue
+        key = key.strip()
+        value = value.strip()
+        if key == 'GROUP':
+            group[value] = OrderedDict()
+            group = group[value]
+            stack.append(group)
+        elif key == 'END_GROUP':
+            if len(stack) > 1:
+                stack.pop()
+                group = stack[-1]
+        else:
+            group[key] = fields[key] = _mtl_value(key, value)
+    return root, fields
+
+
+def _flatten_groups(groups, fields=None):
+    fields = OrderedDict() if fields is None else fields
+    for key, value in groups.items():
+        if isinstance(value, dict):
+            _flatten_groups(value, fields)
+        else:
+            fields[key] = value
+    return fields
+
+
+class MTLRecord(object):
+    '''Parsed MTL file
+
+    Attributes:
+        :filepath: MTL file name
+        :groups:   nested OrderedDict of GROUPs and fields
+        :fields:   OrderedDict of all fields (without their groups)
+        :datetime: acquisition datetime (DATE_ACQUIRED and
+                   SCENE_CENTER_TIME, seconds truncated) or None
+
+    Fields are also attributes, e.g. record.SUN_ELEVATION.  Quoted
+    values are strings, DATE / TIME fields strings, other numbers floats.
+    '''
+    __slots__ = ('filepath', 'groups', 'fields', '_datetime')
+
+    def __init__(self, filepath, groups, fields=None):
+        self.filepath = filepath
+        self.groups = groups
+        self.fields = _flatten_groups(groups) if fields is None else fields
+        self._datetime = False
+
+    @property
+    def datetime(self):
+        if self._datetime is False:
+            self._datetime = None
+            date = self.fields.get('DATE_ACQUIRED')
+            time = self.fields.get('SCENE_CENTER_TIME')
+            if date and time:
+                try:
+                    self._datetime = datetime.strptime(date + time.split('.')[0],
+                                                       '%Y-%m-%d%H:%M:%S')
+                except ValueError:
+                    logger.debug('Cannot parse DATE_ACQUIRED / SCENE_CENTER_TIME in {}'.format(self.filepath))
+        return self._datetime
+
+    def __getattr__(self, name):
+        try:
+            return self.fields[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def get(self, name, default=None):
+        return self.fields.get(name, default)
+
+    def __repr__(self):
+        return 'MTLRecord({!r}, {} fields)'.format(self.filepath, len(self.fields))
+
+
+def parse_mtl(filename):
+    '''Parse a LANDSAT MTL file in one pass
+
+    Parameters:
+        :filename: MTL text file
+
+    Returns:
+        :record:   MTLRecord
+    '''
+    with io.open(filename, encoding='ascii', errors='replace') as f:
+        text = f.read()
+    return MTLRecord(filename, *_parse_mtl_text(text))
+
+
+def _open_mtl_cache(cache_file):
+    conn = sqlite3.connect(cache_file)
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    if version not in (0, MTL_CACHE_VERSION):
+        conn.execute('DROP TABLE IF EXISTS mtl')
+    with conn:
+        conn.execute('CREATE TABLE IF NOT EXISTS mtl (path TEXT PRIMARY KEY, '
+                     'mtime REAL, size INTEGER, groups TEXT)')
+        conn.execute('PRAGMA user_version = {}'.format(MTL_CACHE_VERSION))
+    return conn
+
+
+def parse_mtl_many(filenames, cache_file=None):
+    '''Parse many MTL files, reusing results cached in cache_file
+
+    Parameters:
+        :filenames:  MTL file names
+        :cache_file: SQLite file of parsed MTL groups (created if
+                     needed), keyed by file name, mtime and size.  None
+                     for no cache
+
+    Returns:
+        :records:    list of MTLRecord in filenames order
+    '''
+    filenames = list(filenames)
+    if not cache_file:
+        return [parse_mtl(filename) for filename in filenames]
+    conn = _open_mtl_cache(cache_file)
+    try:
+        cached = {}
+        query = 'SELECT path, mtime, size, groups FROM mtl WHERE path IN ({})'
+        for start in range(0, len(filenames), 500):
+            chunk = filenames[start:start + 500]
+            for path, mtime, size, groups in conn.execute(
+                    query.format(','.join('?' * len(chunk))), chunk):
+                cached[path] = (mtime, size, groups)
+        records, new_rows = [], []
+        for filename in filenames:
+            st = os.stat(filename)
+            entry = cached.get(filename)
+            if entry and entry[:2] == (st.st_mtime, st.st_size):
+                groups = json.loads(entry[2], object_pairs_hook=OrderedDict)
+                records.append(MTLRecord(filename, groups))
+                continue
+            record = parse_mtl(filename)
+            records.append(record)
+            new_rows.append((filename, st.st_mtime, st.st_size, json.dumps(record.groups)))
+        if new_rows:
+            with conn:
+                conn.executemany('INSERT OR REPLACE INTO mtl (path, mtime, size, groups) '
+                                 'VALUES (?, ?, ?, ?)', new_rows)
+        logger.debug('parse_mtl_many: parsed {} of {} files'.format(len(new_rows), len(filenames)))
+    finally:
+        conn.close()
+    return records
+
 
 class landsat_metadata:
     """
@@ -24,9 +221,10 @@ class landsat_metadata:
     will populate as an attribute of landsat_metadata.
     """
 
-    def __init__(self, filename):
+    def __init__(self, filename, record=None):
         """
-        Parse MTL file (filename)
+        Parse MTL file (filename), or take the fields of record
+        (MTLRecord of filename) if given
         """
 
         # custom attribute additions
@@ -58,43 +256,118 @@ class landsat_metadata:
         self.EARTH_SUN_DISTANCE = None    # calculated for Landsats before 8.
 
         # read the file and populate the MTL attributes
-        self._read(filename)
+        if record is None:
+            self._read(filename)
+        else:
+            self._set_fields(record)
 
     def _read(self, filename):
         """ reads the contents of an MTL file """
+        self._set_fields(parse_mtl(filename))
 
+    def _set_fields(self, record):
+        for field, value in record.fields.items():
+            setattr(self, field, value)
+        self.DATETIME_OBJ = record.datetime
 
-        fields = []
-        values = []
 
-        with open(filename, 'r') as metafile:
-            metadata = metafile.readlines()
+CALIBRATIONS = ('radiance', 'reflectance')
 
-        for line in metadata:
-            # skips lines that contain "bad flags" denoting useless data AND lines
-            # greater than 1000 characters. 1000 character limit works around an odd LC5
-            # issue where the metadata has 40,000+ characters of whitespace
-            bad_flags = ["END", "GROUP"]
-            if not any(x in line for x in bad_flags) and len(line) <= 1000:
-                try:
-                    line = line.replace("  ", "")
-                    line = line.replace("\n", "")
-                    field_name, field_value = line.split(' = ')
-                    fields.append(field_name)
-                    values.append(field_value)
-                except:
-                    pass
-
-        for i in range(len(fields)):
-
-            # format fields without quotes,dates, or times in them as floats
-            if not any(['"' in values[i], 'DATE' in fields[i], 'TIME' in fields[i]]):
-                setattr(self, fields[i], float(values[i]))
-            else:
-                values[i] = values[i].replace('"', '')
-                setattr(self, fields[i], values[i])
-
-        # create datetime_obj attribute (drop decimal seconds)
-        dto_string          = self.DATE_ACQUIRED + self.SCENE_CENTER_TIME
-        self.DATETIME_OBJ   = datetime.strptime(dto_string.split(".")[0], "%Y-%m-%d%H:%M:%S")
+CALIBRATE_CHUNK_SIZE = 1 << 20
+
+BAND_NUMBER = re.compile(r'_B(\d+)', re.IGNORECASE)
+
+
+def band_number(filename):
+    '''Band number of a Landsat GeoTiff name like "..._B4.TIF", or None'''
+    match = BAND_NUMBER.search(os.path.basename(filename))
+    return int(match.group(1)) if match else None
+
+
+def calibration_coefficients(mtl, band, calibration='reflectance'):
+    '''(gain, offset, calibration) converting DNs of band to
+    calibration with gain * DN + offset
+
+    Parameters:
+        :mtl:         landsat_metadata or MTLRecord
+        :band:        band number
+        :calibration: "radiance" or "reflectance" (TOA reflectance
+                      corrected for the sun elevation)
+
+    Bands without reflectance coefficients (thermal bands) are
+    calibrated to radiance, as the returned calibration says
+    '''
+    if calibration not in CALIBRATIONS:
+        raise ValueError('Expected calibration in {}, got {}'.format(CALIBRATIONS, calibration))
+    if calibration == 'reflectance':
+        mult = getattr(mtl, 'REFLECTANCE_MULT_BAND_{}'.format(band), None)
+        add = getattr(mtl, 'REFLECTANCE_ADD_BAND_{}'.format(band), None)
+        sun_elevation = getattr(mtl, 'SUN_ELEVATION', None)
+        if mult is not None and add is not None and sun_elevation is not None:
+            sin_elevation = math.sin(math.radians(sun_elevation))
+            return mult / sin_elevation, add / sin_elevation, 'reflectance'
+        logger.info('No reflectance coefficients for band {}: calibrating to radiance'.format(band))
+    mult = getattr(mtl, 'RADIANCE_MULT_BAND_{}'.format(band), None)
+    add = getattr(mtl, 'RADIANCE_ADD_BAND_{}'.format(band), None)
+    if mult is None or add is None:
+        raise ValueError('No radiance coefficients for band {} in {}'.format(band, getattr(mtl, 'FILEPATH', getattr(mtl, 'filepath', mtl))))
+    return mult, add, 'radiance'
+
+
+def _calibrate_kernel(src, dst, gain, offset, fill):
+    '''dst = gain * src + offset, NaN where src == fill'''
+    for i in range(src.size):
+        v = src[i]
+        if v == fill:
+            dst[i] = np.nan
+        else:
+            dst[i] = v * gain + offset
+
+if numba is not None:
+    _calibrate_kernel_jit = numba.njit(nogil=True)(_calibrate_kernel)
+else:
+    _calibrate_kernel_jit = None
+
+
+def _calibrate_numpy_chunked(src, dst, gain, offset, fill,
+                             chunk_size=CALIBRATE_CHUNK_SIZE):
+    '''Pure numpy version of _calibrate_kernel, working on chunks of
+    chunk_size elements'''
+    gain, offset = np.float32(gain), np.float32(offset)
+    for start in range(0, src.size, chunk_size):
+        s, d = src[start:start + chunk_size], dst[start:start + chunk_size]
+        # before d is written: src may be dst (in place)
+        is_fill = s == fill
+        np.multiply(s, gain, out=d)
+        d += offset
+        d[is_fill] = np.nan
+
+
+def calibrate(dn, gain, offset, fill=0, out=None):
+    '''float32 gain * dn + offset in one pass, NaN where dn == fill
+
+    Parameters:
+        :dn:     array of digital numbers
+        :gain:   scalar (see calibration_coefficients)
+        :offset: scalar
+        :fill:   DN of fill (no data) pixels, or None
+        :out:    C contiguous float32 array of dn's shape to write to,
+                 default: a new array.  May be dn itself (float32 DNs,
+                 e.g. read with rasterio into a float32 array) to
+                 calibrate in place
 
+    Returns:
+        :out:    float32 array
+    '''
+    src = np.ascontiguousarray(dn).reshape(-1)
+    if out is None:
+        out = np.empty(np.shape(dn), dtype=np.float32)
+    if out.dtype != np.float32 or not out.flags.c_contiguous or out.shape != np.shape(dn):
+        raise ValueError('Expected out to be a C contiguous float32 array of shape {}'.format(np.shape(dn)))
+    fill = np.nan if fill is None else fill
+    if _calibrate_kernel_jit is not None:
+        _calibrate_kernel_jit(src, out.reshape(-1), float(gain), float(offset), fill)
+    else:
+        _calibrate_numpy_chunked(src, out.reshape(-1), gain, offset, fill,
+                                 chunk_size=CALIBRATE_CHUNK_SIZE)
+    return out
@@ -0,0 +1,362 @@
+'''
+-------------------------
+
+``earthio.layer_sources``
+~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Picklable descriptors of the layers in a file (or TIF directory).
+A :class:`LayerSource` holds only paths, shape, dtype and geo_transform,
+so it can be sent to another process or machine where
+:func:`read_window` reopens the file and reads part of one layer.
+
+Values are decoded as :func:`earthio.load_layers` decodes them: NetCDF
+variables are masked and scaled (_FillValue / missing_value to NaN,
+scale_factor / add_offset applied) as with xr.open_dataset.
+
+'''
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from collections import namedtuple, OrderedDict
+from contextlib import contextmanager
+import logging
+import os
+import threading
+
+import numpy as np
+
+from earthio.http_range import is_remote, rio_open
+from earthio.load_layers import _find_file_type, _load_meta
+from earthio.metadata_selection import match_layers
+from earthio.netcdf import NETCDF_LOCK
+from earthio.util import (LayerSpec,
+                          VALID_X_NAMES,
+                          take_geo_transform_from_meta)
+
+__all__ = ['LayerSource', 'cached_layer_sources', 'layer_sources',
+           'open_layer', 'read_window', 'sources_bounds']
+
+logger = logging.getLogger(__name__)
+
+MAX_CACHED_SOURCES = 4096
+
+_SOURCES_CACHE = OrderedDict()
+_SOURCES_CACHE_LOCK = threading.Lock()
+
+LayerSource = namedtuple('LayerSource', ['name', 'filename', 'path',
+                                         'driver', 'variable',
+                                         'height', 'width', 'dtype',
+                                         'geo_transform', 'block_shape',
+                                         'x_first', 'nodata'])
+LayerSource.__doc__ = '''Descriptor of one layer:
+
+    - **name**: layer name (LayerSpec.name or "layer_N")
+    - **filename**: file or TIF directory the layer was found in
+    - **path**: what is opened to read it (TIF file or GDAL subdataset)
+    - **driver**: one of "rasterio", "gdal", "netcdf"
+    - **variable**: NetCDF variable name (driver "netcdf" only)
+    - **height**, **width**: number of y and x coordinates
+    - **dtype**: numpy dtype string of the (decoded) values read
+    - **geo_transform**: tuple of 6 floats
+    - **block_shape**: (rows, cols) of the storage blocks, in (y, x) order
+    - **x_first**: True if the array is stored with x as first dimension
+    - **nodata**: value of cells without data (GeoTiff / GDAL nodata),
+      or None (NetCDF fill values are decoded to NaN)
+'''
+
+
+def _layer_name(layer_spec):
+    return getattr(layer_spec, 'name', layer_spec)
+
+
+def _tif_sources(filename, meta):
+    sources = []
+    for (idx, path, layer_spec), layer_meta in zip(meta['layer_order_info'],
+                                                   meta['layer_meta']):
+        with rio_open(path) as r:
+            block_shape = tuple(r.block_shapes[0])
+            dtype = r.dtypes[0]
+            nodata = r.nodata
+        sources.append(LayerSource(_layer_name(layer_spec), filename, path,
+                                   'rasterio', None,
+                                   int(layer_meta['height']),
+                                   int(layer_meta['width']),
+                                   str(dtype),
+                                   tuple(map(float, layer_meta['geo_transform'])),
+                                   block_shape, False, nodata))
+    return sources
+
+
+def _gdal_layer_order_info(meta, layer_specs):
+    layer_order_info = []
+    if layer_specs:
+        matches = match_layers(meta['layer_meta'], layer_specs)
+        for idx, layer_meta, sd in zip(matches, meta['layer_meta'],
+                                       meta['sub_datasets']):
+            if idx is not None:
+                layer_order_info.append((idx, layer_meta, sd, layer_specs[idx]))
+    else:
+        for layer_idx, (layer_meta, sd) in enumerate(zip(meta['layer_meta'],
+                                                         meta['sub_datasets'])):
+            layer_order_info.append((layer_idx, layer_meta, sd,
+                                     'layer_{}'.format(layer_idx)))
+    if layer_specs and len(layer_order_info) != len(layer_specs):
+        raise ValueError('Number of layers matching layer_specs {} was not equal '
+                         'to the number of layer_specs {}'.format(len(layer_order_info), len(layer_specs)))
+    layer_order_info.sort(key=lambda x: x[0])
+    return layer_order_info
+
+
+def _gdal_sources(filename, meta, layer_specs):
+    import gdal
+    from gdalconst import GA_ReadOnly
+    from gdal_array import GDALTypeCodeToNumericTypeCode
+    sources = []
+    for _, layer_meta, sd, layer_spec in _gdal_layer_order_info(meta, layer_specs):
+        handle = gdal.Open(sd[0], GA_ReadOnly)
+        band = handle.GetRasterBand(1)
+        attrs = dict(meta)
+        attrs.update(layer_meta)
+        spec = layer_spec if isinstance(layer_spec, LayerSpec) else None
+        geo_transform = take_geo_transform_from_meta(spec, **attrs)
+        if geo_transform is None:
+            geo_transform = handle.GetGeoTransform()
+        stored_coords_order = getattr(spec, 'stored_coords_order', None) or ('y', 'x')
+        x_first = stored_coords_order[0] == 'x'
+        rows, cols = handle.RasterYSize, handle.RasterXSize
+        block_cols, block_rows = band.GetBlockSize()
+        if x_first:
+            rows, cols = cols, rows
+            block_rows, block_cols = block_cols, block_rows
+        dtype = np.dtype(GDALTypeCodeToNumericTypeCode(band.DataType))
+        sources.append(LayerSource(_layer_name(layer_spec), filename, sd[0],
+                                   'gdal', None, rows, cols, str(dtype),
+                                   tuple(map(float, geo_transform)),
+                                   (block_rows, block_cols), x_first,
+                                   band.GetNoDataValue()))
+        del band, handle
+    return sources
+
+
+def _netcdf_encoding(var):
+    '''(name, dimensions, attrs) of netCDF4 variable var, to decode its
+    reads with _decode_netcdf.  Call with NETCDF_LOCK held'''
+    return var.name, var.dimensions, {k: var.getncattr(k) for k in var.ncattrs()}
+
+
+def _decode_netcdf(encoding, arr):
+    '''arr read from a netCDF4 variable (auto mask and scale off) of
+    encoding (see _netcdf_encoding), masked and scaled as
+    xr.open_dataset does.  Makes no netCDF4 calls'''
+    import xarray as xr
+    name, dimensions, attrs = encoding
+    variable = xr.Variable(dimensions, arr, attrs)
+    return np.asarray(xr.conventions.decode_cf_variable(name, variable).values)
+
+
+def _netcdf_sources(filename, meta, layer_specs):
+    import netCDF4 as nc
+    if isinstance(layer_specs, dict):
+        layer_specs = list(layer_specs.values())
+    layer_spec = layer_specs[0] if layer_specs else None
+    geo_transform = take_geo_transform_from_meta(layer_spec=layer_spec,
+                                                 required=True,
+                                                 **meta)
+    if geo_transform is None:
+        raise ValueError('Could not find a geo_transform in metadata of {}'.format(filename))
+    names = [_layer_name(v) for v in layer_specs] if layer_specs else meta['variables']
+    sources = []
+    with NETCDF_LOCK, nc.Dataset(filename) as ds:
+        for name in names:
+            var = ds.variables[name]
+            if len(var.shape) != 2:
+                if layer_specs:
+                    raise ValueError('Expected 2 dimensional variable {}, got shape {}'.format(name, var.shape))
+                continue
+            rows, cols = var.shape
+            chunking = var.chunking()
+            if chunking == 'contiguous':
+                block_rows, block_cols = 1, cols
+            else:
+                block_rows, block_cols = chunking
+            x_first = var.dimensions[0].lower() in VALID_X_NAMES
+            if x_first:
+                rows, cols = cols, rows
+                block_rows, block_cols = block_cols, block_rows
+            dtype = _decode_netcdf(_netcdf_encoding(var),
+                                   np.zeros((1, 1), dtype=var.dtype)).dtype
+            sources.append(LayerSource(name, filename, filename, 'netcdf',
+                                       name, rows, cols, str(dtype),
+                                       tuple(map(float, geo_transform)),
+                                       (block_rows, block_cols), x_first, None))
+    return sources
+
+
+def layer_sources(filename, layer_specs=None, meta=None, reader=None):
+    '''Describe the layers of filename matching layer_specs
+    without reading their arrays
+
+    Parameters:
+        :filename:    filename (HDF4 / 5 or NetCDF) or directory name (TIF)
+        :layer_specs: list of strings or earthio.LayerSpec objects
+        :meta:        meta data from "filename" already loaded
+        :reader:      named reader from earthio - one of:  ('tif', 'hdf4', 'hdf5', 'netcdf')
+
+    Returns:
+        :sources:     list of LayerSource in layer_specs order
+    '''
+    ftype = reader or _find_file_type(filename)
+    if meta is None:
+        if ftype == 'tif':
+            meta = _load_meta(filename, ftype, layer_specs=layer_specs)
+        else:
+            meta = _load_meta(filename, ftype)
+    if ftype == 'tif':
+        return _tif_sources(filename, meta)
+    if ftype == 'netcdf':
+        return _netcdf_sources(filename, meta, layer_specs)
+    return _gdal_sources(filename, meta, layer_specs)
+
+
+def _layer_specs_key(layer_specs):
+    if layer_specs is None:
+        return None
+    if isinstance(layer_specs, dict):
+        layer_specs = list(layer_specs.values())
+    return tuple(repr(sorted(spec.get_params().items()))
+                 if hasattr(spec, 'get_params') else spec
+                 for spec in layer_specs)
+
+
+def _file_stat(filename):
+    '''(mtime, size) of filename, or of the files of a directory (latest
+    mtime, total size): a directory's own mtime does not change when a
+    file in it is rewritten in place'''
+    stat = os.stat(filename)
+    if not os.path.isdir(filename):
+        return stat.st_mtime, stat.st_size
+    mtime, size = stat.st_mtime, 0
+    for name in os.listdir(filename):
+        path = os.path.join(filename, name)
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            mtime = max(mtime, stat.st_mtime)
+            size += stat.st_size
+    return mtime, size
+
+
+def cached_layer_sources(filename, layer_specs=None, reader=None):
+    '''layer_sources(filename, ...), cached while the file's (or TIF
+    directory's files') mtime and size are unchanged.  Remote (http /
+    https) paths are not cached'''
+    if is_remote(filename):
+        return layer_sources(filename, layer_specs=layer_specs, reader=reader)
+    key = (filename,) + _file_stat(filename) + (reader, _layer_specs_key(layer_specs))
+    with _SOURCES_CACHE_LOCK:
+        sources = _SOURCES_CACHE.get(key)
+    if sources is None:
+        sources = layer_sources(filename, layer_specs=layer_specs, reader=reader)
+        with _SOURCES_CACHE_LOCK:
+            _SOURCES_CACHE[key] = sources
+            while len(_SOURCES_CACHE) > MAX_CACHED_SOURCES:
+                _SOURCES_CACHE.popitem(last=False)
+    return sources
+
+
+def sources_bounds(sources):
+    '''(left, bottom, right, top) covering the grids of sources'''
+    lefts, bottoms, rights, tops = [], [], [], []
+    for source in sources:
+        gt = source.geo_transform
+        xs = (gt[0], gt[0] + source.width * gt[1])
+        ys = (gt[3], gt[3] + source.height * gt[5])
+        lefts.append(min(xs))
+        rights.append(max(xs))
+        bottoms.append(min(ys))
+        tops.append(max(ys))
+    return min(lefts), min(bottoms), max(rights), max(tops)
+
+
+def _storage_window(source, window):
+    if window is None:
+        window = ((0, source.height), (0, source.width))
+    (r0, r1), (c0, c1) = window
+    if source.x_first:
+        return ((c0, c1), (r0, r1))
+    return ((r0, r1), (c0, c1))
+
+
+@contextmanager
+def open_layer(source):
+    '''Open the file of a layer once for many window reads
+
+    Parameters:
+        :source: LayerSource
+
+    Yields:
+        :read:   function of a window (see read_window) returning a 2-D
+                 np.ndarray with dims ("y", "x"), decoded as by load_layers
+
+    For driver "netcdf", NETCDF_LOCK is held while the file is opened,
+    read and closed (not between reads, so other NetCDF / xarray calls
+    can run inside the with block).
+    '''
+    if source.driver == 'rasterio':
+        with rio_open(source.path) as r:
+            yield lambda window: _read(source, window,
+                                       lambda w: r.read(1, window=w))
+    elif source.driver == 'gdal':
+        import gdal
+        from gdalconst import GA_ReadOnly
+        handle = gdal.Open(source.path, GA_ReadOnly)
+        band = handle.GetRasterBand(1)
+
+        def read(w):
+            (r0, r1), (c0, c1) = w
+            return band.ReadAsArray(int(c0), int(r0), int(c1 - c0), int(r1 - r0))
+        try:
+            yield lambda window: _read(source, window, read)
+        finally:
+            del band, handle
+    elif source.driver == 'netcdf':
+        import netCDF4 as nc
+        with NETCDF_LOCK:
+            ds = nc.Dataset(source.path)
+            var = ds.variables[source.variable]
+            var.set_auto_maskandscale(False)
+            # decoded outside the lock, from attributes read once here
+            encoding = _netcdf_encoding(var)
+
+        def read(w):
+            (r0, r1), (c0, c1) = w
+            with NETCDF_LOCK:
+                arr = var[r0:r1, c0:c1]
+            return _decode_netcdf(encoding, arr)
+        try:
+            yield lambda window: _read(source, window, read)
+        finally:
+            with NETCDF_LOCK:
+                ds.close()
+    else:
+        raise ValueError('Did not expect driver: {}'.format(source.driver))
+
+
+def _read(source, window, read):
+    arr = np.asarray(read(_storage_window(source, window)))
+    if source.x_first:
+        arr = arr.T
+    return arr
+
+
+def read_window(source, window=None):
+    '''Read a window of one layer, reopening the file
+
+    Parameters:
+        :source: LayerSource
+        :window: ((row_start, row_stop), (col_start, col_stop)) in
+                 (y, x) order.  Default: the whole layer
+
+    Returns:
+        :arr:    2-D np.ndarray with dims ("y", "x")
+    '''
+    with open_layer(source) as read:
+        return read(window)
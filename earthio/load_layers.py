@@ -16,6 +16,7 @@ import re
 from earthio.netcdf import load_netcdf_array, load_netcdf_meta
 from earthio.hdf4 import load_hdf4_array, load_hdf4_meta
 from earthio.hdf5 import load_hdf5_array, load_hdf5_meta
+from earthio.http_range import is_remote
 from earthio.tif import load_dir_of_tifs_meta,load_dir_of_tifs_array
 
 __all__ = ['load_layers', 'load_meta']
@@ -31,8 +32,10 @@ logger = logging.getLogger(__name__)
 
 def _find_file_type(filename):
     '''Guess file type on extension or "tif" if
-    filename is directory, default: netcdf'''
-    if os.path.isdir(filename):
+    filename is directory (or the URL of a directory listing /
+    index.html page), default: netcdf'''
+    if os.path.isdir(filename) or (is_remote(filename) and
+                                   re.search(r'(/|index\.html?)$', filename)):
         ftype = 'tif'
     else:
         this_ext = filename.split('.')[-1]
@@ -45,7 +48,8 @@ def _find_file_type(filename):
     return ftype
 
 
-def load_layers(filename, meta=None, layer_specs=None, reader=None):
+def load_layers(filename, meta=None, layer_specs=None, reader=None,
+                calibration=None, mtl=None):
     '''Create xr.Dataset from HDF4 / 5 or NetCDF files or TIF directories
 
     Parameters:
@@ -53,11 +57,18 @@ def load_layers(filename, meta=None, layer_specs=None, reader=None):
         :meta:       meta data from "filename" already loaded
         :layer_specs: list of strings or earthio.LayerSpec objects
         :reader:     named reader from earthio - one of:  ('tif', 'hdf4', 'hdf5', 'netcdf')
+        :calibration: Landsat TIF directories only: "radiance" or
+                     "reflectance" (see earthio.load_dir_of_tifs_array)
+        :mtl:        MTL file name, MTLRecord or landsat_metadata used
+                     with calibration (default: the "*_MTL.txt" file of
+                     the directory)
 
     Returns:
         :dset:         xr.Dataset with layers specified by layer_specs as xr.DataArray objects in "data_vars" attribute
     '''
     ftype = reader or _find_file_type(filename)
+    if (calibration is not None or mtl is not None) and ftype != 'tif':
+        raise ValueError('calibration is only supported for TIF directories, not {}'.format(ftype))
     if meta is None:
         if ftype == 'tif':
             meta = _load_meta(filename, ftype, layer_specs=layer_specs)
@@ -70,7 +81,8 @@ def load_layers(filename, meta=None, layer_specs=None, reader=None):
     elif ftype == 'hdf4':
         return load_hdf4_array(filename, meta, layer_specs=layer_specs)
     elif ftype == 'tif':
-        return load_dir_of_tifs_array(filename, meta, layer_specs=layer_specs)
+        return load_dir_of_tifs_array(filename, meta, layer_specs=layer_specs,
+                                      calibration=calibration, mtl=mtl)
     elif ftype == 'hdf':
         try:
             dset = load_hdf4_array(filename, meta, layer_specs=layer_specs)
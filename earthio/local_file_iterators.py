@@ -1,35 +1,455 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import glob
+import json
 import logging
 import os
 import re
+import time
+
+from earthio.filename_parsers import filename_filter
+from earthio.load_layers import load_layers
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 
 logger = logging.getLogger(__name__)
 
+__all__ = ['iter_dirs_of_dirs', 'iter_files_recursively', 'iter_load_layers',
+           'iter_new_files', 'watch_new_files']
+
+
+def _compile_pattern(file_pattern):
+    if not file_pattern:
+        return None
+    if hasattr(file_pattern, 'search'):
+        return file_pattern
+    return re.compile(file_pattern)
+
+
+def _scan_dir(root):
+    '''(subdirectories to walk, non-directory names, has a regular file)
+    of root, using the directory entry types from scandir where
+    available.  Like os.walk, symlinks to directories are not walked
+    and unreadable directories are skipped'''
+    dirs, files, has_file = [], [], False
+    try:
+        if scandir is not None:
+            for entry in scandir(root):
+                if entry.is_dir():
+                    if not entry.is_symlink():
+                        dirs.append(entry.name)
+                    continue
+                files.append(entry.name)
+                has_file = has_file or entry.is_file()
+        else:
+            for name in os.listdir(root):
+                path = os.path.join(root, name)
+                if os.path.isdir(path):
+                    if not os.path.islink(path):
+                        dirs.append(name)
+                    continue
+                files.append(name)
+                has_file = has_file or os.path.isfile(path)
+    except OSError as e:
+        logger.debug('Skipping {} ({})'.format(root, repr(e)))
+    return dirs, files, has_file
+
+
+def _subdirs(root, dirs, keep_dir):
+    paths = (os.path.join(root, d) for d in reversed(dirs))
+    if keep_dir is None:
+        return paths
+    return (path for path in paths if keep_dir(path))
+
+
+def _walk(top_dir, max_workers=None, keep_dir=None):
+    '''Yield (root, files, has_file) for top_dir and each directory
+    below it, in os.walk (top down) order.  With max_workers > 1,
+    subdirectories are scanned ahead in a thread pool.  Subdirectories
+    for which keep_dir(path) is False are not scanned'''
+    if not max_workers or max_workers < 2:
+        stack = [top_dir]
+        while stack:
+            root = stack.pop()
+            dirs, files, has_file = _scan_dir(root)
+            yield root, files, has_file
+            stack.extend(_subdirs(root, dirs, keep_dir))
+        return
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    # [path, future or None]: only the next max_in_flight directories to
+    # be walked (the top of the stack) are scanned ahead, so a wide tree
+    # does not queue a scan (and its results) for every directory.
+    # Scans left below the window by newly pushed subdirectories are
+    # kept, i.e. at most max_in_flight per level of the tree
+    max_in_flight = 2 * max_workers
+    stack = [[top_dir, None]]
+    try:
+        while stack:
+            # top (popped next) first, so it is always submitted
+            for entry in reversed(stack[-max_in_flight:]):
+                if entry[1] is None:
+                    entry[1] = executor.submit(_scan_dir, entry[0])
+            root, future = stack.pop()
+            dirs, files, has_file = future.result()
+            yield root, files, has_file
+            stack.extend([path, None] for path in _subdirs(root, dirs, keep_dir))
+    finally:
+        for _, future in stack:
+            if future is not None:
+                future.cancel()
+        executor.shutdown(wait=False)
+
+
+def _name_filters(kwargs):
+    '''(keep_file, keep_dir) of the time_range, tiles, filename_parser
+    and dir_parser kwargs (see earthio.filename_parsers.filename_filter)'''
+    filter_kw = {k: kwargs[k] for k in ('time_range', 'tiles', 'dir_parser')
+                 if kwargs.get(k) is not None}
+    if kwargs.get('filename_parser') is not None:
+        filter_kw['parser'] = kwargs['filename_parser']
+    return filename_filter(**filter_kw)
+
 
 def iter_dirs_of_dirs(**kwargs):
+    '''Iterate over directories under top_dir (and top_dir) that
+    contain files, at least one matching file_pattern if given
+
+    Parameters:
+        :top_dir:         directory to walk
+        :file_pattern:    regex (or compiled regex) file names must match
+        :max_workers:     threads scanning directories ahead (optional; helps
+                          on high latency file systems such as NFS)
+        :time_range:      (start, end) times parsed from file names must
+                          intersect (optional)
+        :tiles:           tiles parsed from file names must be in (optional)
+        :filename_parser: parser of file names' time and tile (see
+                          earthio.filename_parsers.filename_filter)
+        :dir_parser:      parser of date directories' time range (see
+                          earthio.filename_parsers.filename_filter)
+
+    With time_range or tiles, a directory is yielded when one of its
+    files matching file_pattern is selected by its parsed name, and
+    directories outside time_range or the tiles are not walked
+    '''
     top_dir = kwargs['top_dir']
     file_pattern = kwargs.get('file_pattern') or None
     logger.debug('Read {} from {}'.format(file_pattern, top_dir))
-    for root, dirs, files in os.walk(top_dir):
-        if any(os.path.isfile(os.path.join(root, f)) for f in files):
-            if (file_pattern and any(re.search(file_pattern, f) for f in files)) or not file_pattern:
-                yield root
+    pattern = _compile_pattern(file_pattern)
+    keep_file, keep_dir = _name_filters(kwargs)
+    for root, files, has_file in _walk(top_dir, kwargs.get('max_workers'), keep_dir):
+        if has_file:
+            if pattern:
+                files = (f for f in files if pattern.search(f))
+            if keep_file:
+                files = (f for f in files if keep_file(f))
+            if (pattern or keep_file) and not any(True for _ in files):
+                continue
+            yield root
 
 
 def iter_files_recursively(**kwargs):
+    '''Iterate over files under top_dir with names matching file_pattern
+
+    Parameters:
+        :top_dir:         directory to walk
+        :file_pattern:    regex (or compiled regex) file names must match
+        :max_workers:     threads scanning directories ahead (optional; helps
+                          on high latency file systems such as NFS)
+        :time_range:      (start, end) times parsed from file names must
+                          intersect (optional)
+        :tiles:           tiles parsed from file names must be in (optional)
+        :filename_parser: parser of file names' time and tile (see
+                          earthio.filename_parsers.filename_filter)
+        :dir_parser:      parser of date directories' time range (see
+                          earthio.filename_parsers.filename_filter)
+
+    With time_range or tiles, files whose names do not parse are
+    skipped, and directories outside time_range or the tiles (by
+    their date or parsed name) are not walked.  Files are selected
+    by name only; none is stat'ed or opened
+    '''
     file_pattern = kwargs.get('file_pattern') or None
     top_dir = kwargs['top_dir']
     logger.debug('Read {} from {}'.format(file_pattern, top_dir))
     if not top_dir or not os.path.exists(top_dir):
         raise ValueError('Expected top_dir ({}) to exist'.format(top_dir))
-    for root, dirs, files in os.walk(top_dir):
-        if files:
-            if file_pattern:
-                files = (f for f in files if re.search(file_pattern, f))
-            else:
-                files = iter(files)
-            for f in (os.path.join(root, f) for f in files):
-                yield f
+    pattern = _compile_pattern(file_pattern)
+    keep_file, keep_dir = _name_filters(kwargs)
+    for root, files, _ in _walk(top_dir, kwargs.get('max_workers'), keep_dir):
+        if pattern:
+            files = (f for f in files if pattern.search(f))
+        if keep_file:
+            files = (f for f in files if keep_file(f))
+        for f in files:
+            yield os.path.join(root, f)
+
+
+def iter_load_layers(top_dir, file_pattern=None, layer_specs=None,
+                     prefetch=2, reader=None):
+    '''Iterate over (filename, xr.Dataset) for files under top_dir,
+    reading the next "prefetch" datasets in background threads
+    while the current one is processed
+
+    Parameters:
+        :top_dir:      directory to walk
+        :file_pattern: regex filenames must match (optional)
+        :layer_specs:  list of strings or earthio.LayerSpec objects
+        :prefetch:     number of datasets to read ahead.  At most
+                       prefetch + 1 datasets are held in memory
+        :reader:       named reader from earthio - one of:  ('tif', 'hdf4', 'hdf5', 'netcdf').
+                       With "tif", directories of GeoTiffs are loaded
+
+    Yields:
+        :(filename, dset): in the order the files are walked
+    '''
+    kw = dict(top_dir=top_dir, file_pattern=file_pattern)
+    if reader == 'tif':
+        files = iter_dirs_of_dirs(**kw)
+    else:
+        files = iter_files_recursively(**kw)
+    prefetch = max(int(prefetch), 0)
+    executor = ThreadPoolExecutor(max_workers=max(prefetch, 1))
+    pending = deque()
+    def submit():
+        for filename in files:
+            pending.append((filename,
+                            executor.submit(load_layers, filename,
+                                            layer_specs=layer_specs,
+                                            reader=reader)))
+            return True
+        return False
+    try:
+        for _ in range(prefetch):
+            if not submit():
+                break
+        while pending or (not prefetch and submit()):
+            filename, future = pending.popleft()
+            if prefetch:
+                submit()
+            dset = future.result()
+            logger.debug('iter_load_layers: {}'.format(filename))
+            yield filename, dset
+            del dset
+    finally:
+        for _, future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+SCAN_STATE_VERSION = 1
+
+
+def _scan_dir_stats(root, pattern):
+    '''([subdirectory, ...], {file name: [mtime, size]}) of root, for
+    file names matching pattern'''
+    dirs, names, _ = _scan_dir(root)
+    files = {}
+    for name in names:
+        if pattern and not pattern.search(name):
+            continue
+        try:
+            st = os.stat(os.path.join(root, name))
+        except OSError:
+            continue
+        files[name] = [st.st_mtime, st.st_size]
+    return dirs, files
+
+
+def _load_scan_state(state_file, top_dir, file_pattern):
+    state = None
+    if state_file and os.path.exists(state_file):
+        with open(state_file) as f:
+            state = json.load(f)
+        if (state.get('version') != SCAN_STATE_VERSION or
+                state.get('top_dir') != top_dir or
+                state.get('file_pattern') != file_pattern):
+            logger.info('Scan state {} is for another top_dir / file_pattern. '
+                        'Scanning all files'.format(state_file))
+            state = None
+    if state is None:
+        state = {'version': SCAN_STATE_VERSION, 'top_dir': top_dir,
+                 'file_pattern': file_pattern, 'dirs': {}}
+    return state
+
+
+def _save_scan_state(state, state_file):
+    tmp = state_file + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    getattr(os, 'replace', os.rename)(tmp, state_file)
+
+
+def _drop_subtree(dirs_state, rel):
+    prefix = os.path.join(rel, '')
+    for key in [key for key in dirs_state if key == rel or key.startswith(prefix)]:
+        del dirs_state[key]
+
+
+def _iter_new_files(top_dir, state, pattern, check_modified):
+    dirs_state = state['dirs']
+    stack = [os.curdir]
+    while stack:
+        rel = stack.pop()
+        root = os.path.normpath(os.path.join(top_dir, rel))
+        try:
+            mtime = os.stat(root).st_mtime
+        except OSError:
+            _drop_subtree(dirs_state, rel)
+            continue
+        entry = dirs_state.get(rel)
+        if entry is None or entry['mtime'] != mtime:
+            # listing changed: stat the files, compare to what was seen
+            dirs, files = _scan_dir_stats(root, pattern)
+            old_files = entry['files'] if entry else {}
+            new = [name for name, st in files.items() if old_files.get(name) != st]
+            for name in set(entry['dirs'] if entry else ()) - set(dirs):
+                _drop_subtree(dirs_state, os.path.join(rel, name))
+        else:
+            # listing unchanged: only subdirectories are visited
+            dirs, files, new = entry['dirs'], entry['files'], []
+            if check_modified:
+                for name, st in list(files.items()):
+                    try:
+                        s = os.stat(os.path.join(root, name))
+                    except OSError:
+                        continue
+                    if [s.st_mtime, s.st_size] != st:
+                        files[name] = [s.st_mtime, s.st_size]
+                        new.append(name)
+        for name in sorted(new):
+            yield os.path.join(root, name)
+        # recorded after the new files were consumed, so files are
+        # yielded again if the iteration stops before
+        dirs_state[rel] = {'mtime': mtime, 'dirs': dirs, 'files': files}
+        stack.extend(os.path.normpath(os.path.join(rel, d)) for d in reversed(dirs))
+
+
+def iter_new_files(top_dir, state_file, file_pattern=None, check_modified=False):
+    '''Iterate over files under top_dir that are new (or modified)
+    since the last iteration with the same state_file
+
+    Parameters:
+        :top_dir:        directory to walk
+        :state_file:     JSON file of the scan state (directory mtimes and
+                         files seen), created / updated by the iteration
+        :file_pattern:   regex file names must match (optional)
+        :check_modified: if True, stat files of unchanged directories to
+                         find files modified in place.  Files replaced
+                         (written to a temporary name and renamed) are
+                         found either way
+
+    Yields:
+        :filename:       new or modified files
+
+    Directories whose mtime did not change are not listed again; only
+    their subdirectories are stat'ed.  The state is saved when the
+    iteration ends or the generator is closed; files of a directory are
+    recorded as seen once all of them were yielded.
+    '''
+    if not top_dir or not os.path.isdir(top_dir):
+        raise ValueError('Expected top_dir ({}) to exist'.format(top_dir))
+    if hasattr(file_pattern, 'pattern'):
+        file_pattern = file_pattern.pattern
+    state = _load_scan_state(state_file, top_dir, file_pattern)
+    pattern = _compile_pattern(file_pattern)
+    try:
+        for filename in _iter_new_files(top_dir, state, pattern, check_modified):
+            yield filename
+    finally:
+        _save_scan_state(state, state_file)
+
+
+def _inotify_watch(top_dir, pattern, stop, timeout):
+    from inotify_simple import INotify, flags
+    mask = flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE
+    inotify = INotify()
+    watches = {}
+
+    def add_watches(directory):
+        for root, _, _ in _walk(directory):
+            try:
+                watches[inotify.add_watch(root, mask)] = root
+            except OSError as e:
+                logger.debug('Cannot watch {} ({})'.format(root, repr(e)))
+    try:
+        add_watches(top_dir)
+        yield None
+        while stop is None or not stop.is_set():
+            for event in inotify.read(timeout=int(timeout * 1000)):
+                root = watches.get(event.wd)
+                if root is None or not event.name:
+                    continue
+                path = os.path.join(root, event.name)
+                if event.mask & flags.ISDIR:
+                    if event.mask & (flags.CREATE | flags.MOVED_TO):
+                        add_watches(path)
+                        for filename in iter_files_recursively(top_dir=path,
+                                                               file_pattern=pattern):
+                            yield filename
+                elif event.mask & (flags.CLOSE_WRITE | flags.MOVED_TO):
+                    if not pattern or pattern.search(event.name):
+                        yield path
+    finally:
+        inotify.close()
+
+
+def watch_new_files(top_dir, state_file, file_pattern=None, poll_interval=5.,
+                    stop=None, use_inotify=True):
+    '''Iterate over new files under top_dir as they appear
+
+    Parameters:
+        :top_dir:       directory to watch
+        :state_file:    JSON scan state file (see iter_new_files)
+        :file_pattern:  regex file names must match (optional)
+        :poll_interval: seconds between scans when polling, or between
+                        checks of stop when using inotify
+        :stop:          threading.Event ending the iteration when set
+        :use_inotify:   use inotify (Linux, needs the optional
+                        inotify_simple package) instead of polling
+                        with iter_new_files
+
+    Yields:
+        :filename:      files new since the last run with state_file,
+                        then files written or moved under top_dir
 
+    With inotify, a file is yielded once it is closed after writing
+    (or moved in), and the scan state is updated by a scan when the
+    iteration ends.  A file written during the first scan may be
+    yielded twice.
+    '''
+    try:
+        import inotify_simple
+    except ImportError:
+        inotify_simple = None
+    if use_inotify and inotify_simple is None:
+        logger.info('inotify_simple is not installed. Polling {} every {} s'.format(top_dir, poll_interval))
+        use_inotify = False
+    if use_inotify:
+        pattern = _compile_pattern(file_pattern)
+        watcher = _inotify_watch(top_dir, pattern, stop, poll_interval)
+        next(watcher)  # watches are set before the catch up scan
+        try:
+            for filename in iter_new_files(top_dir, state_file, file_pattern=file_pattern):
+                yield filename
+            for filename in watcher:
+                yield filename
+        finally:
+            watcher.close()
+            for _ in iter_new_files(top_dir, state_file, file_pattern=file_pattern):
+                pass
+        return
+    while True:
+        for filename in iter_new_files(top_dir, state_file, file_pattern=file_pattern):
+            yield filename
+        if stop is None:
+            time.sleep(poll_interval)
+        elif stop.wait(poll_interval):
+            return
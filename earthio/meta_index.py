@@ -0,0 +1,142 @@
+'''
+----------------------
+
+``earthio.meta_index``
+~~~~~~~~~~~~~~~~~~~~~~
+
+Index of the keys of a nested metadata dict, built in one walk, so that
+repeated key searches (valid range, missing value, grid header words)
+do not rescan the whole dict.
+
+'''
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import re
+
+from six import string_types
+
+from earthio.meta_parser import LazyMetaDict
+
+__all__ = ['MetaKeyIndex', 'normalize_key']
+
+KEY_DELIMITERS = re.compile(r'[\s._\-]+')
+
+MAX_CACHED_KEYS = 100000
+
+_NORMALIZED_KEYS = {}
+_COMPILED = {}
+_KEY_MATCHES = {}
+
+
+def normalize_key(key):
+    '''Lower-case key with delimiters (".", "_", "-", whitespace) removed.
+    Keys that are not strings are returned unchanged'''
+    if not isinstance(key, string_types):
+        return key
+    nkey = _NORMALIZED_KEYS.get(key)
+    if nkey is None:
+        if len(_NORMALIZED_KEYS) > MAX_CACHED_KEYS:
+            _NORMALIZED_KEYS.clear()
+        nkey = _NORMALIZED_KEYS[key] = KEY_DELIMITERS.sub('', key.lower())
+    return nkey
+
+
+def _compiled(pattern):
+    compiled = _COMPILED.get(pattern)
+    if compiled is None:
+        compiled = _COMPILED[pattern] = re.compile(pattern, re.IGNORECASE)
+    return compiled
+
+
+def _key_matches(patterns, nkey):
+    key = (patterns, nkey)
+    match = _KEY_MATCHES.get(key)
+    if match is None:
+        if len(_KEY_MATCHES) > MAX_CACHED_KEYS:
+            _KEY_MATCHES.clear()
+        match = _KEY_MATCHES[key] = any(_compiled(p).search(nkey)
+                                        for p in patterns)
+    return match
+
+
+def _meta_items(meta):
+    if isinstance(meta, LazyMetaDict):
+        return meta.index_items()
+    return meta.items()
+
+
+class MetaKeyIndex(object):
+    '''Index of a nested metadata dict
+
+    Parameters:
+        :meta: dict, possibly containing dicts
+
+    Each dict (the "container") found while walking meta is recorded
+    with its items as (key, normalized key, value, child) where child
+    is the index of the container for a dict value, else None.
+    Container 0 is meta.  A container's items are built the first time
+    a search reaches it, so a find that matches early does not walk (or
+    parse, for earthio.LazyMetaDict) the rest of meta.
+    '''
+    __slots__ = ('containers', '_found', '_metas')
+
+    def __init__(self, meta):
+        self.containers = []
+        self._metas = []
+        self._found = {}
+        self._add(meta, ())
+
+    def _add(self, meta, path):
+        self.containers.append((path, None))
+        self._metas.append(meta)
+        return len(self.containers) - 1
+
+    def _items(self, idx):
+        path, items = self.containers[idx]
+        if items is None:
+            items = []
+            for key, value in _meta_items(self._metas[idx]):
+                if isinstance(value, dict):
+                    child = self._add(value, path + (key,))
+                else:
+                    child = None
+                items.append((key, normalize_key(key), value, child))
+            self.containers[idx] = (path, items)
+            self._metas[idx] = None
+        return path, items
+
+    def _iter_items(self, idx=0):
+        path, items = self._items(idx)
+        for key, nkey, value, child in items:
+            if child is None:
+                yield path + (key,), nkey, value
+            else:
+                for item in self._iter_items(child):
+                    yield item
+
+    def find(self, patterns):
+        '''First (path, value) whose normalized key matches one of the
+        regex patterns, walking the dicts in their item order (depth
+        first).  Returns None if no key matches.  Results are cached
+        per tuple of patterns'''
+        patterns = tuple(patterns)
+        if patterns in self._found:
+            return self._found[patterns]
+        found = None
+        for path, nkey, value in self._iter_items():
+            if isinstance(nkey, string_types) and _key_matches(patterns, nkey):
+                found = (path, value)
+                break
+        self._found[patterns] = found
+        return found
+
+    def iter_containers_post_order(self, idx=0):
+        '''Yield (path, [(key, value), ...]) of each dict with its
+        non-dict items, the dicts nested in it first'''
+        path, items = self._items(idx)
+        for _, _, _, child in items:
+            if child is not None:
+                for container in self.iter_containers_post_order(child):
+                    yield container
+        yield path, [(key, value) for key, _, value, child in items
+                     if child is None]
@@ -0,0 +1,335 @@
+'''
+-----------------------
+
+``earthio.meta_parser``
+~~~~~~~~~~~~~~~~~~~~~~~
+
+Parsing of metadata strings found in HDF / NetCDF / GDAL metadata:
+
+    - ``key=value;`` sequences like ``"DOI=Realtime;\nDOIshortName=3IMERGHH;\n"``
+    - ODL blocks (``GROUP = ... END_GROUP = ...``) like HDF-EOS StructMetadata
+      (only with ``odl=True``: by default they are left as strings, as
+      earthio.load_meta always returned them)
+
+and :class:`LazyMetaDict`, a dict that parses its string values only
+when they are first accessed.
+
+'''
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from collections import OrderedDict
+try:
+    from collections.abc import Sequence
+except ImportError:
+    # Python 2.7
+    from collections import Sequence
+import copy
+import re
+
+from six import string_types
+
+__all__ = ['LazyMetaDict', 'iter_key_values', 'parse_odl',
+           'parse_meta_string', 'parse_meta_string_odl']
+
+_KEY_VALUE_RES = {}
+
+_ODL_GROUP = re.compile(r'^\s*(?:GROUP|OBJECT)\s*=', re.MULTILINE)
+_ODL_LINE = re.compile(r'^\s*([^=\s][^=]*?)\s*=\s*(.*?)\s*$')
+
+
+def _key_value_re(sep):
+    regex = _KEY_VALUE_RES.get(sep)
+    if regex is None:
+        regex = _KEY_VALUE_RES[sep] = re.compile(
+            r'\s*([^=]*?)\s*(?:=\s*(.*?)\s*)?(?:{}|\Z)'.format(re.escape(sep)),
+            re.DOTALL)
+    return regex
+
+
+def iter_key_values(s, sep=';', strict=False):
+    '''Tokenize "key=value<sep>key=value<sep>..." in one pass
+
+    Parameters:
+        :s:      string
+        :sep:    item separator
+        :strict: if True, skip items without exactly one "=", else
+                 yield (item, None) for an item without "="
+
+    Yields:
+        :(key, value): stripped strings
+    '''
+    for match in _key_value_re(sep).finditer(s):
+        key, value = match.groups()
+        if value is None:
+            if strict or not key:
+                continue
+        elif strict and '=' in value:
+            continue
+        yield key, value
+
+
+def _odl_value(value):
+    if len(value) > 1 and value[0] == value[-1] == '"':
+        return value[1:-1]
+    return value
+
+
+def parse_odl(s):
+    '''Parse an ODL string (as in HDF-EOS StructMetadata / CoreMetadata)
+    to nested dicts, in one pass over its lines.
+
+    GROUP / OBJECT blocks become dicts keyed by the block name.  Values
+    are strings with surrounding double quotes removed.  Values whose
+    parentheses are not closed on their first line continue on the
+    following lines.
+    '''
+    root = OrderedDict()
+    stack = [root]
+    key = value = None
+    for line in s.splitlines():
+        if key is not None:
+            value += line.strip()
+            if value.count('(') > value.count(')'):
+                continue
+            stack[-1][key] = _odl_value(value)
+            key = None
+            continue
+        match = _ODL_LINE.match(line)
+        if not match:
+            continue
+        name, value = match.groups()
+        upper = name.upper()
+        if upper in ('GROUP', 'OBJECT'):
+            group = stack[-1][_odl_value(value)] = OrderedDict()
+            stack.append(group)
+        elif upper in ('END_GROUP', 'END_OBJECT'):
+            if len(stack) > 1:
+                stack.pop()
+        elif value.count('(') > value.count(')'):
+            key = name
+        else:
+            stack[-1][name] = _odl_value(value)
+    if key is not None:
+        stack[-1][key] = _odl_value(value)
+    return root
+
+
+def parse_meta_string(s, odl=False):
+    '''Parse a metadata string
+
+    Returns:
+        - a dict for "key=value;" strings (value None for items without "=")
+        - nested dicts for ODL strings (see parse_odl) if odl is True
+        - s unchanged otherwise
+    '''
+    if ';' in s and '=' in s and s.index('=') < s.index(';'):
+        return dict(iter_key_values(s))
+    if odl and _ODL_GROUP.search(s) and ('END_GROUP' in s or 'END_OBJECT' in s):
+        return parse_odl(s)
+    return s
+
+
+def parse_meta_string_odl(s):
+    '''parse_meta_string(s, odl=True)'''
+    return parse_meta_string(s, odl=True)
+
+
+def _is_plain_dict(value):
+    return type(value) in (dict, OrderedDict)
+
+
+def lazy_meta_value(value, parse=parse_meta_string):
+    '''Value of a metadata dict as seen through a LazyMetaDict:
+    strings are parsed, dicts become LazyMetaDict and sequences lists'''
+    if isinstance(value, string_types):
+        return parse(value)
+    return lazy_meta(value, parse=parse)
+
+
+def lazy_meta(meta, parse=None):
+    '''Wrap dicts (recursively through sequences) as LazyMetaDict
+    parsing strings with parse (default: parse_meta_string).
+    Strings are returned unchanged'''
+    if isinstance(meta, LazyMetaDict):
+        return meta
+    if _is_plain_dict(meta):
+        return LazyMetaDict(meta, parse=parse)
+    if isinstance(meta, Sequence) and not isinstance(meta, string_types):
+        return [lazy_meta(item, parse=parse) for item in meta]
+    return meta
+
+
+class LazyMetaDict(dict):
+    '''dict of metadata whose values are converted on first access:
+
+        - strings are parsed with parse (default: parse_meta_string)
+        - dicts are wrapped as LazyMetaDict
+        - sequences become lists (of wrapped dicts)
+
+    Converted values replace the raw ones, so each is parsed at most once.
+    Values set after construction are stored as given.
+
+    :meth:`from_merged_strings` defers even the keys: the dict is the merge
+    of "key=value" strings, tokenized on the first read of the dict.
+    Setting a key does not tokenize them; values set before they are
+    tokenized override the merged ones.
+    '''
+    __slots__ = ('_unparsed', '_pending', '_parse')
+
+    def __init__(self, *args, **kwargs):
+        parse = kwargs.pop('parse', None)
+        dict.__init__(self, *args, **kwargs)
+        self._parse = parse or parse_meta_string
+        self._unparsed = set(dict.keys(self))
+        self._pending = []
+
+    @classmethod
+    def from_merged_strings(cls, strings, sep=';\n', parse=None):
+        '''LazyMetaDict of the "key=value<sep>" items of each of strings
+        (later strings override earlier ones).  Items without exactly
+        one "=" are dropped.  Nothing is tokenized until the dict is read'''
+        meta = cls(parse=parse)
+        meta._pending = [(s, sep) for s in strings
+                         if isinstance(s, string_types)]
+        return meta
+
+    def _load(self):
+        if self._pending:
+            pending, self._pending = self._pending, []
+            # set before loading: override the merged strings, keep last
+            explicit = [(key, dict.pop(self, key)) for key in list(dict.keys(self))]
+            explicit_keys = set(key for key, _ in explicit)
+            for s, sep in pending:
+                for key, value in iter_key_values(s, sep=sep, strict=True):
+                    if key not in explicit_keys:
+                        dict.__setitem__(self, key, value)
+                        self._unparsed.add(key)
+            for key, value in explicit:
+                dict.__setitem__(self, key, value)
+                self._unparsed.discard(key)
+
+    def _convert(self, key):
+        value = dict.__getitem__(self, key)
+        if key in self._unparsed:
+            value = lazy_meta_value(value, parse=self._parse)
+            dict.__setitem__(self, key, value)
+            self._unparsed.discard(key)
+        return value
+
+    def _convert_all(self):
+        self._load()
+        for key in list(self._unparsed):
+            self._convert(key)
+
+    def __getitem__(self, key):
+        self._load()
+        return self._convert(key)
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self._unparsed.discard(key)
+
+    def __delitem__(self, key):
+        self._load()
+        dict.__delitem__(self, key)
+        self._unparsed.discard(key)
+
+    def __iter__(self):
+        self._load()
+        return dict.__iter__(self)
+
+    def __len__(self):
+        self._load()
+        return dict.__len__(self)
+
+    def __contains__(self, key):
+        self._load()
+        return dict.__contains__(self, key)
+
+    def __eq__(self, other):
+        self._convert_all()
+        if isinstance(other, LazyMetaDict):
+            other._convert_all()
+        return dict.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    def keys(self):
+        self._load()
+        return dict.keys(self)
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def index_items(self):
+        '''(key, value) pairs for earthio.MetaKeyIndex: values that can
+        become dicts (dicts, sequences, strings with "=") are converted,
+        other strings are returned unparsed (parsing leaves them as is)'''
+        self._load()
+        items = []
+        for key in list(dict.keys(self)):
+            value = dict.__getitem__(self, key)
+            if (key in self._unparsed and isinstance(value, string_types)
+                    and '=' not in value):
+                items.append((key, value))
+            else:
+                items.append((key, self._convert(key)))
+        return items
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def pop(self, key, *default):
+        if key in self:
+            value = self[key]
+            del self[key]
+            return value
+        return dict.pop(self, key, *default)
+
+    def popitem(self):
+        self._load()
+        key = next(iter(self))
+        return key, self.pop(key)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def copy(self):
+        return copy.copy(self)
+
+    def __copy__(self):
+        new = type(self)(parse=self._parse)
+        for key, value in dict.items(self):
+            dict.__setitem__(new, key, value)
+        new._unparsed = set(self._unparsed)
+        new._pending = list(self._pending)
+        return new
+
+    def __deepcopy__(self, memo):
+        new = type(self)(parse=self._parse)
+        memo[id(self)] = new
+        for key, value in dict.items(self):
+            dict.__setitem__(new, key, copy.deepcopy(value, memo))
+        new._unparsed = set(self._unparsed)
+        new._pending = list(self._pending)
+        return new
+
+    def __reduce__(self):
+        return (LazyMetaDict, (dict(self.items()),))
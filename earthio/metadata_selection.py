@@ -25,6 +25,82 @@ def _strip_key(k):
             k = k.lower().replace(delim,'')
     return k
 
+MAX_CACHED_MATCHERS = 1024
+
+_MATCHERS = {}
+
+
+def _re_flags(flag_names):
+    flag_names = flag_names or []
+    if isinstance(flag_names, string_types):
+        flag_names = [flag_names]
+    flags = 0
+    for att in flag_names:
+        flag = getattr(re, att, None)
+        if isinstance(flag, int):
+            flags |= flag
+    return flags
+
+
+def _matcher_params(layer_spec):
+    key_re, value_re = (tuple(flags) if isinstance(flags, (list, tuple)) else flags
+                        for flags in (layer_spec.key_re_flags,
+                                      layer_spec.value_re_flags))
+    return (layer_spec.search_key or 'name',
+            layer_spec.search_value or '',
+            key_re, value_re)
+
+
+class LayerSpecMatcher(object):
+    '''Compiled search_key / search_value regexes of a LayerSpec
+
+    Parameters:
+        :search_key:     regex of metadata keys
+        :search_value:   regex of metadata values
+        :key_re_flags:   names of re flags (e.g. "IGNORECASE") for search_key
+        :value_re_flags: names of re flags for search_value
+    '''
+    __slots__ = ('key_re', 'value_re')
+
+    def __init__(self, search_key, search_value, key_re_flags=None,
+                 value_re_flags=None):
+        self.key_re = re.compile(search_key, _re_flags(key_re_flags))
+        self.value_re = re.compile(search_value, _re_flags(value_re_flags))
+
+    def match_key(self, key):
+        return isinstance(key, string_types) and bool(self.key_re.search(key))
+
+    def match_value(self, value):
+        return isinstance(value, string_types) and bool(self.value_re.search(value))
+
+    def match(self, meta):
+        '''True if a key of meta matches search_key and its value
+        matches search_value'''
+        return any(self.match_key(mkey) and self.match_value(meta[mkey])
+                   for mkey in meta)
+
+
+def layer_spec_matcher(layer_spec):
+    '''LayerSpecMatcher of layer_spec, cached on layer_spec (and shared
+    by LayerSpecs with the same search parameters)'''
+    if not isinstance(layer_spec, LayerSpec):
+        raise ValueError('layer_spec must be earthio.LayerSpec object')
+    params = _matcher_params(layer_spec)
+    cached = getattr(layer_spec, '_matcher', None)
+    if cached is not None and cached[0] == params:
+        return cached[1]
+    matcher = _MATCHERS.get(params)
+    if matcher is None:
+        if len(_MATCHERS) >= MAX_CACHED_MATCHERS:
+            _MATCHERS.clear()
+        matcher = _MATCHERS[params] = LayerSpecMatcher(*params)
+    try:
+        layer_spec._matcher = (params, matcher)
+    except AttributeError:
+        pass
+    return matcher
+
+
 def match_meta(meta, layer_spec):
     '''
     Parmeters:
@@ -35,24 +111,44 @@ def match_meta(meta, layer_spec):
         :boolean: of whether layer_spec matches meta
 
     '''
-    if not isinstance(layer_spec, LayerSpec):
-        raise ValueError('layer_spec must be earthio.LayerSpec object')
-    dir_re = dir(re)
-    search_key = layer_spec.search_key or 'name'
-    search_value = layer_spec.search_value or ''
-    for mkey in meta:
-        key_re = layer_spec.key_re_flags or []
-        if isinstance(key_re, string_types):
-            key_re = [key_re]
-        value_re = layer_spec.value_re_flags or []
-        if isinstance(value_re, string_types):
-            value_re = [value_re]
-        key_re_flags = [getattr(re, att) for att in key_re if att in dir_re]
-        value_re_flags = [getattr(re, att) for att in value_re if att in dir_re]
-        if bool(re.search(search_key, mkey, *key_re_flags)):
-            if bool(re.search(search_value, meta[mkey], *value_re_flags)):
-                return True
-    return False
+    return layer_spec_matcher(layer_spec).match(meta)
+
+
+def match_layers(layer_metas, layer_specs):
+    '''Match many layers' metadata to layer_specs in one pass
+
+    Parameters:
+        :layer_metas: list of layer meta dicts
+        :layer_specs: list of LayerSpec objects
+
+    Returns:
+        :matches:     list with, for each of layer_metas, the index of
+                      the first of layer_specs matching it (as in
+                      match_meta) or None
+
+    Each distinct metadata key is tested against the search_key of
+    every spec once; only values of keys matching a spec's search_key
+    are searched.
+    '''
+    matchers = [layer_spec_matcher(layer_spec) for layer_spec in layer_specs]
+    key_specs = {}
+    matches = []
+    for meta in layer_metas:
+        candidates = [[] for _ in matchers]
+        for mkey in meta:
+            spec_idxs = key_specs.get(mkey)
+            if spec_idxs is None:
+                spec_idxs = key_specs[mkey] = [idx for idx, matcher in enumerate(matchers)
+                                               if matcher.match_key(mkey)]
+            for idx in spec_idxs:
+                candidates[idx].append(mkey)
+        found = None
+        for idx, (matcher, keys) in enumerate(zip(matchers, candidates)):
+            if any(matcher.match_value(meta[mkey]) for mkey in keys):
+                found = idx
+                break
+        matches.append(found)
+    return matches
 
 
 def meta_is_day(attrs):
@@ -0,0 +1,226 @@
+'''
+------------------
+
+``earthio.mosaic``
+~~~~~~~~~~~~~~~~~~
+
+Mosaic many tiles (files or TIF directories) onto one grid.
+
+Tiles are placed one at a time into a preallocated (optionally memory
+mapped) output, so peak memory is the output plus one tile window per
+worker thread.  Placement is computed from the tiles' cached
+:class:`earthio.LayerSource` descriptors (geo_transform and shape).
+
+'''
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import math
+import numbers
+
+import numpy as np
+import xarray as xr
+
+from earthio.layer_sources import cached_layer_sources, read_window
+from earthio.util import (geotransform_to_bounds,
+                          geotransform_to_coords,
+                          layers_to_dataset)
+
+__all__ = ['mosaic']
+
+logger = logging.getLogger(__name__)
+
+MOSAIC_METHODS = ('first', 'mean', 'max')
+
+
+def _target_grid(target_bounds, resolution):
+    left, bottom, right, top = target_bounds
+    left, right = min(left, right), max(left, right)
+    bottom, top = min(bottom, top), max(bottom, top)
+    if isinstance(resolution, numbers.Number):
+        resolution = (resolution, resolution)
+    xres, yres = map(abs, map(float, resolution))
+    width = int(math.ceil((right - left) / xres))
+    height = int(math.ceil((top - bottom) / yres))
+    if width < 1 or height < 1:
+        raise ValueError('Expected target_bounds larger than resolution, got {} {}'.format(target_bounds, resolution))
+    return (float(left), xres, 0., float(top), 0., -yres), height, width
+
+
+def _axis_placement(t_origin, t_step, t_size, s_origin, s_step, s_size):
+    '''Target index range [start, stop) whose cell centers fall in the
+    source axis, and the source index of each of those cells'''
+    centers = t_origin + (np.arange(t_size) + .5) * t_step
+    src = np.floor((centers - s_origin) / s_step)
+    idx = np.flatnonzero((src >= 0) & (src < s_size))
+    if not idx.size:
+        return None
+    return idx[0], idx[-1] + 1, src[idx].astype(np.int64)
+
+
+def _placement(source, geo_transform, height, width):
+    '''((row_start, row_stop), (col_start, col_stop)) in the target grid
+    and source rows / cols sampled for it, or None if source is outside'''
+    gt, sgt = geo_transform, source.geo_transform
+    cols = _axis_placement(gt[0], gt[1], width, sgt[0], sgt[1], source.width)
+    rows = _axis_placement(gt[3], gt[5], height, sgt[3], sgt[5], source.height)
+    if cols is None or rows is None:
+        return None
+    return (rows[:2], cols[:2]), rows[2], cols[2]
+
+
+def _overlaps(a, b):
+    (a_layer, (ar, ac)), (b_layer, (br, bc)) = a, b
+    return (a_layer == b_layer and ar[0] < br[1] and br[0] < ar[1] and
+            ac[0] < bc[1] and bc[0] < ac[1])
+
+
+def _waves(windows):
+    '''Group indices of (layer index, target window) in waves without
+    overlaps.  A window is put after the last wave with a window it
+    overlaps, so overlapping tiles are placed in their original order'''
+    waves = []
+    for idx, window in enumerate(windows):
+        wave = 0
+        for w, members in enumerate(waves):
+            if any(_overlaps(window, windows[other]) for other in members):
+                wave = w + 1
+        if wave == len(waves):
+            waves.append([])
+        waves[wave].append(idx)
+    return waves
+
+
+def _place(out, count, layer_idx, source, placement, method, nodata=None):
+    (r0, r1), (c0, c1) = placement[0]
+    src_rows, src_cols = placement[1], placement[2]
+    # source rows descend for south-up tiles (positive y step)
+    row0, col0 = src_rows.min(), src_cols.min()
+    arr = read_window(source, ((row0, src_rows.max() + 1),
+                               (col0, src_cols.max() + 1)))
+    raw = arr[np.ix_(src_rows - row0, src_cols - col0)]
+    # NaN marks cells without data: they never win or count
+    arr = raw.astype(out.dtype)
+    if nodata is None:
+        nodata = source.nodata
+    if nodata is not None and not np.isnan(nodata):
+        arr[raw == nodata] = np.nan
+    target = out[layer_idx, r0:r1, c0:c1]
+    if method == 'first':
+        empty = np.isnan(target)
+        target[empty] = arr[empty]
+    elif method == 'max':
+        np.fmax(target, arr, out=target)
+    else:
+        valid = ~np.isnan(arr)
+        target[valid] += arr[valid]
+        count[layer_idx, r0:r1, c0:c1][valid] += 1
+
+
+def mosaic(files, target_bounds, resolution, layer_specs=None, method='first',
+           reader=None, out_file=None, max_workers=None, nodata=None):
+    '''Mosaic the layers of many tiles onto one grid
+
+    Parameters:
+        :files:         list of filenames (HDF4 / 5 or NetCDF) or TIF directories
+        :target_bounds: (left, bottom, right, top) of the output grid
+        :resolution:    cell size, or (x size, y size), in the tiles' CRS
+        :layer_specs:   list of strings or earthio.LayerSpec objects
+        :method:        how overlapping tiles combine - one of:
+
+                          - "first": the first tile (in files order) with data
+                          - "mean": mean of the tiles with data
+                          - "max": max of the tiles with data
+        :reader:        named reader from earthio - one of:  ('tif', 'hdf4', 'hdf5', 'netcdf')
+        :out_file:      path of a .npy file to memory map the output to
+                        (shape (layers, y, x)), or None to keep it in memory
+        :max_workers:   threads placing non-overlapping tiles in parallel.
+                        Default: place one tile at a time
+        :nodata:        value of tile cells without data, for tiles whose
+                        files do not set one (e.g. 0 for Landsat).
+                        Default: each tile's nodata (LayerSource.nodata)
+
+    Returns:
+        :dset:          xr.Dataset with one (y, x) layer per layer spec,
+                        NaN where no tile has data
+
+    Tiles must share the CRS of the output.  Each output cell takes the
+    tile cell containing its center (nearest neighbor), so tiles at a
+    different resolution are resampled while they are placed.  Tile cells
+    equal to nodata, and NaN (e.g. NetCDF _FillValue, decoded), are not
+    data: they are skipped by every method.
+    '''
+    if method not in MOSAIC_METHODS:
+        raise ValueError('Expected method in {}, got {}'.format(MOSAIC_METHODS, method))
+    geo_transform, height, width = _target_grid(target_bounds, resolution)
+    files = list(files)
+    sources = [cached_layer_sources(filename, layer_specs=layer_specs, reader=reader)
+               for filename in files]
+    if not sources:
+        raise ValueError('Expected at least one file')
+    names = [source.name for source in sources[0]]
+    dtype = np.result_type(np.float32, *(source.dtype for file_sources in sources
+                                         for source in file_sources))
+    shape = (len(names), height, width)
+    if out_file:
+        out = np.lib.format.open_memmap(out_file, mode='w+', dtype=dtype, shape=shape)
+    else:
+        out = np.empty(shape, dtype=dtype)
+    count = None
+    if method == 'mean':
+        out[...] = 0
+        count = np.zeros(shape, dtype=np.int32)
+    else:
+        out[...] = np.nan
+    tasks = []
+    placements = {}
+    for filename, file_sources in zip(files, sources):
+        by_name = {source.name: source for source in file_sources}
+        if set(by_name) != set(names):
+            raise ValueError('Expected layers {} in {}, got {}'.format(names, filename, list(by_name)))
+        for layer_idx, name in enumerate(names):
+            source = by_name[name]
+            key = (source.geo_transform, source.height, source.width)
+            if key not in placements:
+                placements[key] = _placement(source, geo_transform, height, width)
+            if placements[key] is None:
+                logger.debug('mosaic: {} {} is outside target_bounds'.format(filename, name))
+                continue
+            tasks.append((layer_idx, source, placements[key]))
+    if max_workers and max_workers > 1:
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            for wave in _waves([(layer_idx, p[0]) for layer_idx, _, p in tasks]):
+                futures = [executor.submit(_place, out, count, tasks[idx][0],
+                                           tasks[idx][1], tasks[idx][2], method,
+                                           nodata)
+                           for idx in wave]
+                for future in futures:
+                    future.result()
+        finally:
+            executor.shutdown(wait=True)
+    else:
+        for layer_idx, source, placement in tasks:
+            _place(out, count, layer_idx, source, placement, method, nodata)
+    if method == 'mean':
+        with np.errstate(invalid='ignore', divide='ignore'):
+            np.divide(out, count, out=out)
+        out[count == 0] = np.nan
+        del count
+    coords_x, coords_y = geotransform_to_coords(width, height, geo_transform)
+    bounds = geotransform_to_bounds(width, height, geo_transform)
+    data = OrderedDict()
+    for layer_idx, name in enumerate(names):
+        data[name] = xr.DataArray(out[layer_idx],
+                                  coords=[('y', coords_y), ('x', coords_x)],
+                                  dims=('y', 'x'),
+                                  attrs=dict(geo_transform=np.array(geo_transform),
+                                             buf_xsize=width,
+                                             buf_ysize=height,
+                                             dims=('y', 'x'),
+                                             bounds=bounds,
+                                             files=files))
+    return layers_to_dataset(data, attrs={'layer_order': names,
+                                          'mosaic_method': method})
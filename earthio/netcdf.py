@@ -15,6 +15,7 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 from collections import OrderedDict
 import logging
+import threading
 
 from affine import Affine
 import netCDF4 as nc
@@ -25,27 +26,37 @@ from earthio.util import (geotransform_to_bounds,
                           take_geo_transform_from_meta,
                           meta_strings_to_dict)
 from earthio.metadata_selection import match_meta
+from earthio.meta_parser import (iter_key_values,
+                                 LazyMetaDict,
+                                 parse_meta_string)
 from six import string_types
 
 __all__ = ['load_netcdf_meta', 'load_netcdf_array']
 
 logger = logging.getLogger(__name__)
 
+# netCDF4 / HDF5 C libraries are not thread safe.  Share xarray's lock
+# so reads through netCDF4 and through xr.open_dataset are serialized
+try:
+    from xarray.backends.locks import HDF5_LOCK as NETCDF_LOCK
+except ImportError:
+    NETCDF_LOCK = threading.Lock()
+
 
 def _nc_str_to_dict(nc_str):
     if isinstance(nc_str, string_types):
-        str_list = [g.split('=') for g in nc_str.split(';\n')]
-        d = dict([g for g in str_list if len(g) == 2])
+        d = dict(iter_key_values(nc_str, sep=';\n', strict=True))
         if d:
             return d
-        return nc_str
+        return parse_meta_string(nc_str)
     return nc_str
 
 
 def _get_nc_attrs(nc_dataset):
-
-    return {k: _nc_str_to_dict(nc_dataset.getncattr(k))
-            for k in nc_dataset.ncattrs()}
+    '''Attributes of nc_dataset, with strings parsed on first access'''
+    return LazyMetaDict(((k, nc_dataset.getncattr(k))
+                         for k in nc_dataset.ncattrs()),
+                        parse=_nc_str_to_dict)
 
 
 def _get_subdatasets(nc_dataset):
@@ -92,14 +103,14 @@ def load_netcdf_meta(datafile):
     Returns:
         :meta: Dictionary of metadata
     '''
-    ras = nc.Dataset(datafile)
-    attrs = _get_nc_attrs(ras)
-    sds = _get_subdatasets(ras)
-    meta = {'meta': attrs,
-            'layer_meta': sds,
-            'name': datafile,
-            'variables': list(ras.variables.keys()),
-            }
+    with NETCDF_LOCK, nc.Dataset(datafile) as ras:
+        attrs = _get_nc_attrs(ras)
+        sds = _get_subdatasets(ras)
+        meta = {'meta': attrs,
+                'layer_meta': sds,
+                'name': datafile,
+                'variables': list(ras.variables.keys()),
+                }
     return meta_strings_to_dict(meta)
 
 
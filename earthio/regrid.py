@@ -0,0 +1,239 @@
+'''
+------------------
+
+``earthio.regrid``
+~~~~~~~~~~~~~~~~~~
+
+Put the layers of an xr.Dataset on a target grid (and CRS).
+
+The interpolation from a source grid to a target grid is a sparse
+(target cells x source cells) weights matrix.  It depends only on the
+geometry of the two grids, so it is built once, cached, and applied to
+all layers (and all later Datasets on the same grid) as one sparse
+matrix product.
+
+'''
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from collections import namedtuple, OrderedDict
+import logging
+import threading
+
+import numpy as np
+import xarray as xr
+
+from earthio.util import (VALID_X_NAMES,
+                          geotransform_to_bounds,
+                          geotransform_to_coords,
+                          layers_to_dataset)
+
+__all__ = ['TargetGrid', 'regrid', 'regrid_weights']
+
+logger = logging.getLogger(__name__)
+
+REGRID_METHODS = ('nearest', 'bilinear')
+
+MAX_CACHED_WEIGHTS = 32
+
+_WEIGHTS_CACHE = OrderedDict()
+_WEIGHTS_CACHE_LOCK = threading.Lock()
+
+TargetGrid = namedtuple('TargetGrid', ['geo_transform', 'height', 'width', 'crs'])
+TargetGrid.__new__.__defaults__ = (None,)
+TargetGrid.__doc__ = '''Grid to regrid to:
+
+    - **geo_transform**: tuple of 6 floats
+    - **height**, **width**: number of y and x coordinates
+    - **crs**: CRS of the grid (anything pyproj.CRS.from_user_input
+      accepts), or None for the CRS of the source
+'''
+
+
+def _crs_key(crs):
+    if crs is None:
+        return None
+    if hasattr(crs, 'to_wkt'):
+        return crs.to_wkt()
+    return str(crs)
+
+
+def _layer_crs(attrs):
+    crs = attrs.get('crs')
+    if crs is None and isinstance(attrs.get('meta'), dict):
+        crs = attrs['meta'].get('crs')
+    return crs
+
+
+def _grid_tuple(geo_transform):
+    return tuple(float(v) for v in geo_transform)
+
+
+def _target_cell_centers(target):
+    gt = target.geo_transform
+    x = gt[0] + (np.arange(target.width) + .5) * gt[1]
+    y = gt[3] + (np.arange(target.height) + .5) * gt[5]
+    return np.meshgrid(x, y)
+
+
+def _to_source_crs(x, y, src_crs, dst_crs):
+    if src_crs is None or dst_crs is None or _crs_key(src_crs) == _crs_key(dst_crs):
+        return x, y
+    from pyproj import CRS, Transformer
+    transformer = Transformer.from_crs(CRS.from_user_input(_crs_key(dst_crs)),
+                                       CRS.from_user_input(_crs_key(src_crs)),
+                                       always_xy=True)
+    return transformer.transform(x, y)
+
+
+def _build_weights(src_geo_transform, src_shape, target, method, src_crs):
+    from scipy import sparse
+    height, width = src_shape
+    x, y = _target_cell_centers(target)
+    x, y = _to_source_crs(x.ravel(), y.ravel(), src_crs, target.crs)
+    gt = src_geo_transform
+    # fractional (col, row) of target cell centers, 0 at the center of
+    # the first source cell
+    fcol = (np.asarray(x) - gt[0]) / gt[1] - .5
+    frow = (np.asarray(y) - gt[3]) / gt[5] - .5
+    inside = (fcol > -.5) & (fcol < width - .5) & (frow > -.5) & (frow < height - .5)
+    target_idx = np.flatnonzero(inside)
+    fcol, frow = fcol[inside], frow[inside]
+    if method == 'nearest':
+        rows = np.clip(np.round(frow), 0, height - 1).astype(np.int64)
+        cols = np.clip(np.round(fcol), 0, width - 1).astype(np.int64)
+        targets = target_idx
+        sources = rows * width + cols
+        weights = np.ones(target_idx.size)
+    else:
+        r0, c0 = np.floor(frow), np.floor(fcol)
+        dr, dc = frow - r0, fcol - c0
+        targets, sources, weights = [], [], []
+        for row_offset, row_weight in ((0, 1 - dr), (1, dr)):
+            for col_offset, col_weight in ((0, 1 - dc), (1, dc)):
+                rows = np.clip(r0 + row_offset, 0, height - 1).astype(np.int64)
+                cols = np.clip(c0 + col_offset, 0, width - 1).astype(np.int64)
+                targets.append(target_idx)
+                sources.append(rows * width + cols)
+                weights.append(row_weight * col_weight)
+        targets, sources, weights = map(np.concatenate, (targets, sources, weights))
+    n_target = target.height * target.width
+    matrix = sparse.csr_matrix((weights, (targets, sources)),
+                               shape=(n_target, height * width))
+    covered = np.zeros(n_target, dtype=np.bool_)
+    covered[target_idx] = True
+    return matrix, covered
+
+
+def regrid_weights(src_geo_transform, src_shape, target, method='nearest',
+                   src_crs=None):
+    '''Sparse weights from a source grid to target, cached by
+    (source geo_transform and shape, target, method, CRSs)
+
+    Parameters:
+        :src_geo_transform: geo_transform of the source grid
+        :src_shape:         (height, width) of the source grid
+        :target:            TargetGrid
+        :method:            one of REGRID_METHODS
+        :src_crs:           CRS of the source grid, or None for target.crs
+
+    Returns:
+        :matrix:            scipy.sparse.csr_matrix (target cells x source cells),
+                            cells in C order of (y, x)
+        :covered:           bool array, False for target cells outside the source
+    '''
+    if method not in REGRID_METHODS:
+        raise ValueError('Expected method in {}, got {}'.format(REGRID_METHODS, method))
+    target = TargetGrid(_grid_tuple(target.geo_transform), int(target.height),
+                        int(target.width), target.crs)
+    key = (_grid_tuple(src_geo_transform), tuple(int(s) for s in src_shape),
+           target[:3], method, _crs_key(src_crs), _crs_key(target.crs))
+    with _WEIGHTS_CACHE_LOCK:
+        weights = _WEIGHTS_CACHE.get(key)
+    if weights is None:
+        weights = _build_weights(key[0], key[1], target, method, src_crs)
+        with _WEIGHTS_CACHE_LOCK:
+            _WEIGHTS_CACHE[key] = weights
+            while len(_WEIGHTS_CACHE) > MAX_CACHED_WEIGHTS:
+                _WEIGHTS_CACHE.popitem(last=False)
+    return weights
+
+
+def _as_target_grid(target_grid):
+    if isinstance(target_grid, TargetGrid):
+        return target_grid
+    if isinstance(target_grid, xr.Dataset):
+        target_grid = target_grid[target_grid.attrs.get('layer_order', list(target_grid.data_vars))[0]]
+    if isinstance(target_grid, xr.DataArray):
+        attrs = target_grid.attrs
+        return TargetGrid(attrs['geo_transform'], attrs['buf_ysize'],
+                          attrs['buf_xsize'], _layer_crs(attrs))
+    return TargetGrid(*target_grid)
+
+
+def _yx_values(arr):
+    if arr.ndim != 2:
+        raise ValueError('Expected 2 dimensional layers, got {} with dims {}'.format(arr.name, arr.dims))
+    if arr.dims[0].lower() in VALID_X_NAMES:
+        return arr.values.T
+    return arr.values
+
+
+def regrid(dset, target_grid, method='nearest'):
+    '''Regrid the layers of dset to target_grid
+
+    Parameters:
+        :dset:        xr.Dataset of 2-D layers from earthio readers
+                      (with geo_transform attrs)
+        :target_grid: TargetGrid, (geo_transform, height, width[, crs]),
+                      or an xr.Dataset / xr.DataArray on the target grid
+        :method:      "nearest" or "bilinear"
+
+    Returns:
+        :dset:        xr.Dataset on target_grid, dims ("y", "x").
+                      Target cells outside the source grid are NaN
+
+    Layers on the same grid are stacked and regridded with one sparse
+    matrix product.  A layer's CRS is taken from its "crs" attr (or
+    "meta" / "crs" for TIFs); when both it and target_grid.crs are
+    given and differ, pyproj transforms the target cell centers.
+    NaN in a source cell propagates to the target cells it weights.
+    '''
+    target = _as_target_grid(target_grid)
+    names = dset.attrs.get('layer_order', list(dset.data_vars))
+    groups = OrderedDict()
+    for name in names:
+        arr = dset[name]
+        if 'geo_transform' not in arr.attrs:
+            raise ValueError('Expected geo_transform in attrs of layer {}'.format(name))
+        values = _yx_values(arr)
+        crs = _layer_crs(arr.attrs)
+        key = (_grid_tuple(arr.attrs['geo_transform']), values.shape, _crs_key(crs))
+        groups.setdefault(key, (crs, []))[1].append((name, values))
+    coords_x, coords_y = geotransform_to_coords(target.width, target.height,
+                                                target.geo_transform)
+    regridded = {}
+    for (geo_transform, shape, _), (crs, layers) in groups.items():
+        matrix, covered = regrid_weights(geo_transform, shape, target,
+                                         method=method, src_crs=crs)
+        dtype = np.result_type(np.float32, *(values.dtype for _, values in layers))
+        stacked = np.column_stack([values.ravel() for _, values in layers])
+        out = np.asarray(matrix.dot(stacked), dtype=dtype)
+        out[~covered] = np.nan
+        for idx, (name, _) in enumerate(layers):
+            regridded[name] = out[:, idx].reshape(target.height, target.width)
+    data = OrderedDict()
+    for name in names:
+        attrs = dict(dset[name].attrs)
+        attrs.update(geo_transform=np.array(target.geo_transform, dtype=np.float64),
+                     buf_xsize=target.width,
+                     buf_ysize=target.height,
+                     dims=('y', 'x'),
+                     bounds=geotransform_to_bounds(target.width, target.height,
+                                                   target.geo_transform))
+        if target.crs is not None:
+            attrs['crs'] = target.crs
+        data[name] = xr.DataArray(regridded[name],
+                                  coords=[('y', coords_y), ('x', coords_x)],
+                                  dims=('y', 'x'),
+                                  attrs=attrs)
+    return layers_to_dataset(data, attrs=dict(dset.attrs))
@@ -1,58 +1,515 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
 import logging
 import os
 import re
-from urllib.request import urlopen
+import shutil
+import threading
 
+import numpy as np
 import pandas as pd
+import requests
+from six.moves.urllib.parse import urlparse
 
 logger = logging.getLogger(__name__)
 
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+DEFAULT_MAX_WORKERS = 4
+DOWNLOAD_TIMEOUT = 60
+
+_THREAD_LOCAL = threading.local()
+
 S3_TIF_DIR = os.environ.get('EARTHIO_EXAMPLE_DATA_PATH',
                             os.environ.get('ELM_EXAMPLE_DATA_PATH', 'tif'))
 
+# compact dtypes of the scene list columns (others are left to read_csv).
+# cloudCover stays float64: float32 would change the values compared with
+# max_cloud (float32 10.1 is 10.1000004, above a 10.1 threshold)
+SCENE_LIST_DTYPES = {'processingLevel': 'category',
+                     'path': 'int16',
+                     'row': 'int16',
+                     'cloudCover': 'float64'}
+
+# bump when the cached columns / dtypes change
+SCENE_LIST_CACHE_VERSION = 3
+
+
+def _scene_list_cache_file(scene_list_gz):
+    try:
+        import pyarrow.feather
+        ext = 'feather'
+    except ImportError:
+        ext = 'pkl'
+    return '{}.v{}.{}'.format(scene_list_gz, SCENE_LIST_CACHE_VERSION, ext)
+
+
+def _read_scene_list_csv(scene_list_gz):
+    columns = pd.read_csv(scene_list_gz, nrows=0, compression='gzip').columns
+    dtype = {k: v for k, v in SCENE_LIST_DTYPES.items() if k in columns}
+    return pd.read_csv(scene_list_gz, dtype=dtype,
+                       parse_dates=['acquisitionDate'],
+                       compression='gzip')
+
+
+def _write_scene_list_cache(df, cache_file):
+    tmp = cache_file + '.tmp'
+    if cache_file.endswith('.feather'):
+        import pyarrow as pa
+        import pyarrow.feather
+        # uncompressed so that it can be memory-mapped on reload, one
+        # chunk per column so that row selections (take) stay fast
+        table = pa.Table.from_pandas(df, preserve_index=False).combine_chunks()
+        pyarrow.feather.write_feather(table, tmp, compression='uncompressed',
+                                      chunksize=max(len(df), 1))
+    else:
+        df.to_pickle(tmp)
+    _replace(tmp, cache_file)
+
+
+def _read_scene_list_cache(cache_file):
+    if cache_file.endswith('.feather'):
+        import pyarrow.feather
+        table = pyarrow.feather.read_table(cache_file, memory_map=True)
+        return table.to_pandas()
+    return pd.read_pickle(cache_file)
+
+
+ALL_MONTHS = tuple(range(1, 13))
+
+
+def _session():
+    '''requests.Session of the current thread (connections are reused
+    by the downloads of a thread)'''
+    session = getattr(_THREAD_LOCAL, 'session', None)
+    if session is None:
+        session = _THREAD_LOCAL.session = requests.Session()
+    return session
+
+
+# os.replace is Python 3 only (os.rename replaces files on POSIX)
+_replace = getattr(os, 'replace', os.rename)
+
+
+def _hash_file(fname, hasher, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    with open(fname, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            hasher.update(chunk)
+
+
+def download_file(url, fname, chunk_size=DOWNLOAD_CHUNK_SIZE, session=None,
+                  timeout=DOWNLOAD_TIMEOUT, hasher=None):
+    '''Stream url to fname
+
+    Parameters:
+        :url:        http(s) URL
+        :fname:      local file name
+        :chunk_size: bytes written at a time
+        :session:    requests.Session (default: one per thread)
+        :timeout:    seconds to wait for the server
+        :hasher:     hashlib object updated with the file's bytes as they
+                     are written (optional)
+
+    Returns:
+        :fname:      fname
+
+    The response is written to fname + ".part", renamed to fname when
+    complete, and its ETag (or Last-Modified) to fname + ".part.validator".
+    If a ".part" file is left by an interrupted download, the rest of the
+    file is requested with HTTP Range and If-Range headers: the download
+    restarts if the file changed on the server (200 response), the server
+    ignores the Range, or no validator was stored.  When resuming, the
+    bytes of the ".part" file are hashed first.
+    '''
+    session = session or _session()
+    part = fname + '.part'
+    validator_file = part + '.validator'
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+    validator = None
+    if offset and os.path.exists(validator_file):
+        with open(validator_file) as f:
+            validator = f.read().strip() or None
+    if validator is None:
+        offset = 0
+    headers = {'Range': 'bytes={}-'.format(offset),
+               'If-Range': validator} if offset else {}
+    with session.get(url, headers=headers, stream=True, timeout=timeout) as resp:
+        if resp.status_code == 416 and offset:
+            # Range starts at the end of the file: check it is complete
+            total = resp.headers.get('Content-Range', '').rpartition('/')[-1]
+            if total != str(offset):
+                os.remove(part)
+                return download_file(url, fname, chunk_size=chunk_size,
+                                     session=session, timeout=timeout,
+                                     hasher=hasher)
+            if hasher is not None:
+                _hash_file(part, hasher, chunk_size)
+        else:
+            resp.raise_for_status()
+            if resp.status_code != 206:
+                offset = 0
+                validator = (resp.headers.get('ETag') or
+                             resp.headers.get('Last-Modified'))
+                if validator:
+                    with open(validator_file, 'w') as f:
+                        f.write(validator)
+                elif os.path.exists(validator_file):
+                    os.remove(validator_file)
+            if offset and hasher is not None:
+                _hash_file(part, hasher, chunk_size)
+            expected = resp.headers.get('Content-Length')
+            written = 0
+            with open(part, 'ab' if offset else 'wb') as f:
+                for chunk in resp.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+                    if hasher is not None:
+                        hasher.update(chunk)
+                    written += len(chunk)
+            if expected is not None and written != int(expected):
+                raise IOError('Expected {} bytes from {}, got {} ({} kept to resume)'.format(expected, url, written, part))
+    _replace(part, fname)
+    if os.path.exists(validator_file):
+        os.remove(validator_file)
+    return fname
+
+
+class ContentStore(object):
+    '''Content-addressed store of downloaded files
+
+    Parameters:
+        :root:      directory of the store: "objects/<digest>" files,
+                    "tmp" downloads in progress and "manifest.json"
+        :hash_name: hashlib algorithm of the digests
+
+    Each URL is downloaded once to a temporary file and hashed while it
+    streams.  The file is then moved to objects/ under its digest,
+    unless an identical object exists.  manifest.json maps URLs to
+    {"digest", "size", "ino", "mtime", "links"}, where "links" maps local
+    files to the digest and (inode, size, mtime) they were linked with.
+    Local files are hard links to the objects (copies if linking fails),
+    so the same content in several layouts is stored once.
+
+    Local files and objects are checked against the manifest without
+    reading them.  A file written in place through a hard link changes
+    the shared object: when an object's size, inode or mtime changed it
+    is hashed again, and removed (so the URL is fetched again) if its
+    digest changed.  Unrecorded local files are hashed too.
+    '''
+    def __init__(self, root, hash_name='sha256'):
+        self.root = root
+        self.hash_name = hash_name
+        self.manifest_file = os.path.join(root, 'manifest.json')
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        for d in ('objects', 'tmp'):
+            if not os.path.isdir(os.path.join(root, d)):
+                os.makedirs(os.path.join(root, d))
+        self.manifest = {}
+        if os.path.exists(self.manifest_file):
+            with open(self.manifest_file) as f:
+                self.manifest = json.load(f)
+
+    def object_path(self, digest):
+        return os.path.join(self.root, 'objects', digest[:2], digest)
+
+    def _save_manifest(self):
+        tmp = self.manifest_file + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.manifest, f, indent=1, sort_keys=True)
+        _replace(tmp, self.manifest_file)
+
+    def _key_lock(self, key):
+        '''Lock of the downloads of one URL (they share a ".part" file)'''
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _digest(self, fname):
+        hasher = hashlib.new(self.hash_name)
+        _hash_file(fname, hasher)
+        return hasher.hexdigest()
+
+    def _valid_object(self, url):
+        '''Object path of url if it is in the manifest and the object
+        has the recorded (inode, size, mtime) - or still its digest -
+        else None'''
+        with self._lock:
+            entry = self.manifest.get(url)
+            if not entry:
+                return None
+            obj = self.object_path(entry['digest'])
+            try:
+                st = os.stat(obj)
+            except OSError:
+                return None
+            if _stat_key(st) == _stat_key(entry):
+                return obj
+            logger.debug('{} changed: hashing it again'.format(obj))
+            if self._digest(obj) != entry['digest']:
+                logger.warning('{} (of {}) was modified: removing it'.format(obj, url))
+                os.remove(obj)
+                return None
+            for e in self.manifest.values():
+                if e['digest'] == entry['digest']:
+                    e.update(_stat_dict(st))
+            self._save_manifest()
+            return obj
+
+    def is_valid(self, url, fname):
+        '''True if fname holds the content of url recorded in the
+        manifest: it is unchanged since it was linked (same digest,
+        inode, size and mtime), or has the digest of the content'''
+        obj = self._valid_object(url)
+        if obj is None:
+            return False
+        try:
+            st = os.stat(fname)
+        except OSError:
+            return False
+        entry = self.manifest[url]
+        link = entry.get('links', {}).get(fname)
+        if (link is not None and link['digest'] == entry['digest'] and
+                _stat_key(st) == _stat_key(link)):
+            return True
+        if st.st_size != entry['size'] or self._digest(fname) != entry['digest']:
+            return False
+        self._record_link(url, fname)
+        return True
+
+    def _record_link(self, url, fname):
+        with self._lock:
+            entry = self.manifest[url]
+            link = dict(digest=entry['digest'], **_stat_dict(os.stat(fname)))
+            entry.setdefault('links', {})[fname] = link
+            self._save_manifest()
+
+    def _link(self, obj, fname):
+        if os.path.exists(fname):
+            os.remove(fname)
+        try:
+            os.link(obj, fname)
+        except OSError:
+            shutil.copyfile(obj, fname)
+
+    def _download(self, url):
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        with self._key_lock(key):
+            # another thread may have fetched url while this one waited
+            obj = self._valid_object(url)
+            if obj is not None:
+                return obj
+            hasher = hashlib.new(self.hash_name)
+            tmp = download_file(url, os.path.join(self.root, 'tmp', key),
+                                hasher=hasher)
+            digest = hasher.hexdigest()
+            obj = self.object_path(digest)
+            with self._lock:
+                if (os.path.exists(obj) and
+                        os.path.getsize(obj) == os.path.getsize(tmp) and
+                        self._digest(obj) == digest):
+                    logger.debug('{} has the content of {}'.format(url, obj))
+                    os.remove(tmp)
+                else:
+                    if not os.path.isdir(os.path.dirname(obj)):
+                        os.makedirs(os.path.dirname(obj))
+                    _replace(tmp, obj)
+                    os.chmod(obj, 0o444)
+                st = os.stat(obj)
+                entry = self.manifest.setdefault(url, {})
+                entry.update(digest=digest, **_stat_dict(st))
+                for e in self.manifest.values():
+                    if e['digest'] == digest:
+                        e.update(_stat_dict(st))
+                self._save_manifest()
+        return obj
+
+    def fetch(self, url, fname=None):
+        '''Download url into the store (unless the manifest has it) and
+        link it to fname
+
+        Returns:
+            :digest: hex digest of the content
+        '''
+        obj = self._valid_object(url) or self._download(url)
+        if fname is not None and not self.is_valid(url, fname):
+            self._link(obj, fname)
+            self._record_link(url, fname)
+        return self.manifest[url]['digest']
+
+
+def _stat_dict(st):
+    return {'ino': st.st_ino, 'size': st.st_size, 'mtime': st.st_mtime}
+
+
+def _stat_key(st):
+    '''(inode, size, mtime) of an os.stat result or a manifest entry'''
+    if isinstance(st, dict):
+        return st.get('ino'), st.get('size'), st.get('mtime')
+    return st.st_ino, st.st_size, st.st_mtime
+
+
+def _path_row_key(path, row):
+    return np.asarray(path, dtype=np.int32) * 1000 + np.asarray(row, dtype=np.int32)
+
+
+def _ranges(starts, ends):
+    '''Concatenation of np.arange(start, end) for each start, end'''
+    lengths = ends - starts
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return offsets + np.arange(lengths.sum())
+
+
+class SceneIndex(object):
+    '''Index of a scene list DataFrame by (path, row)
+
+    Rows of each (path, row) group are held contiguous, sorted by
+    acquisition date (by_date) and by cloud cover (by_cloud), so that
+    a query reads only the rows of its groups.
+
+    Parameters:
+        :df: scene list DataFrame (path, row, cloudCover, acquisitionDate)
+    '''
+    def __init__(self, df):
+        self.df = df
+        keys = _path_row_key(df['path'].values, df['row'].values)
+        self.cloud = df['cloudCover'].values
+        dates = df['acquisitionDate'].values
+        self.month = pd.DatetimeIndex(dates).month.values.astype(np.int8)
+        self.by_date = np.lexsort((dates, keys))
+        self.keys, self.starts = np.unique(keys[self.by_date], return_index=True)
+        self.ends = np.append(self.starts[1:], len(keys))
+        group = np.repeat(np.arange(len(self.keys)), self.ends - self.starts)
+        # cloud cover order within each group (group is sorted already)
+        self.by_cloud = self.by_date[np.lexsort((self.cloud[self.by_date], group))]
+
+    def _groups(self, path, row):
+        '''(starts, ends) of the groups of (path, row) arrays, empty
+        ranges for path / rows not in the scene list'''
+        keys = _path_row_key(path, row)
+        if not len(self.keys):
+            return np.zeros_like(keys), np.zeros_like(keys)
+        pos = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        found = self.keys[pos] == keys
+        return np.where(found, self.starts[pos], 0), np.where(found, self.ends[pos], 0)
+
+    def _keep(self, rows, max_cloud, months):
+        cloud = self.cloud[rows]
+        keep = (cloud < max_cloud) & (cloud >= 0)
+        if set(months) != set(ALL_MONTHS):
+            keep &= np.isin(self.month[rows], np.asarray(months, dtype=np.int8))
+        return keep
+
+    def scenes(self, path, row, max_cloud=10, months=ALL_MONTHS):
+        '''Row positions (in df order) of the scenes of path / row arrays
+        with 0 <= cloud cover < max_cloud acquired in months'''
+        starts, ends = self._groups(np.atleast_1d(path), np.atleast_1d(row))
+        rows = self.by_date[_ranges(starts, ends)]
+        return np.unique(rows[self._keep(rows, max_cloud, months)])
+
+    def lowest_cloud_cover(self, path, row, max_cloud=10, months=ALL_MONTHS):
+        '''Row positions (in df order) of the scenes with the lowest
+        cloud cover of each (path, row) among those selected by scenes'''
+        starts, ends = self._groups(np.atleast_1d(path), np.atleast_1d(row))
+        rows = self.by_cloud[_ranges(starts, ends)]
+        keep = self._keep(rows, max_cloud, months)
+        group = np.repeat(np.arange(len(starts)), ends - starts)[keep]
+        rows = rows[keep]
+        cloud = self.cloud[rows]
+        if not len(rows):
+            return rows
+        # first kept row of each group has the group's lowest cloud cover
+        first = np.ones(len(group), dtype=bool)
+        first[1:] = group[1:] != group[:-1]
+        lowest = np.maximum.accumulate(np.where(first, np.arange(len(group)), 0))
+        return np.unique(rows[cloud == cloud[lowest]])
+
+
 class SceneDownloader:
+    '''Download LANDSAT scenes from the landsat-pds S3 bucket
 
-    def __init__(self, scene_list_gz='scene_list.gz', s3_tif_dir=None):
+    Parameters:
+        :scene_list_gz: local scene_list.gz (downloaded if missing)
+        :s3_tif_dir:    directory of the downloaded files
+        :use_cache:     convert the scene list once to a columnar cache
+                        file next to scene_list_gz (Feather if pyarrow is
+                        installed, else pickle) and reload from it while
+                        it is newer than scene_list_gz
+        :store_dir:     directory of a ContentStore the layers are
+                        downloaded to (and linked from s3_tif_dir), or None
+                        to download to s3_tif_dir directly
+    '''
+    def __init__(self, scene_list_gz='scene_list.gz', s3_tif_dir=None,
+                 use_cache=True, store_dir=None):
         self.s3_tif_dir = s3_tif_dir or S3_TIF_DIR
         if not os.path.exists(self.s3_tif_dir):
             os.makedirs(self.s3_tif_dir)
+        self.store = ContentStore(store_dir) if store_dir else None
         self.scene_list_gz = scene_list_gz
+        self.use_cache = use_cache
         if not os.path.exists(scene_list_gz):
             self.download_scene_list()
         self.reload_scene_list()
 
+    @property
+    def scene_list_cache(self):
+        return _scene_list_cache_file(self.scene_list_gz)
+
     def reload_scene_list(self):
+        cache_file = self.scene_list_cache
+        if (self.use_cache and os.path.exists(cache_file) and
+                os.stat(cache_file).st_mtime >= os.stat(self.scene_list_gz).st_mtime):
+            logger.info('Loading LANDSAT scene list from {}'.format(cache_file))
+            try:
+                self.df = _read_scene_list_cache(cache_file)
+                return
+            except Exception as e:
+                logger.warning('Cannot read {} ({}). Reading {}'.format(cache_file, repr(e), self.scene_list_gz))
         logger.info('Loading LANDSAT scene list from {}'.format(self.scene_list_gz))
-        self.df = pd.read_csv(self.scene_list_gz,
-                              parse_dates=['acquisitionDate'],
-                              compression='gzip')
+        self.df = _read_scene_list_csv(self.scene_list_gz)
+        if self.use_cache:
+            try:
+                _write_scene_list_cache(self.df, cache_file)
+            except Exception as e:
+                logger.warning('Cannot write {} ({})'.format(cache_file, repr(e)))
 
     def download_scene_list(self):
         scene_list_url = 'http://landsat-pds.s3.amazonaws.com/scene_list.gz'
         if os.path.exists(self.scene_list_gz):
             return
-        with urlopen(scene_list_url) as f:
-            logger.info('Download {} to {}'.format(scene_list_url, self.scene_list_gz))
-            with open(self.scene_list_gz, 'wb') as f2:
-                f2.write(f.read())
-
-    def get_scene_list(self, row=33, path=15, max_cloud=10, months=tuple(range(1,13))):
-        df = self.df
-        sel = df[(df.path == path)&
-                 (df.row == row)&
-                 (df.cloudCover < max_cloud)&
-                 (df.cloudCover >= 0)&
-                 (df.acquisitionDate.dt.month.isin(months))]
-        return sel
+        logger.info('Download {} to {}'.format(scene_list_url, self.scene_list_gz))
+        download_file(scene_list_url, self.scene_list_gz)
+
+    @property
+    def scene_index(self):
+        '''SceneIndex of self.df, built on first use'''
+        index = getattr(self, '_scene_index', None)
+        if index is None or index.df is not self.df:
+            index = self._scene_index = SceneIndex(self.df)
+        return index
+
+    def get_scene_list(self, row=33, path=15, max_cloud=10, months=ALL_MONTHS):
+        return self.df.iloc[self.scene_index.scenes(path, row, max_cloud, months)]
 
     def lowest_cloud_cover_image(self, **kw):
-        sel = self.get_scene_list(**kw)
-        return sel[sel.cloudCover == sel.cloudCover.min()]
+        kw.setdefault('row', 33)
+        kw.setdefault('path', 15)
+        return self.df.iloc[self.scene_index.lowest_cloud_cover(**kw)]
+
+    def get_scene_lists(self, path_rows, max_cloud=10, months=ALL_MONTHS):
+        '''Scenes of many (path, row) pairs (as in get_scene_list) in
+        one DataFrame'''
+        path, row = np.asarray(path_rows, dtype=np.int32).reshape(-1, 2).T
+        return self.df.iloc[self.scene_index.scenes(path, row, max_cloud, months)]
+
+    def lowest_cloud_cover_images(self, path_rows, max_cloud=10, months=ALL_MONTHS):
+        '''Lowest cloud cover scenes of many (path, row) pairs (as in
+        lowest_cloud_cover_image) in one DataFrame'''
+        path, row = np.asarray(path_rows, dtype=np.int32).reshape(-1, 2).T
+        return self.df.iloc[self.scene_index.lowest_cloud_cover(path, row, max_cloud, months)]
 
     def local_file_for_url(self, download_url):
-        _, rel_file = download_url.split('.com/')
+        rel_file = urlparse(download_url).path.lstrip('/')
         full_file = os.path.join(self.s3_tif_dir, rel_file)
         dirr = os.path.dirname(full_file)
         if not os.path.exists(dirr):
@@ -61,8 +518,9 @@ class SceneDownloader:
 
 
     def get_urls_on_index_page(self, download_url):
-        with urlopen(download_url) as f:
-            contents = f.read().decode()
+        resp = _session().get(download_url, timeout=DOWNLOAD_TIMEOUT)
+        resp.raise_for_status()
+        contents = resp.text
         fnames = []
         for ending in ('txt', 'TIF'):
             fnames.extend(set(re.findall('([\w\d_-]+\.{})'.format(ending), contents)))
@@ -71,21 +529,31 @@ class SceneDownloader:
 
 
     def download_one_file(self, url, fname):
-        try:
-            print('Download', url, 'to', fname)
-            with urlopen(url) as f:
-                with open(fname, 'wb') as f2:
-                    f2.write(f.read())
-        except:
-            if os.path.exists(fname):
-                os.remove(fname)
-            raise
+        logger.info('Download {} to {}'.format(url, fname))
+        if self.store is not None:
+            self.store.fetch(url, fname)
+            return fname
+        return download_file(url, fname)
+
+    def _is_downloaded(self, url, fname):
+        if self.store is not None:
+            return self.store.is_valid(url, fname)
+        return os.path.exists(fname)
 
 
-    def download_all_layers(self, download_url):
+    def download_all_layers(self, download_url, max_workers=DEFAULT_MAX_WORKERS):
+        '''Download the files of a scene index page (files already
+        downloaded are skipped), max_workers at a time.  With a store,
+        files are checked against its manifest'''
         urls = self.get_urls_on_index_page(download_url)
         local_files = [self.local_file_for_url(url) for url in urls]
-        for url, fname in zip(urls, local_files):
-            if not os.path.exists(fname):
-                self.download_one_file(url, fname)
+        missing = [(url, fname) for url, fname in zip(urls, local_files)
+                   if not self._is_downloaded(url, fname)]
+        if missing:
+            with ThreadPoolExecutor(max_workers=max(int(max_workers), 1)) as executor:
+                futures = [executor.submit(self.download_one_file, url, fname)
+                           for url, fname in missing]
+                errors = [f.exception() for f in futures if f.exception() is not None]
+            if errors:
+                raise errors[0]
         return local_files
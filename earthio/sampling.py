@@ -0,0 +1,206 @@
+'''
+--------------------
+
+``earthio.sampling``
+~~~~~~~~~~~~~~~~~~~~
+
+Values of layers at points (stations, pixels of interest), reading only
+the storage blocks that contain points instead of whole layers.
+
+'''
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import threading
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from earthio.layer_sources import (cached_layer_sources,
+                                   layer_sources,
+                                   open_layer)
+
+__all__ = ['extract_time_series', 'points_to_row_col', 'sample_points']
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_WORKERS = 4
+
+
+
+def points_to_row_col(xs, ys, geo_transform, height, width):
+    '''Rows and columns of the cells containing points, in one
+    vectorized pass
+
+    Parameters:
+        :xs, ys:        1-D arrays of point coordinates
+        :geo_transform: geo_transform of the grid
+        :height, width: number of rows and columns of the grid
+
+    Returns:
+        :rows, cols:    int64 arrays (0 for points outside the grid)
+        :inside:        bool array, False for points outside the grid
+    '''
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    cols = np.floor((xs - geo_transform[0]) / geo_transform[1])
+    rows = np.floor((ys - geo_transform[3]) / geo_transform[5])
+    inside = (cols >= 0) & (cols < width) & (rows >= 0) & (rows < height)
+    rows = np.where(inside, rows, 0).astype(np.int64)
+    cols = np.where(inside, cols, 0).astype(np.int64)
+    return rows, cols, inside
+
+
+def _group_by_block(rows, cols, inside, block_shape, width):
+    '''List of (point indices, rows, cols) of the points in each block'''
+    idx = np.flatnonzero(inside)
+    if not idx.size:
+        return []
+    rows, cols = rows[idx], cols[idx]
+    block_rows, block_cols = block_shape
+    n_block_cols = -(-width // block_cols)
+    block_ids = (rows // block_rows) * n_block_cols + cols // block_cols
+    order = np.argsort(block_ids, kind='mergesort')
+    block_ids = block_ids[order]
+    starts = np.flatnonzero(np.r_[True, block_ids[1:] != block_ids[:-1]])
+    stops = np.r_[starts[1:], block_ids.size]
+    idx, rows, cols = idx[order], rows[order], cols[order]
+    return [(idx[start:stop], rows[start:stop], cols[start:stop])
+            for start, stop in zip(starts, stops)]
+
+
+def _sampling_plan(source, xs, ys, plans):
+    '''Row / col of points and their grouping by block, shared by
+    layers (and files) with the same grid and block shape'''
+    key = (source.geo_transform, source.height, source.width, source.block_shape)
+    plan = plans.get(key)
+    if plan is None:
+        rows, cols, inside = points_to_row_col(xs, ys, source.geo_transform,
+                                               source.height, source.width)
+        groups = _group_by_block(rows, cols, inside, source.block_shape,
+                                 source.width)
+        plan = plans[key] = (inside.all(), groups)
+    return plan
+
+
+def _sample_source(source, xs, ys, plans):
+    all_inside, groups = _sampling_plan(source, xs, ys, plans)
+    if all_inside:
+        values = np.empty(len(xs), dtype=np.dtype(source.dtype))
+    else:
+        values = np.full(len(xs), np.nan, dtype=np.float64)
+    if not groups:
+        return values
+    with open_layer(source) as read:
+        for idx, rows, cols in groups:
+            r0, c0 = rows.min(), cols.min()
+            arr = read(((r0, rows.max() + 1), (c0, cols.max() + 1)))
+            values[idx] = arr[rows - r0, cols - c0]
+    return values
+
+
+def _sample_sources(sources, xs, ys, plans=None):
+    plans = {} if plans is None else plans
+    return OrderedDict((source.name, _sample_source(source, xs, ys, plans))
+                       for source in sources)
+
+
+def sample_points(filename, xs, ys, layer_specs=None, reader=None,
+                  sources=None):
+    '''Values of layers at points, without loading the layers
+
+    Parameters:
+        :filename:    filename (HDF4 / 5 or NetCDF) or directory name (TIF)
+        :xs, ys:      1-D arrays of point coordinates (in the grid's CRS)
+        :layer_specs: list of strings or earthio.LayerSpec objects
+        :reader:      named reader from earthio - one of:  ('tif', 'hdf4', 'hdf5', 'netcdf')
+        :sources:     list of LayerSource for filename, if already computed
+
+    Returns:
+        :df:          pd.DataFrame with columns "x", "y" and one column
+                      per layer.  Points outside a layer's grid are NaN
+                      (the column is then float64)
+
+    Points are mapped to rows / cols and grouped by the storage block
+    (tile or chunk) containing them; only the window spanning the points
+    of each block is read.  Values are decoded as by earthio.load_layers
+    (NetCDF variables masked and scaled).
+    '''
+    xs = np.asarray(xs, dtype=np.float64).ravel()
+    ys = np.asarray(ys, dtype=np.float64).ravel()
+    if xs.shape != ys.shape:
+        raise ValueError('Expected xs and ys of the same length, got {} and {}'.format(xs.size, ys.size))
+    if sources is None:
+        sources = layer_sources(filename, layer_specs=layer_specs, reader=reader)
+    data = OrderedDict([('x', xs), ('y', ys)])
+    data.update(_sample_sources(sources, xs, ys))
+    return pd.DataFrame(data, columns=list(data))
+
+
+def extract_time_series(files, points, layer_specs=None, reader=None,
+                        max_workers=None, times=None):
+    '''Values of layers at points in each of many files
+
+    Parameters:
+        :files:       list of filenames (HDF4 / 5 or NetCDF) or TIF
+                      directories, one per time step
+        :points:      (n, 2) array-like of (x, y) point coordinates
+        :layer_specs: list of strings or earthio.LayerSpec objects
+        :reader:      named reader from earthio - one of:  ('tif', 'hdf4', 'hdf5', 'netcdf')
+        :max_workers: number of threads reading files (default
+                      DEFAULT_MAX_WORKERS)
+        :times:       coordinate values of the "time" dimension
+                      (default: files)
+
+    Returns:
+        :arr:         xr.DataArray with dims ("time", "point", "layer")
+                      and "x", "y" coordinates on "point".  Points
+                      outside a grid are NaN.  Values are decoded as by
+                      earthio.load_layers (see sample_points)
+
+    Layer sources (metadata and geo_transform) are cached per file and
+    the rows / cols of points are computed once per distinct grid, so
+    each file costs only the small window reads around its points.
+    Files are read in parallel threads; NetCDF reads are serialized
+    (see earthio.netcdf.NETCDF_LOCK).
+    '''
+    files = list(files)
+    points = np.asarray(points, dtype=np.float64)
+    if points.ndim != 2 or points.shape[1] != 2:
+        raise ValueError('Expected points with shape (n, 2), got {}'.format(points.shape))
+    if times is not None and len(times) != len(files):
+        raise ValueError('Expected {} times, got {}'.format(len(files), len(times)))
+    xs, ys = points[:, 0].copy(), points[:, 1].copy()
+    plans = {}
+    plans_lock = threading.Lock()
+
+    def sample_file(filename):
+        sources = cached_layer_sources(filename, layer_specs=layer_specs,
+                                       reader=reader)
+        for source in sources:
+            with plans_lock:
+                _sampling_plan(source, xs, ys, plans)
+        return _sample_sources(sources, xs, ys, plans)
+
+    executor = ThreadPoolExecutor(max_workers=max_workers or DEFAULT_MAX_WORKERS)
+    try:
+        samples = list(executor.map(sample_file, files))
+    finally:
+        executor.shutdown(wait=False)
+    if not samples:
+        raise ValueError('Expected at least one file')
+    layers = list(samples[0])
+    for filename, sample in zip(files, samples):
+        if list(sample) != layers:
+            raise ValueError('Expected layers {} in {}, got {}'.format(layers, filename, list(sample)))
+    values = np.stack([np.column_stack(list(sample.values()))
+                       for sample in samples])
+    return xr.DataArray(values,
+                        coords=[('time', files if times is None else list(times)),
+                                ('point', np.arange(len(xs))),
+                                ('layer', layers)],
+                        dims=('time', 'point', 'layer')).assign_coords(x=('point', xs),
+                                                                       y=('point', ys))
@@ -0,0 +1,219 @@
+'''
+-------------------------
+
+``earthio.spatial_index``
+~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Persistent spatial (and time) index of the bounds of many files, to
+find the files intersecting an area of interest without reading their
+metadata again.
+
+The index is an STR (sort-tile-recursive) packed R-tree held in numpy
+arrays: the file bounds sorted in spatially coherent groups of
+``node_size``, and one array of node bounds per level above them.  It is
+saved / loaded with np.savez / np.load.
+
+'''
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import datetime
+import logging
+import math
+
+import numpy as np
+
+from earthio.layer_sources import cached_layer_sources, sources_bounds
+
+__all__ = ['SpatialIndex', 'build_spatial_index']
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_NODE_SIZE = 16
+
+NAT = np.datetime64('NaT', 's')
+
+
+def _normalize_bounds(bounds):
+    bounds = np.asarray(bounds, dtype=np.float64).reshape(-1, 4)
+    return np.column_stack((np.minimum(bounds[:, 0], bounds[:, 2]),
+                            np.minimum(bounds[:, 1], bounds[:, 3]),
+                            np.maximum(bounds[:, 0], bounds[:, 2]),
+                            np.maximum(bounds[:, 1], bounds[:, 3])))
+
+
+def _to_datetime64(value):
+    if value is None:
+        return NAT
+    if isinstance(value, datetime.date) and not isinstance(value, datetime.datetime):
+        value = datetime.datetime(value.year, value.month, value.day)
+    return np.datetime64(value, 's')
+
+
+def _time_range(value):
+    '''(start, end) datetime64 of a time, (start, end) pair, or None'''
+    if isinstance(value, (tuple, list)):
+        start, end = value
+    else:
+        start = end = value
+    return _to_datetime64(start), _to_datetime64(end)
+
+
+def _str_order(bounds, node_size):
+    '''Order of bounds in STR packing: slices by x center, each
+    slice sorted by y center'''
+    n = len(bounds)
+    if not n:
+        return np.arange(0)
+    cx = (bounds[:, 0] + bounds[:, 2]) / 2.
+    cy = (bounds[:, 1] + bounds[:, 3]) / 2.
+    n_leaves = int(math.ceil(n / node_size))
+    slice_size = int(math.ceil(math.sqrt(n_leaves))) * node_size
+    order = np.argsort(cx, kind='mergesort')
+    for start in range(0, n, slice_size):
+        part = order[start:start + slice_size]
+        order[start:start + slice_size] = part[np.argsort(cy[part], kind='mergesort')]
+    return order
+
+
+def _parent_bounds(bounds, node_size):
+    starts = np.arange(0, len(bounds), node_size)
+    return np.column_stack((np.minimum.reduceat(bounds[:, 0], starts),
+                            np.minimum.reduceat(bounds[:, 1], starts),
+                            np.maximum.reduceat(bounds[:, 2], starts),
+                            np.maximum.reduceat(bounds[:, 3], starts)))
+
+
+def _intersects(boxes, query):
+    left, bottom, right, top = query
+    return ((boxes[:, 0] <= right) & (boxes[:, 2] >= left) &
+            (boxes[:, 1] <= top) & (boxes[:, 3] >= bottom))
+
+
+class SpatialIndex(object):
+    '''Packed R-tree of file bounds (and optional time ranges)
+
+    Parameters:
+        :files:     list of file names
+        :bounds:    (n, 4) array-like of (left, bottom, right, top)
+        :times:     (n, 2) array-like of (start, end) datetime64, or None
+        :node_size: number of children per tree node
+    '''
+    def __init__(self, files, bounds, times=None, node_size=DEFAULT_NODE_SIZE):
+        self.files = np.asarray(files, dtype=np.str_)
+        self.bounds = _normalize_bounds(bounds) if len(self.files) else np.empty((0, 4))
+        if times is None:
+            times = np.full((len(self.files), 2), NAT)
+        self.times = np.asarray(times, dtype='datetime64[s]').reshape(-1, 2)
+        if not (len(self.files) == len(self.bounds) == len(self.times)):
+            raise ValueError('Expected files, bounds and times of the same length')
+        self.node_size = int(node_size)
+        if self.node_size < 2:
+            raise ValueError('Expected node_size >= 2, got {}'.format(node_size))
+        self.order = _str_order(self.bounds, self.node_size)
+        self.levels = [self.bounds[self.order]]
+        while len(self.levels[-1]) > self.node_size:
+            self.levels.append(_parent_bounds(self.levels[-1], self.node_size))
+
+    def __len__(self):
+        return len(self.files)
+
+    def intersecting(self, bounds):
+        '''Indices (in files order) of files whose bounds intersect bounds'''
+        query = _normalize_bounds(bounds)[0]
+        idx = np.arange(len(self.levels[-1]))
+        for level in range(len(self.levels) - 1, -1, -1):
+            idx = idx[_intersects(self.levels[level][idx], query)]
+            if level:
+                idx = (idx[:, None] * self.node_size + np.arange(self.node_size)).ravel()
+                idx = idx[idx < len(self.levels[level - 1])]
+        return np.sort(self.order[idx])
+
+    def files_intersecting(self, bounds, time_range=None):
+        '''Files whose bounds intersect bounds
+
+        Parameters:
+            :bounds:     (left, bottom, right, top)
+            :time_range: (start, end) datetimes (or datetime64 / strings),
+                         or None for any time.  Files without a time
+                         range are not returned when time_range is given
+
+        Returns:
+            :files:      list of file names, in the order they were indexed
+        '''
+        idx = self.intersecting(bounds)
+        if time_range is not None:
+            start, end = _time_range(time_range)
+            times = self.times[idx]
+            keep = ~np.isnat(times[:, 0]) & ~np.isnat(times[:, 1])
+            if not np.isnat(start):
+                keep &= times[:, 1] >= start
+            if not np.isnat(end):
+                keep &= times[:, 0] <= end
+            idx = idx[keep]
+        return self.files[idx].tolist()
+
+    def save(self, path):
+        '''Save the index to path (np.savez format)
+
+        The index is written to path as given: np.savez would append .npz
+        to a file name, so SpatialIndex.load(path) could not find it'''
+        levels = {'level_{}'.format(idx): level
+                  for idx, level in enumerate(self.levels)}
+        with open(path, 'wb') as f:
+            np.savez(f, files=self.files, bounds=self.bounds, times=self.times,
+                     order=self.order, node_size=self.node_size, **levels)
+
+    @classmethod
+    def load(cls, path):
+        '''Load an index saved with SpatialIndex.save'''
+        with np.load(path, allow_pickle=False) as data:
+            index = cls.__new__(cls)
+            index.files = data['files']
+            index.bounds = data['bounds']
+            index.times = data['times']
+            index.order = data['order']
+            index.node_size = int(data['node_size'])
+            index.levels = []
+            while 'level_{}'.format(len(index.levels)) in data:
+                index.levels.append(data['level_{}'.format(len(index.levels))])
+        return index
+
+
+def build_spatial_index(files, layer_specs=None, reader=None, time_func=None,
+                        node_size=DEFAULT_NODE_SIZE, path=None):
+    '''Build a SpatialIndex of the bounds of files
+
+    Parameters:
+        :files:       list of filenames (HDF4 / 5 or NetCDF) or TIF directories
+        :layer_specs: list of strings or earthio.LayerSpec objects whose
+                      grids are indexed (default: all layers)
+        :reader:      named reader from earthio - one of:  ('tif', 'hdf4', 'hdf5', 'netcdf')
+        :time_func:   function of a filename returning its time, (start, end)
+                      times, or None
+        :node_size:   number of children per tree node
+        :path:        if given, save the index to path
+
+    Returns:
+        :index:       SpatialIndex
+
+    Bounds are the extent of the layers' grids (from their geo_transform
+    and shape).  Files whose metadata cannot be read are logged and
+    left out of the index.
+    '''
+    names, bounds, times = [], [], []
+    for filename in files:
+        try:
+            sources = cached_layer_sources(filename, layer_specs=layer_specs,
+                                           reader=reader)
+        except Exception as e:
+            logger.warning('build_spatial_index: skipping {} ({})'.format(filename, repr(e)))
+            continue
+        if not sources:
+            continue
+        names.append(filename)
+        bounds.append(sources_bounds(sources))
+        times.append(_time_range(time_func(filename) if time_func else None))
+    index = SpatialIndex(names, bounds, times=times or None, node_size=node_size)
+    if path:
+        index.save(path)
+    return index
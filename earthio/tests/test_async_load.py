@@ -0,0 +1,104 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from concurrent.futures import ThreadPoolExecutor
+import os
+import sys
+
+import numpy as np
+import pytest
+import xarray as xr
+
+if sys.version_info < (3, 5):
+    pytest.skip('earthio.async_load requires Python >= 3.5',
+                allow_module_level=True)
+
+import asyncio
+
+from earthio import aload_layers, aload_meta, load_layers
+from earthio.tests.util import (TIF_FILES, HDF5_FILES,
+                                HDF4_FILES, NETCDF_FILES)
+TRIALS = {}
+
+if TIF_FILES:
+    from earthio.tests.test_tif import layer_specs as tif_layer_specs
+    TRIALS['tif'] = os.path.dirname(TIF_FILES[0])
+if HDF4_FILES:
+    from earthio.tests.test_hdf4 import layer_specs as hdf4_layer_specs
+    TRIALS['hdf4'] = HDF4_FILES[0]
+if HDF5_FILES:
+    TRIALS['hdf5'] = HDF5_FILES[0]
+if NETCDF_FILES:
+    TRIALS['netcdf'] = NETCDF_FILES[0]
+
+
+# no "async def" here, so that the module parses on Python 2 (and is skipped)
+def _run(coro, cancel=False):
+    loop = asyncio.new_event_loop()
+    try:
+        task = loop.create_task(coro)
+        if cancel:
+            loop.call_soon(task.cancel)
+        return loop.run_until_complete(task)
+    finally:
+        loop.close()
+
+
+def _layer_specs(ftype, filename):
+    if ftype == 'tif':
+        return tif_layer_specs[:3]
+    if ftype == 'hdf4':
+        return hdf4_layer_specs[:3]
+    if ftype == 'hdf5':
+        from earthio.tests.test_hdf5 import get_layer_specs
+        return get_layer_specs(filename)[1][:3]
+    return None
+
+
+@pytest.mark.parametrize('ftype,filename', sorted(TRIALS.items()))
+def test_aload_layers(ftype, filename):
+    layer_specs = _layer_specs(ftype, filename)
+    dset = _run(aload_layers(filename, layer_specs=layer_specs, reader=ftype))
+    assert isinstance(dset, xr.Dataset)
+    expected = load_layers(filename, layer_specs=layer_specs, reader=ftype)
+    assert list(dset.data_vars) == list(expected.data_vars)
+    for layer in dset.data_vars:
+        assert dset[layer].shape == expected[layer].shape
+
+
+@pytest.mark.parametrize('ftype,filename', sorted(TRIALS.items()))
+def test_aload_layers_cancel(ftype, filename):
+    layer_specs = _layer_specs(ftype, filename)
+    executor = ThreadPoolExecutor(max_workers=1)
+    with pytest.raises(asyncio.CancelledError):
+        _run(aload_layers(filename, layer_specs=layer_specs, reader=ftype,
+                          executor=executor), cancel=True)
+    executor.shutdown()
+
+
+@pytest.mark.parametrize('ftype,filename', sorted(TRIALS.items()))
+def test_aload_meta(ftype, filename):
+    meta = _run(aload_meta(filename, reader=ftype))
+    assert 'layer_meta' in meta
+
+
+@pytest.mark.parametrize('calibration', (None, 'reflectance'))
+def test_aload_layers_tmp_tifs(tmp_path, calibration):
+    pytest.importorskip('rasterio')
+    from earthio.tests.test_landsat_util import write_mtl
+    from earthio.tests.test_tif import _write_band, ls
+    scene_dir = os.path.join(str(tmp_path), 'scene')
+    os.makedirs(scene_dir)
+    dn = np.arange(1, 8 * 6 + 1, dtype=np.uint16).reshape(8, 6) * 100
+    for band in (1, 2, 10):
+        _write_band(os.path.join(scene_dir, 'LC80150332013207LGN00_B{}.TIF'.format(band)), dn)
+    mtl = write_mtl(str(tmp_path))
+    layer_specs = [ls(1), ls(2), ls(10)]
+    kw = dict(layer_specs=layer_specs, reader='tif', calibration=calibration,
+              mtl=mtl if calibration else None)
+    dset = _run(aload_layers(scene_dir, **kw))
+    expected = load_layers(scene_dir, **kw)
+    assert list(dset.data_vars) == ['layer_1', 'layer_2', 'layer_10']
+    for layer in dset.data_vars:
+        xr.testing.assert_identical(dset[layer], expected[layer])
+    dtype = np.float32 if calibration else np.uint16
+    assert all(dset[layer].dtype == dtype for layer in dset.data_vars)
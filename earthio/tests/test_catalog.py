@@ -0,0 +1,83 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import datetime
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from earthio.catalog import Catalog
+from earthio.tests.util import NETCDF_FILES
+from earthio.util import LayerSpec
+
+
+def _write_tif(path, left, top, fill=1):
+    import rasterio as rio
+    from affine import Affine
+    with rio.open(path, 'w', driver='GTiff', height=4, width=4, count=1,
+                  dtype='uint16', transform=Affine(10., 0, left, 0, -10., top)) as dst:
+        dst.write(np.full((4, 4), fill, dtype=np.uint16), 1)
+
+
+@pytest.fixture
+def tif_tree(tmp_path):
+    pytest.importorskip('rasterio')
+    top_dir = os.path.join(str(tmp_path), 'tifs')
+    for name, left in (('scene_a', 0.), ('scene_b', 1000.)):
+        scene = os.path.join(top_dir, name)
+        os.makedirs(scene)
+        for band in ('B1', 'B2'):
+            _write_tif(os.path.join(scene, '{}_{}.TIF'.format(name, band)), left, 40.)
+    return top_dir
+
+
+def _time_func(filename):
+    return datetime.date(2016, 1, 2) if filename.endswith('scene_b') else None
+
+
+def test_catalog_refresh(tif_tree, tmp_path):
+    db = os.path.join(str(tmp_path), 'catalog.sqlite')
+    scene_a, scene_b = (os.path.join(tif_tree, name) for name in ('scene_a', 'scene_b'))
+    with Catalog(db) as catalog:
+        counts = catalog.refresh(tif_tree, reader='tif', time_func=_time_func)
+        assert counts['added'] == 2 and counts['failed'] == 0
+        assert catalog.files() == [scene_a, scene_b]
+        spec = LayerSpec(name='b2', search_key='name', search_value='B2\\.TIF$')
+        layers = catalog.layers_matching(spec)
+        assert [(path, name) for path, _, name in layers] == \
+            [(scene_a, os.path.join(scene_a, 'scene_a_B2.TIF')),
+             (scene_b, os.path.join(scene_b, 'scene_b_B2.TIF'))]
+        assert catalog.files_matching(spec, bounds=(0., 0., 40., 40.)) == [scene_a]
+        assert catalog.files_matching(time_range=('2016-01-01', '2016-01-31')) == [scene_b]
+        assert catalog.files_matching(LayerSpec(name='x', search_value='B9')) == []
+    with Catalog(db) as catalog:
+        assert catalog.refresh(tif_tree, reader='tif')['unchanged'] == 2
+        _write_tif(os.path.join(scene_a, 'scene_a_B3.TIF'), 0., 40.)
+        os.utime(scene_a, (0, 0))
+        shutil.rmtree(scene_b)
+        counts = catalog.refresh(tif_tree, reader='tif')
+        assert (counts['updated'], counts['removed'], counts['unchanged']) == (1, 1, 0)
+        spec = LayerSpec(name='b3', search_value='B3')
+        assert catalog.files_matching(spec) == [scene_a]
+        count = catalog.conn.execute('SELECT COUNT(*) FROM layers').fetchone()[0]
+        assert count == 3
+        # a TIF rewritten in place does not change its directory's mtime
+        band = os.path.join(scene_a, 'scene_a_B3.TIF')
+        mtime = os.stat(scene_a).st_mtime
+        _write_tif(band, 0., 40., fill=2)
+        os.utime(band, (mtime + 10, mtime + 10))
+        os.utime(scene_a, (mtime, mtime))
+        assert catalog.refresh(tif_tree, reader='tif')['updated'] == 1
+        assert catalog.refresh(tif_tree, reader='tif')['unchanged'] == 1
+
+
+@pytest.mark.skipif(not NETCDF_FILES,
+                    reason='elm-data repo has not been cloned')
+def test_catalog_netcdf():
+    catalog = Catalog()
+    for filename in NETCDF_FILES:
+        catalog.add_file(filename, reader='netcdf')
+    spec = LayerSpec(name='HQobservationTime', search_key='long_name',
+                     search_value='HQobservationTime', value_re_flags='IGNORECASE')
+    assert catalog.files_matching(spec) == sorted(NETCDF_FILES)
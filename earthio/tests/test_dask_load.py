@@ -0,0 +1,136 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+import pickle
+import sys
+import threading
+
+import numpy as np
+import pytest
+
+from earthio import load_layers
+from earthio.dask_load import load_layers_dask
+from earthio.layer_sources import layer_sources, open_layer, read_window
+from earthio.netcdf import load_netcdf_meta
+from earthio.tests.util import NETCDF_FILES, TIF_FILES, write_netcdf
+
+if TIF_FILES:
+    from earthio.tests.test_tif import TIF_DIR, layer_specs as tif_layer_specs
+
+
+@pytest.mark.skipif(not NETCDF_FILES,
+                    reason='elm-data repo has not been cloned')
+@pytest.mark.parametrize('chunks', (None, (500, 1000)))
+def test_load_layers_dask_netcdf(chunks):
+    files = NETCDF_FILES[:2]
+    dset = load_layers_dask(files, layer_specs=['HQobservationTime'],
+                            reader='netcdf', chunks=chunks)
+    assert dset.HQobservationTime.dims == ('file', 'y', 'x')
+    assert dset.HQobservationTime.shape == (len(files), 1800, 3600)
+    values = dset.HQobservationTime.values
+    for idx, filename in enumerate(files):
+        expected = load_layers(filename, layer_specs=['HQobservationTime'],
+                               reader='netcdf').HQobservationTime.values
+        assert np.array_equal(values[idx], expected, equal_nan=True)
+
+
+@pytest.mark.skipif(not NETCDF_FILES,
+                    reason='elm-data repo has not been cloned')
+def test_layer_sources_picklable():
+    sources = layer_sources(NETCDF_FILES[0], layer_specs=['HQobservationTime'],
+                            reader='netcdf')
+    source = pickle.loads(pickle.dumps(sources[0]))
+    assert source == sources[0]
+    assert read_window(source, ((10, 20), (30, 50))).shape == (10, 20)
+
+
+@pytest.mark.skipif(not TIF_FILES,
+                    reason='elm-data repo has not been cloned')
+def test_load_layers_dask_tif():
+    layer_specs = tif_layer_specs[:2]
+    dset = load_layers_dask([TIF_DIR], layer_specs=layer_specs,
+                            reader='tif', chunks='blocks', concat_dim=None)[0]
+    expected = load_layers(TIF_DIR, layer_specs=layer_specs, reader='tif')
+    for layer_spec in layer_specs:
+        assert np.array_equal(dset[layer_spec.name].values,
+                              expected[layer_spec.name].values)
+
+
+def test_open_layer_netcdf_releases_lock(tmp_path):
+    fname = write_netcdf(os.path.join(str(tmp_path), 'precip.nc'))
+    source = layer_sources(fname, reader='netcdf')[0]
+    metas = []
+
+    def read_meta_while_open():
+        with open_layer(source) as read:
+            read(((0, 2), (0, 2)))
+            metas.append(load_netcdf_meta(fname))
+            read(((2, 4), (0, 2)))
+    thread = threading.Thread(target=read_meta_while_open)
+    thread.daemon = True
+    thread.start()
+    thread.join(30)
+    assert not thread.is_alive() and len(metas) == 1
+
+
+def test_open_layer_netcdf_reads_attrs_once(tmp_path, monkeypatch):
+    from earthio.netcdf import NETCDF_LOCK
+    ls = sys.modules['earthio.layer_sources']
+    fname = write_netcdf(os.path.join(str(tmp_path), 'precip.nc'))
+    source = layer_sources(fname, reader='netcdf')[0]
+    locked = []
+    netcdf_encoding = ls._netcdf_encoding
+    def recording_encoding(var):
+        locked.append(NETCDF_LOCK.locked())
+        return netcdf_encoding(var)
+    monkeypatch.setattr(ls, '_netcdf_encoding', recording_encoding)
+    with open_layer(source) as read:
+        arrays = [read(((0, 3), (0, 5))), read(((3, 6), (0, 5)))]
+    # scale / offset / fill attributes: read once, with the lock held
+    assert locked == [True]
+    expected = load_layers(fname, reader='netcdf').precip.values
+    assert np.array_equal(np.vstack(arrays), read_window(source), equal_nan=True)
+    assert np.isnan(read_window(source)).sum() == np.isnan(expected).sum() == 1
+
+
+def test_cached_layer_sources_tif_rewritten(tmp_path):
+    rio = pytest.importorskip('rasterio')
+    from affine import Affine
+    from earthio.layer_sources import cached_layer_sources
+    scene = str(tmp_path)
+    band = os.path.join(scene, 'LC80150332013207LGN00_B1.TIF')
+    def write(dtype):
+        with rio.open(band, 'w', driver='GTiff', height=4, width=4, count=1,
+                      dtype=dtype, transform=Affine(30., 0, 0., 0, -30., 120.)) as dst:
+            dst.write(np.ones((4, 4), dtype=dtype), 1)
+    write('uint8')
+    assert cached_layer_sources(scene, reader='tif')[0].dtype == 'uint8'
+    # rewritten in place: the directory's mtime does not change
+    mtime = os.stat(scene).st_mtime
+    write('uint16')
+    os.utime(band, (mtime + 10, mtime + 10))
+    os.utime(scene, (mtime, mtime))
+    assert cached_layer_sources(scene, reader='tif')[0].dtype == 'uint16'
+
+
+@pytest.mark.parametrize('chunks', (None, (4, 3)))
+def test_load_layers_dask_decodes_like_load_layers(tmp_path, chunks):
+    files = [write_netcdf(os.path.join(str(tmp_path), '{}.nc'.format(idx)),
+                          scale_factor=scale)
+             for idx, scale in enumerate((0.5, 2.))]
+    dset = load_layers_dask(files, reader='netcdf', chunks=chunks,
+                            layer_specs=['precip'])
+    for idx, filename in enumerate(files):
+        expected = load_layers(filename, reader='netcdf').precip
+        assert dset.precip.dtype == expected.dtype
+        assert np.array_equal(dset.precip.values[idx], expected.values, equal_nan=True)
+    assert np.isnan(dset.precip.values[:, 0, 0]).all()
+
+
+def test_layer_source_tasks_keys(tmp_path):
+    from earthio.dask_load import layer_source_tasks
+    fname = write_netcdf(os.path.join(str(tmp_path), 'precip.nc'))
+    keys = [layer_source_tasks([fname], layer_specs=specs, reader=reader)[0].key
+            for specs, reader in ((['precip'], 'netcdf'), (['lat'], 'netcdf'),
+                                  (['precip'], None), (['precip'], 'netcdf'))]
+    assert len(set(keys[:3])) == 3 and keys[0] == keys[3]
@@ -0,0 +1,63 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import datetime
+
+import pytest
+
+from earthio.filename_parsers import (FileNameInfo,
+                                      dir_time_range,
+                                      filename_filter,
+                                      parse_filename)
+
+
+@pytest.mark.parametrize('name, expected', (
+    ('LC80150332013207LGN00_B1.TIF',
+     FileNameInfo(datetime.datetime(2013, 7, 26), (15, 33))),
+    ('LC08_L1TP_042034_20170616_20170629_01_T1_MTL.txt',
+     FileNameInfo(datetime.datetime(2017, 6, 16), (42, 34))),
+    ('MOD09GA.A2016001.h08v05.006.2016012044419.hdf',
+     FileNameInfo(datetime.datetime(2016, 1, 1), (8, 5))),
+    ('MOD08_M3.A2016032.006.2016062105549.hdf',
+     FileNameInfo(datetime.datetime(2016, 2, 1), None)),
+    ('3B-HHR-E.MS.MRG.3IMERG.20160101-S233000-E235959.1410.V03E.nc',
+     FileNameInfo((datetime.datetime(2016, 1, 1, 23, 30),
+                   datetime.datetime(2016, 1, 1, 23, 59, 59)), None)),
+    ('3B-MO.MS.MRG.3IMERG.20160201-S000000-E235959.02.V03D.HDF5',
+     FileNameInfo((datetime.datetime(2016, 2, 1),
+                   datetime.datetime(2016, 2, 29, 23, 59, 59)), None)),
+    ('/data/LC80150332013400LGN00_B1.TIF', None),
+    ('readme.txt', None),
+))
+def test_parse_filename(name, expected):
+    assert parse_filename(name) == expected
+
+
+@pytest.mark.parametrize('path, expected', (
+    ('/data/2016/01/01/imerg', ('2016-01-01', '2016-01-01T23:59:59')),
+    ('/data/2016/02', ('2016-02-01', '2016-02-29T23:59:59')),
+    ('/data/2016/032', ('2016-02-01', '2016-02-01T23:59:59')),
+    ('/data/2016', ('2016-01-01', '2016-12-31T23:59:59')),
+    ('/data/2016.03.01', ('2016-03-01', '2016-03-01T23:59:59')),
+    ('/data/L8/015/033', None),
+))
+def test_dir_time_range(path, expected):
+    if expected is not None:
+        expected = tuple(datetime.datetime.strptime(t, '%Y-%m-%dT%H:%M:%S' if 'T' in t else '%Y-%m-%d')
+                         for t in expected)
+    assert dir_time_range(path) == expected
+
+
+def test_filename_filter():
+    assert filename_filter() == (None, None)
+    keep_file, keep_dir = filename_filter(time_range=('2013-07-01', '2013-07-31'),
+                                          tiles=[(15, 33)], parser='landsat')
+    assert keep_file('LC80150332013207LGN00_B1.TIF')
+    assert not keep_file('LC80150342013207LGN00_B1.TIF')
+    assert not keep_file('LC80150332014207LGN00_B1.TIF')
+    assert not keep_file('MOD09GA.A2013207.h08v05.006.2016012044419.hdf')
+    assert keep_dir('/data/L8/015/033')
+    assert keep_dir('/data/L8/015/033/LC80150332013207LGN00')
+    assert not keep_dir('/data/L8/015/033/LC80150332014207LGN00')
+    assert not keep_dir('/data/2014/01')
+    with pytest.raises(ValueError):
+        filename_filter(tiles=[(15, 33)], parser='sentinel')
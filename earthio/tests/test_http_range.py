@@ -0,0 +1,114 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+
+import numpy as np
+import pytest
+
+from earthio.http_range import HTTPRangeFile, is_remote, rio_open
+from earthio.tests.util import RangeHTTPServer
+from earthio.util import LayerSpec
+
+SHAPE = (2048, 2048)
+WINDOW = ((512, 1024), (1024, 1536))
+
+
+@pytest.fixture
+def http_server():
+    server = RangeHTTPServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def remote_scene(http_server, tmp_path):
+    rio = pytest.importorskip('rasterio')
+    from affine import Affine
+    arrays = {}
+    for band in (1, 2):
+        name = 'LC80150332013207LGN00_B{}.TIF'.format(band)
+        path = os.path.join(str(tmp_path), name)
+        arr = np.random.RandomState(band).randint(0, 10000, SHAPE).astype(np.uint16)
+        with rio.open(path, 'w', driver='GTiff', height=SHAPE[0], width=SHAPE[1],
+                      count=1, dtype='uint16', tiled=True, blockxsize=256, blockysize=256,
+                      transform=Affine(30., 0, 300000., 0, -30., 4000000.)) as dst:
+            dst.write(arr, 1)
+        with open(path, 'rb') as f:
+            http_server.files['/scene/' + name] = f.read()
+        arrays[name] = arr
+    http_server.files['/scene/index.html'] = ''.join(
+        '<a href="{0}">{0}</a>'.format(name) for name in arrays).encode()
+    return http_server.url + '/scene/', arrays
+
+
+def test_http_range_file(http_server):
+    body = os.urandom(100000)
+    http_server.files['/data.bin'] = body
+    f = HTTPRangeFile(http_server.url + '/data.bin', block_size=4096)
+    assert f.seek(0, 2) == len(body)
+    f.seek(5000)
+    assert f.read(10000) == body[5000:15000]
+    assert f.n_requests == 1 and f.bytes_fetched == 3 * 4096
+    f.seek(8000)
+    assert f.read(100) == body[8000:8100]
+    assert f.n_requests == 1
+    f.seek(len(body) - 10)
+    assert f.read(100) == body[-10:]
+    assert f.read(100) == b''
+    with pytest.raises(IOError):
+        HTTPRangeFile(http_server.url + '/missing.bin')
+
+
+def test_http_range_file_read_larger_than_cache(http_server):
+    from earthio.http_range import MAX_MEMORY_BLOCKS
+    block_size = 256
+    body = os.urandom(block_size * (MAX_MEMORY_BLOCKS + 50))
+    http_server.files['/big.bin'] = body
+    f = HTTPRangeFile(http_server.url + '/big.bin', block_size=block_size)
+    f.seek(block_size * 10)
+    assert f.read(block_size) == body[block_size * 10:block_size * 11]
+    f.seek(100)
+    # cached block 10 in the middle, more blocks than the memory cache
+    assert f.read(len(body)) == body[100:]
+    assert f.n_requests == 3
+
+
+def test_remote_tif_window(remote_scene, http_server, tmp_path):
+    url, arrays = remote_scene
+    name = 'LC80150332013207LGN00_B1.TIF'
+    cache_dir = os.path.join(str(tmp_path), 'cache')
+    assert is_remote(url + name)
+    with rio_open(url + name, cache_dir=cache_dir) as r:
+        arr = r.read(1, window=WINDOW)
+    (r0, r1), (c0, c1) = WINDOW
+    assert np.array_equal(arr, arrays[name][r0:r1, c0:c1])
+    file_size = len(http_server.files['/scene/' + name])
+    # header + 4 tiles of 256 x 256 x 2 bytes
+    assert http_server.bytes_sent < file_size / 10
+    n_requests = len(http_server.requests)
+    with rio_open(url + name, cache_dir=cache_dir) as r:
+        assert np.array_equal(r.read(1, window=WINDOW), arr)
+    assert len(http_server.requests) == n_requests
+
+
+def test_load_layers_remote(remote_scene, http_server, tmp_path, monkeypatch):
+    from earthio.load_layers import load_layers
+    monkeypatch.setenv('EARTHIO_HTTP_CACHE', os.path.join(str(tmp_path), 'cache'))
+    url, arrays = remote_scene
+    layer_specs = [LayerSpec(name=name, search_key='name', search_value=name + '\\.TIF$',
+                             window=WINDOW)
+                   for name in ('B1', 'B2')]
+    dset = load_layers(url + 'index.html', layer_specs=layer_specs)
+    (r0, r1), (c0, c1) = WINDOW
+    for name in ('B1', 'B2'):
+        expected = arrays['LC80150332013207LGN00_{}.TIF'.format(name)][r0:r1, c0:c1]
+        assert np.array_equal(dset[name].values, expected)
+    file_size = len(http_server.files['/scene/LC80150332013207LGN00_B1.TIF'])
+    assert http_server.bytes_sent < file_size / 5
+
+
+def test_cached_layer_sources_remote(remote_scene):
+    from earthio.layer_sources import cached_layer_sources
+    url, arrays = remote_scene
+    sources = cached_layer_sources(url + 'index.html', reader='tif')
+    assert sorted(s.height for s in sources) == [SHAPE[0]] * len(arrays)
@@ -0,0 +1,157 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import datetime
+import math
+import os
+
+import numpy as np
+import pytest
+
+from earthio.landsat_util import (band_number,
+                                  calibrate,
+                                  calibration_coefficients,
+                                  landsat_metadata,
+                                  parse_mtl,
+                                  parse_mtl_many)
+
+MTL_TEXT = '''\
+GROUP = L1_METADATA_FILE
+  GROUP = METADATA_FILE_INFO
+    ORIGIN = "Image courtesy of the U.S. Geological Survey"
+    REQUEST_ID = "0501307267213_00003"
+    LANDSAT_SCENE_ID = "LC80150332013207LGN00"
+    FILE_DATE = 2013-07-27T01:17:38Z
+    PROCESSING_SOFTWARE_VERSION = "LPGS_2.2.3"
+  END_GROUP = METADATA_FILE_INFO
+  GROUP = PRODUCT_METADATA
+    DATA_TYPE = "L1T"
+    SPACECRAFT_ID = "LANDSAT_8"
+    SENSOR_ID = "OLI_TIRS"
+    WRS_PATH = 15
+    WRS_ROW = 33
+    DATE_ACQUIRED = 2013-07-26
+    SCENE_CENTER_TIME = 15:41:45.2531423Z
+    FILE_NAME_BAND_1 = "LC80150332013207LGN00_B1.TIF"
+  END_GROUP = PRODUCT_METADATA
+  GROUP = IMAGE_ATTRIBUTES
+    CLOUD_COVER = 0.66
+    SUN_AZIMUTH = 125.42553969
+    SUN_ELEVATION = 64.75305289
+  END_GROUP = IMAGE_ATTRIBUTES
+  GROUP = MIN_MAX_PIXEL_VALUE
+    QUANTIZE_CAL_MAX_BAND_1 = 65535
+    QUANTIZE_CAL_MIN_BAND_1 = 1
+  END_GROUP = MIN_MAX_PIXEL_VALUE
+  GROUP = RADIOMETRIC_RESCALING
+    RADIANCE_MULT_BAND_1 = 1.2599E-02
+    RADIANCE_ADD_BAND_1 = -62.99690
+    RADIANCE_MULT_BAND_2 = 1.2901E-02
+    RADIANCE_ADD_BAND_2 = -64.50720
+    RADIANCE_MULT_BAND_10 = 3.3420E-04
+    RADIANCE_ADD_BAND_10 = 0.10000
+    REFLECTANCE_MULT_BAND_1 = 2.0000E-05
+    REFLECTANCE_ADD_BAND_1 = -0.100000
+    REFLECTANCE_MULT_BAND_2 = 2.0000E-05
+    REFLECTANCE_ADD_BAND_2 = -0.100000
+  END_GROUP = RADIOMETRIC_RESCALING
+  GROUP = TIRS_THERMAL_CONSTANTS
+    K1_CONSTANT_BAND_10 = 774.89
+    K2_CONSTANT_BAND_10 = 1321.08
+  END_GROUP = TIRS_THERMAL_CONSTANTS
+END_GROUP = L1_METADATA_FILE
+END
+'''
+
+
+def write_mtl(directory, scene_id='LC80150332013207LGN00', text=MTL_TEXT):
+    fname = os.path.join(directory, '{}_MTL.txt'.format(scene_id))
+    with open(fname, 'w') as f:
+        f.write(text.replace('LC80150332013207LGN00', scene_id))
+    return fname
+
+
+def test_parse_mtl(tmp_path):
+    record = parse_mtl(write_mtl(str(tmp_path)))
+    groups = record.groups['L1_METADATA_FILE']
+    assert list(groups)[:3] == ['METADATA_FILE_INFO', 'PRODUCT_METADATA', 'IMAGE_ATTRIBUTES']
+    assert groups['RADIOMETRIC_RESCALING']['REFLECTANCE_MULT_BAND_2'] == 2e-5
+    assert record.SUN_ELEVATION == 64.75305289
+    assert record.WRS_PATH == 15.
+    assert record.DATA_TYPE == 'L1T'
+    assert record.DATE_ACQUIRED == '2013-07-26'
+    assert record.datetime == datetime.datetime(2013, 7, 26, 15, 41, 45)
+    assert record.get('MISSING') is None
+    with pytest.raises(AttributeError):
+        record.MISSING
+    with pytest.raises(AttributeError):
+        record.other = 1
+
+
+def test_landsat_metadata(tmp_path):
+    fname = write_mtl(str(tmp_path))
+    meta = landsat_metadata(fname)
+    assert meta.FILEPATH == fname
+    assert meta.LANDSAT_SCENE_ID == 'LC80150332013207LGN00'
+    assert meta.RADIANCE_ADD_BAND_1 == -62.9969
+    assert meta.SCENE_CENTER_TIME == '15:41:45.2531423Z'
+    assert meta.DATETIME_OBJ == datetime.datetime(2013, 7, 26, 15, 41, 45)
+    assert meta.IMAGE_QUALITY_OLI is None
+    assert vars(landsat_metadata(fname, record=parse_mtl(fname))) == vars(meta)
+
+
+def test_parse_mtl_many(tmp_path, monkeypatch):
+    import earthio.landsat_util as landsat_util
+    fnames = [write_mtl(str(tmp_path), 'LC8015033{}LGN00'.format(2013200 + idx))
+              for idx in range(5)]
+    cache_file = os.path.join(str(tmp_path), 'mtl.sqlite')
+    records = parse_mtl_many(fnames, cache_file=cache_file)
+    assert [r.LANDSAT_SCENE_ID for r in records] == [os.path.basename(f)[:21] for f in fnames]
+    parsed = []
+    parse = landsat_util.parse_mtl
+    monkeypatch.setattr(landsat_util, 'parse_mtl', lambda f: parsed.append(f) or parse(f))
+    with open(fnames[2], 'a') as f:
+        f.write('\n')
+    cached = parse_mtl_many(fnames[::-1], cache_file=cache_file)
+    assert parsed == [fnames[2]]
+    assert [r.groups for r in cached] == [r.groups for r in records[::-1]]
+    assert [r.filepath for r in cached] == fnames[::-1]
+    assert cached[0].datetime == records[-1].datetime
+
+
+def test_calibration_coefficients(tmp_path):
+    meta = landsat_metadata(write_mtl(str(tmp_path)))
+    sin_elevation = math.sin(math.radians(64.75305289))
+    gain, offset, calibration = calibration_coefficients(meta, 2)
+    assert calibration == 'reflectance'
+    assert np.allclose((gain, offset), (2e-5 / sin_elevation, -0.1 / sin_elevation))
+    assert calibration_coefficients(meta, 1, 'radiance') == (1.2599e-2, -62.9969, 'radiance')
+    assert calibration_coefficients(meta, 10) == (3.342e-4, 0.1, 'radiance')
+    with pytest.raises(ValueError):
+        calibration_coefficients(meta, 11)
+    with pytest.raises(ValueError):
+        calibration_coefficients(meta, 1, 'brightness')
+    assert band_number('/data/LC80150332013207LGN00_B10.TIF') == 10
+    assert band_number('LC80150332013207LGN00_BQA.TIF') is None
+
+
+@pytest.mark.parametrize('use_numba', [True, False])
+@pytest.mark.parametrize('in_place', [True, False])
+def test_calibrate(monkeypatch, use_numba, in_place):
+    import earthio.landsat_util as landsat_util
+    if not use_numba:
+        monkeypatch.setattr(landsat_util, '_calibrate_kernel_jit', None)
+        monkeypatch.setattr(landsat_util, 'CALIBRATE_CHUNK_SIZE', 7)
+    dn = np.random.RandomState(0).randint(0, 100, (1, 10, 9)).astype(np.uint16)
+    dn[0, :2] = 0
+    expected = (dn * 2e-5 - 0.1).astype(np.float32)
+    expected[dn == 0] = np.nan
+    if in_place:
+        out = dn.astype(np.float32)
+        assert calibrate(out, 2e-5, -0.1, out=out) is out
+    else:
+        out = calibrate(dn, 2e-5, -0.1)
+    assert out.dtype == np.float32 and out.shape == dn.shape
+    assert np.allclose(out, expected, equal_nan=True)
+    assert not np.isnan(calibrate(dn, 1., 0., fill=None)).any()
+    with pytest.raises(ValueError):
+        calibrate(dn, 1., 0., out=np.empty(dn.shape))
@@ -28,3 +28,17 @@ def test_load_layers(ftype, filename):
         layer_specs = None
     assert isinstance(load_layers(filename, layer_specs=layer_specs), xr.Dataset)
 
+
+
+def test_load_layers_sel(tmp_path):
+    pytest.importorskip('rasterio')
+    import numpy as np
+    from earthio.tests.test_tif import _write_band
+    dn = np.arange(8 * 6, dtype=np.uint16).reshape(8, 6)
+    for band in (1, 2):
+        _write_band(os.path.join(str(tmp_path), 'LC80150332013207LGN00_B{}.TIF'.format(band)), dn)
+    dset = load_layers(str(tmp_path), reader='tif')
+    # label selection on the x / y coordinates (30 m cells from 500000, 4300000)
+    layer = dset[dset.layer_order[0]]
+    assert layer.sel(x=500060., y=4299970.).values == dn[1, 2]
+    assert dset.sel(x=slice(500030., 500090.)).x.size == 3
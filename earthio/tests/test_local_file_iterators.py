@@ -0,0 +1,233 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+import re
+import threading
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from earthio.local_file_iterators import (iter_dirs_of_dirs,
+                                          iter_files_recursively,
+                                          iter_load_layers,
+                                          iter_new_files,
+                                          watch_new_files)
+from earthio.tests.util import (EARTHIO_EXAMPLE_DATA_PATH,
+                                NETCDF_FILES,
+                                write_netcdf)
+
+
+@pytest.mark.skipif(not NETCDF_FILES,
+                    reason='elm-data repo has not been cloned')
+@pytest.mark.parametrize('prefetch', (0, 1, 3))
+def test_iter_load_layers(prefetch):
+    top_dir = os.path.dirname(NETCDF_FILES[0])
+    expected = list(iter_files_recursively(top_dir=top_dir,
+                                           file_pattern='\\.nc$'))
+    loaded = []
+    for filename, dset in iter_load_layers(top_dir,
+                                           file_pattern='\\.nc$',
+                                           prefetch=prefetch,
+                                           reader='netcdf'):
+        assert isinstance(dset, xr.Dataset)
+        loaded.append(filename)
+    assert loaded == expected
+
+
+@pytest.mark.parametrize('prefetch', (0, 1, 3))
+def test_iter_load_layers_synthetic(tmp_path, monkeypatch, prefetch):
+    pytest.importorskip('netCDF4')
+    from earthio import local_file_iterators
+    from earthio.load_layers import load_layers
+    top_dir = os.path.join(str(tmp_path), 'nc')
+    for idx in range(6):
+        sub = os.path.join(top_dir, 'd{}'.format(idx % 3))
+        if not os.path.isdir(sub):
+            os.makedirs(sub)
+        write_netcdf(os.path.join(sub, '{}.nc'.format(idx)), scale_factor=idx + 1.)
+    expected = list(iter_files_recursively(top_dir=top_dir, file_pattern='\\.nc$'))
+    assert len(expected) == 6
+    started = []
+    def counting_load_layers(filename, **kwargs):
+        started.append(filename)
+        return load_layers(filename, **kwargs)
+    monkeypatch.setattr(local_file_iterators, 'load_layers', counting_load_layers)
+    loaded = []
+    for filename, dset in iter_load_layers(top_dir, file_pattern='\\.nc$',
+                                           prefetch=prefetch, reader='netcdf'):
+        # the current dataset and at most prefetch more were read
+        assert len(started) <= len(loaded) + 1 + prefetch
+        assert np.array_equal(dset.precip.values,
+                              load_layers(filename, reader='netcdf').precip.values,
+                              equal_nan=True)
+        loaded.append(filename)
+    assert loaded == expected
+    assert sorted(started) == sorted(expected)
+
+
+@pytest.fixture
+def tree(tmp_path):
+    top_dir = os.path.join(str(tmp_path), 'tree')
+    for d in ('a/b/c', 'a/d', 'e', 'f/empty'):
+        os.makedirs(os.path.join(top_dir, d))
+    for f in ('x.nc', 'a/y.hdf', 'a/b/z.nc', 'a/b/c/w.TIF', 'a/d/v.nc', 'e/u.txt'):
+        with open(os.path.join(top_dir, f), 'w') as fh:
+            fh.write('0')
+    if hasattr(os, 'symlink'):
+        os.symlink(os.path.join(top_dir, 'a'), os.path.join(top_dir, 'link_to_a'))
+        os.symlink(os.path.join(top_dir, 'missing'), os.path.join(top_dir, 'e', 'broken.nc'))
+    return top_dir
+
+
+def _walk_files(top_dir, file_pattern=None):
+    out = []
+    for root, dirs, files in os.walk(top_dir):
+        out.extend(os.path.join(root, f) for f in files
+                   if not file_pattern or re.search(file_pattern, f))
+    return out
+
+
+def _walk_dirs(top_dir, file_pattern=None):
+    return [root for root, dirs, files in os.walk(top_dir)
+            if any(os.path.isfile(os.path.join(root, f)) for f in files)
+            and (not file_pattern or any(re.search(file_pattern, f) for f in files))]
+
+
+@pytest.mark.parametrize('max_workers', (None, 4))
+@pytest.mark.parametrize('file_pattern', (None, '\\.nc$'))
+def test_iter_files_same_as_os_walk(tree, max_workers, file_pattern):
+    files = list(iter_files_recursively(top_dir=tree, file_pattern=file_pattern,
+                                        max_workers=max_workers))
+    assert files == _walk_files(tree, file_pattern)
+    dirs = list(iter_dirs_of_dirs(top_dir=tree, file_pattern=file_pattern,
+                                  max_workers=max_workers))
+    assert dirs == _walk_dirs(tree, file_pattern)
+
+
+def test_walk_caps_scans_in_flight(tmp_path, monkeypatch):
+    from earthio import local_file_iterators
+    top_dir = str(tmp_path)
+    for idx in range(50):
+        os.makedirs(os.path.join(top_dir, 'd{:02d}'.format(idx)))
+    scanned = []
+    scan_dir = local_file_iterators._scan_dir
+    def counting_scan_dir(root):
+        scanned.append(root)
+        return scan_dir(root)
+    monkeypatch.setattr(local_file_iterators, '_scan_dir', counting_scan_dir)
+    walk = local_file_iterators._walk(top_dir, max_workers=2)
+    next(walk)
+    next(walk)
+    # top_dir, then at most 2 * max_workers directories ahead
+    assert len(scanned) <= 5
+    assert len(list(walk)) == 49
+    assert len(scanned) == 51
+
+
+@pytest.mark.parametrize('max_workers', (2, 3))
+def test_walk_deep_wide_tree(tmp_path, max_workers):
+    top_dir = os.path.join(str(tmp_path), 'tree')
+    for i in range(10):
+        for j in range(10):
+            d = os.path.join(top_dir, 'd{}'.format(i), 'd{}'.format(j))
+            os.makedirs(os.path.join(d, 'leaf'))
+            for name in ('x.nc', os.path.join('leaf', 'y.nc')):
+                with open(os.path.join(d, name), 'w') as fh:
+                    fh.write('0')
+    serial = list(iter_files_recursively(top_dir=top_dir))
+    assert len(serial) == 200
+    assert list(iter_files_recursively(top_dir=top_dir,
+                                       max_workers=max_workers)) == serial
+    assert serial == _walk_files(top_dir)
+
+
+def test_iter_files_compiled_pattern(tree):
+    files = list(iter_files_recursively(top_dir=tree,
+                                        file_pattern=re.compile('\\.(nc|hdf)$')))
+    assert files == _walk_files(tree, '\\.(nc|hdf)$')
+
+
+def _touch(path, content='0'):
+    with open(path, 'w') as fh:
+        fh.write(content)
+
+
+def test_iter_new_files(tree, tmp_path):
+    state_file = os.path.join(str(tmp_path), 'state.json')
+    first = sorted(iter_new_files(tree, state_file, file_pattern='\\.nc$'))
+    assert first == sorted(f for f in _walk_files(tree, '\\.nc$')
+                           if os.path.exists(f) and '/link_to_a/' not in f)
+    assert list(iter_new_files(tree, state_file, file_pattern='\\.nc$')) == []
+    new_dir = os.path.join(tree, 'a', 'b', 'new')
+    os.makedirs(new_dir)
+    _touch(os.path.join(new_dir, 'n.nc'))
+    _touch(os.path.join(tree, 'e', 'n2.nc'))
+    _touch(os.path.join(tree, 'e', 'ignored.txt'))
+    assert sorted(iter_new_files(tree, state_file, file_pattern='\\.nc$')) == \
+        sorted([os.path.join(new_dir, 'n.nc'), os.path.join(tree, 'e', 'n2.nc')])
+    # modified in place: only found with check_modified
+    _touch(os.path.join(tree, 'x.nc'), '12345')
+    assert list(iter_new_files(tree, state_file, file_pattern='\\.nc$')) == []
+    assert list(iter_new_files(tree, state_file, file_pattern='\\.nc$',
+                               check_modified=True)) == [os.path.join(tree, 'x.nc')]
+
+
+def test_iter_new_files_stopped_early(tree, tmp_path):
+    state_file = os.path.join(str(tmp_path), 'state.json')
+    files = iter_new_files(tree, state_file)
+    first = next(files)
+    files.close()
+    # the first directory was not finished, so nothing was recorded
+    remaining = list(iter_new_files(tree, state_file))
+    assert remaining[0] == first
+    assert sorted(remaining) == sorted(iter_new_files(tree, state_file + '.2'))
+
+
+def test_watch_new_files_polling(tree, tmp_path):
+    state_file = os.path.join(str(tmp_path), 'state.json')
+    list(iter_new_files(tree, state_file, file_pattern='\\.nc$'))
+    stop = threading.Event()
+    new_file = os.path.join(tree, 'a', 'd', 'later.nc')
+    timer = threading.Timer(.2, _touch, (new_file,))
+    timer.start()
+    seen = []
+    for filename in watch_new_files(tree, state_file, file_pattern='\\.nc$',
+                                    poll_interval=.05, stop=stop,
+                                    use_inotify=False):
+        seen.append(filename)
+        stop.set()
+    timer.join()
+    assert seen == [new_file]
+
+
+def test_iter_files_time_range_tiles(tmp_path, monkeypatch):
+    import earthio.local_file_iterators as lfi
+    top_dir = os.path.join(str(tmp_path), 'data')
+    names = {'2016/01/01': ['3B-HHR-E.MS.MRG.3IMERG.20160101-S000000-E002959.0000.V03E.nc'],
+             '2016/01/02': ['3B-HHR-E.MS.MRG.3IMERG.20160102-S000000-E002959.0000.V03E.nc',
+                            'readme.txt'],
+             '2016/02/01': ['3B-HHR-E.MS.MRG.3IMERG.20160201-S000000-E002959.0000.V03E.nc'],
+             'L8/015/033/LC80150332013207LGN00': ['LC80150332013207LGN00_B1.TIF'],
+             'L8/015/034/LC80150342013207LGN00': ['LC80150342013207LGN00_B1.TIF']}
+    for d, files in names.items():
+        os.makedirs(os.path.join(top_dir, d))
+        for name in files:
+            open(os.path.join(top_dir, d, name), 'w').close()
+    scanned = []
+    scan_dir = lfi._scan_dir
+    def record(root):
+        scanned.append(os.path.relpath(root, top_dir))
+        return scan_dir(root)
+    monkeypatch.setattr(lfi, '_scan_dir', record)
+    files = list(iter_files_recursively(top_dir=top_dir,
+                                        time_range=('2016-01-02', '2016-01-31')))
+    assert files == [os.path.join(top_dir, '2016/01/02', names['2016/01/02'][0])]
+    assert '2016/01/01' not in scanned and '2016/02' not in scanned
+    assert 'L8/015/033/LC80150332013207LGN00' not in scanned
+    del scanned[:]
+    dirs = list(iter_dirs_of_dirs(top_dir=top_dir, file_pattern='\\.TIF$',
+                                  tiles=[(15, 33)], filename_parser='landsat'))
+    assert dirs == [os.path.join(top_dir, 'L8/015/033/LC80150332013207LGN00')]
+    assert 'L8/015/034/LC80150342013207LGN00' not in scanned
+    assert len(list(iter_files_recursively(top_dir=top_dir))) == 6
@@ -0,0 +1,110 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import copy
+import pickle
+
+from earthio.meta_index import MetaKeyIndex
+from earthio.meta_parser import (iter_key_values,
+                                 LazyMetaDict,
+                                 parse_meta_string,
+                                 parse_odl)
+from earthio.util import meta_strings_to_dict
+
+FILE_HEADER = 'DOI=Realtime;\nDOIshortName=3IMERGHH;\nAlgorithmID=3IMERGHH;\n'
+
+STRUCT_METADATA = '''GROUP=SwathStructure
+END_GROUP=SwathStructure
+GROUP=GridStructure
+	GROUP=GRID_1
+		GridName="MOD_Grid_500m_Surface_Reflectance"
+		XDim=2400
+		UpperLeftPointMtrs=(-7783653.637667,
+		                    4447802.078667)
+		GROUP=Dimension
+			OBJECT=Dimension_1
+				DimensionName="YDim"
+				Size=2400
+			END_OBJECT=Dimension_1
+		END_GROUP=Dimension
+	END_GROUP=GRID_1
+END_GROUP=GridStructure
+END
+'''
+
+
+def test_iter_key_values():
+    assert list(iter_key_values('a=1; b = 2 ;c;')) == [('a', '1'), ('b', '2'), ('c', None)]
+    assert list(iter_key_values('a=1;\nb=2=3;\nc;\n', sep=';\n', strict=True)) == [('a', '1')]
+
+
+def test_parse_meta_string():
+    assert parse_meta_string(FILE_HEADER) == {'DOI': 'Realtime',
+                                              'DOIshortName': '3IMERGHH',
+                                              'AlgorithmID': '3IMERGHH'}
+    assert parse_meta_string('no structure') == 'no structure'
+    assert parse_meta_string('a=b') == 'a=b'
+
+
+def test_parse_odl():
+    assert parse_meta_string(STRUCT_METADATA) == STRUCT_METADATA
+    odl = parse_meta_string(STRUCT_METADATA, odl=True)
+    assert odl == parse_odl(STRUCT_METADATA)
+    grid = odl['GridStructure']['GRID_1']
+    assert grid['GridName'] == 'MOD_Grid_500m_Surface_Reflectance'
+    assert grid['XDim'] == '2400'
+    assert grid['UpperLeftPointMtrs'] == '(-7783653.637667,4447802.078667)'
+    assert grid['Dimension']['Dimension_1']['Size'] == '2400'
+    assert odl['SwathStructure'] == {}
+
+
+def test_lazy_meta_dict_parses_on_access():
+    meta = meta_strings_to_dict({'FileHeader': FILE_HEADER,
+                                 'StructMetadata.0': STRUCT_METADATA,
+                                 'nested': [{'GridHeader': 'Origin=SOUTHWEST;'}],
+                                 'n': 1})
+    assert isinstance(meta, LazyMetaDict)
+    assert meta._unparsed == {'FileHeader', 'StructMetadata.0', 'nested', 'n'}
+    assert meta['FileHeader']['DOI'] == 'Realtime'
+    assert 'StructMetadata.0' in meta._unparsed
+    assert meta['nested'][0]['GridHeader'] == {'Origin': 'SOUTHWEST'}
+    meta2 = copy.deepcopy(meta)
+    assert 'StructMetadata.0' in meta2._unparsed
+    assert dict(meta2) == dict(meta)
+    assert pickle.loads(pickle.dumps(meta)) == meta
+    assert meta['StructMetadata.0'] == STRUCT_METADATA
+    kw = dict(**meta)
+    assert kw['n'] == 1
+    meta = meta_strings_to_dict({'StructMetadata.0': STRUCT_METADATA,
+                                 'nested': [{'StructMetadata.1': STRUCT_METADATA}]},
+                                odl=True)
+    assert isinstance(meta['StructMetadata.0'], dict)
+    assert isinstance(meta['nested'][0]['StructMetadata.1'], dict)
+
+
+def test_lazy_meta_dict_from_merged_strings():
+    meta = LazyMetaDict.from_merged_strings([FILE_HEADER, 'DOI=Final;\nx=1=2;\n'])
+    assert dict.__len__(meta) == 0
+    assert meta['DOI'] == 'Final'
+    assert sorted(meta) == ['AlgorithmID', 'DOI', 'DOIshortName']
+
+
+def test_lazy_meta_dict_set_before_load():
+    meta = LazyMetaDict.from_merged_strings([FILE_HEADER])
+    meta['sub_dataset_name'] = 'HDF5:"x.HDF5"://precipitationCal'
+    meta['DOI'] = 'Mine'
+    assert meta._pending and dict.__len__(meta) == 2
+    assert list(meta) == ['DOIshortName', 'AlgorithmID', 'sub_dataset_name', 'DOI']
+    assert meta['DOI'] == 'Mine'
+    assert meta['sub_dataset_name'] == 'HDF5:"x.HDF5"://precipitationCal'
+
+
+def test_meta_key_index_lazy():
+    meta = meta_strings_to_dict({'Scale': 1,
+                                 'later': {'FileHeader': FILE_HEADER,
+                                           'title': 'no key value'}})
+    index = MetaKeyIndex(meta)
+    assert index.find(('^scale$',)) == (('Scale',), 1)
+    later = dict.__getitem__(meta, 'later')
+    assert later._unparsed == {'FileHeader', 'title'}
+    assert index.find(('doishortname',)) == (('later', 'FileHeader', 'DOIshortName'), '3IMERGHH')
+    assert later._unparsed == {'title'}
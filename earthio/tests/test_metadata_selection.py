@@ -0,0 +1,47 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import pytest
+
+from earthio.metadata_selection import (layer_spec_matcher,
+                                        match_layers,
+                                        match_meta)
+from earthio.util import LayerSpec
+
+LAYER_METAS = [{'name': 'HDF4_EOS:EOS_GRID:"x.hdf":Grid:Band_1', 'long_name': 'Band 1'},
+               {'name': 'HDF4_EOS:EOS_GRID:"x.hdf":Grid:Band_2', 'long_name': 'Band 2'},
+               {'name': 'HDF4_EOS:EOS_GRID:"x.hdf":Grid:QA', 'valid_range': [0, 3]},
+               {'Name': 'band_3', 'units': 'K'}]
+
+
+def test_match_layers_same_as_match_meta():
+    layer_specs = [LayerSpec(name='qa', search_value='QA$'),
+                   LayerSpec(name='band_2', search_key='long_name', search_value='Band 2'),
+                   LayerSpec(name='band', search_value='Band_\\d'),
+                   LayerSpec(name='band_3', search_key='name', search_value='BAND_3',
+                             key_re_flags=['IGNORECASE'], value_re_flags='IGNORECASE')]
+    expected = []
+    for layer_meta in LAYER_METAS:
+        found = None
+        for idx, layer_spec in enumerate(layer_specs):
+            if match_meta(layer_meta, layer_spec):
+                found = idx
+                break
+        expected.append(found)
+    assert expected == [2, 1, 0, 3]
+    assert match_layers(LAYER_METAS, layer_specs) == expected
+    assert match_layers(LAYER_METAS, layer_specs[:2]) == [None, 1, 0, None]
+
+
+def test_layer_spec_matcher_cached():
+    layer_spec = LayerSpec(name='qa', search_value='QA$')
+    matcher = layer_spec_matcher(layer_spec)
+    assert layer_spec_matcher(layer_spec) is matcher
+    assert layer_spec_matcher(LayerSpec(name='other', search_value='QA$')) is matcher
+    layer_spec.set_params(search_value='Band_1$')
+    assert layer_spec_matcher(layer_spec) is not matcher
+    assert match_layers(LAYER_METAS, [layer_spec]) == [0, None, None, None]
+
+
+def test_match_meta_requires_layer_spec():
+    with pytest.raises(ValueError):
+        match_meta(LAYER_METAS[0], 'Band_1')
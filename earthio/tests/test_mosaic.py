@@ -0,0 +1,97 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+
+import numpy as np
+import pytest
+
+from earthio.mosaic import mosaic, _waves
+
+
+def _write_tile(tmp_path, name, values, left, top, res=10., nodata=None):
+    import rasterio as rio
+    from affine import Affine
+    tile_dir = os.path.join(str(tmp_path), name)
+    os.mkdir(tile_dir)
+    with rio.open(os.path.join(tile_dir, 'B1.TIF'), 'w', driver='GTiff',
+                  height=values.shape[0], width=values.shape[1], count=1,
+                  dtype=values.dtype.name, nodata=nodata,
+                  transform=Affine(res, 0, left, 0, -res, top)) as dst:
+        dst.write(values, 1)
+    return tile_dir
+
+
+@pytest.fixture
+def tiles(tmp_path):
+    pytest.importorskip('rasterio')
+    # two 4 x 4 tiles overlapping in 2 columns, and one tile outside
+    a = _write_tile(tmp_path, 'a', np.full((4, 4), 1, dtype=np.uint16), 0., 40.)
+    b = _write_tile(tmp_path, 'b', np.full((4, 4), 3, dtype=np.uint16), 20., 40.)
+    c = _write_tile(tmp_path, 'c', np.full((4, 4), 9, dtype=np.uint16), 500., 40.)
+    return [a, b, c]
+
+
+@pytest.mark.parametrize('max_workers', (None, 2))
+@pytest.mark.parametrize('method, overlap', (('first', 1), ('mean', 2), ('max', 3)))
+def test_mosaic(tiles, method, overlap, max_workers):
+    dset = mosaic(tiles, (0., 0., 70., 40.), 10., method=method,
+                  reader='tif', max_workers=max_workers)
+    out = dset.layer_0.values
+    assert out.shape == (4, 7)
+    assert dset.layer_0.attrs['geo_transform'].tolist() == [0., 10., 0., 40., 0., -10.]
+    assert (out[:, :2] == 1).all()
+    assert (out[:, 2:4] == overlap).all()
+    assert (out[:, 4:6] == 3).all()
+    assert np.isnan(out[:, 6]).all()
+
+
+def test_mosaic_memmap_and_resample(tiles, tmp_path):
+    out_file = os.path.join(str(tmp_path), 'mosaic.npy')
+    dset = mosaic(tiles[:2], (0., 0., 60., 40.), 5., reader='tif', out_file=out_file)
+    assert dset.layer_0.shape == (8, 12)
+    saved = np.load(out_file, mmap_mode='r')
+    assert np.array_equal(saved[0], dset.layer_0.values)
+    assert (saved[0, :, :8] == 1).all() and (saved[0, :, 8:] == 3).all()
+
+
+@pytest.mark.parametrize('nodata_tag', (True, False))
+@pytest.mark.parametrize('method, overlap', (('first', 1), ('mean', 2), ('max', 3)))
+def test_mosaic_fill_borders(tmp_path, method, overlap, nodata_tag):
+    pytest.importorskip('rasterio')
+    # 0 fill borders, like Landsat scenes: the overlap of the two tiles
+    # has data of a in columns 2-3 only where b is 0 fill, and both in 3
+    a = np.full((4, 5), 1, dtype=np.uint16)
+    a[:, 4] = 0
+    b = np.full((4, 5), 3, dtype=np.uint16)
+    b[:, :1] = 0
+    tag = 0 if nodata_tag else None
+    tiles = [_write_tile(tmp_path, 'a', a, 0., 40., nodata=tag),
+             _write_tile(tmp_path, 'b', b, 20., 40., nodata=tag)]
+    dset = mosaic(tiles, (0., 0., 80., 40.), 10., method=method, reader='tif',
+                  nodata=None if nodata_tag else 0)
+    out = dset.layer_0.values
+    assert (out[:, :2] == 1).all()
+    assert (out[:, 2] == 1).all()
+    assert (out[:, 3] == overlap).all()
+    assert (out[:, 4:7] == 3).all()
+    assert np.isnan(out[:, 7]).all()
+
+
+def test_mosaic_south_up(tmp_path):
+    pytest.importorskip('netCDF4')
+    from earthio.tests.util import write_netcdf
+    # Origin=SOUTHWEST: row 0 of the file is the southern row
+    filename = write_netcdf(os.path.join(str(tmp_path), 'south_up.nc'))
+    dset = mosaic([filename], (-101., 40., -95., 47.), 1.,
+                  layer_specs=['precip'], reader='netcdf')
+    raw = np.arange(30, dtype=np.float64).reshape(6, 5)
+    raw[0, 0] = np.nan
+    expected = np.full((7, 6), np.nan)
+    expected[1:, 1:] = np.flipud(raw * .5 + 1.)
+    assert np.array_equal(dset.precip.values, expected, equal_nan=True)
+
+
+def test_waves():
+    windows = [(0, ((0, 4), (0, 4))), (0, ((0, 4), (2, 6))),
+               (0, ((0, 4), (6, 8))), (1, ((0, 4), (0, 4)))]
+    assert _waves(windows) == [[0, 2, 3], [1]]
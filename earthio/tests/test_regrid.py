@@ -0,0 +1,84 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from earthio.regrid import TargetGrid, regrid, regrid_weights
+from earthio.util import geotransform_to_coords
+
+GEO_TRANSFORM = (100., 10., 0, 500., 0, -10.)
+
+
+def _dset(values, geo_transform=GEO_TRANSFORM, **attrs):
+    rows, cols = values.shape
+    x, y = geotransform_to_coords(cols, rows, geo_transform)
+    data = OrderedDict()
+    for name, arr in (('a', values), ('b', values * 2)):
+        data[name] = xr.DataArray(arr, coords=[('y', y), ('x', x)],
+                                  dims=('y', 'x'),
+                                  attrs=dict(geo_transform=np.array(geo_transform),
+                                             **attrs))
+    return xr.Dataset(data, attrs={'layer_order': ['a', 'b']})
+
+
+def test_regrid_identity():
+    values = np.arange(40, dtype=np.float32).reshape(5, 8)
+    target = TargetGrid(GEO_TRANSFORM, 5, 8)
+    for method in ('nearest', 'bilinear'):
+        out = regrid(_dset(values), target, method=method)
+        assert out.a.dims == ('y', 'x')
+        assert np.allclose(out.a.values, values)
+        assert np.allclose(out.b.values, values * 2)
+
+
+def test_regrid_nearest_upsample_and_outside():
+    values = np.arange(12, dtype=np.int16).reshape(3, 4)
+    # half the cell size, shifted one source cell left of the source grid
+    target = TargetGrid((90., 5., 0, 500., 0, -5.), 6, 10)
+    out = regrid(_dset(values), target).a.values
+    assert out.dtype == np.float32
+    assert np.isnan(out[:, :2]).all()
+    assert np.array_equal(out[:, 2:], np.repeat(np.repeat(values, 2, 0), 2, 1))
+
+
+def test_regrid_bilinear_midpoints():
+    values = np.array([[0., 10.], [20., 30.]])
+    # one target cell centered on the 4 source cell centers
+    target = TargetGrid((105., 10., 0, 495., 0, -10.), 1, 1)
+    out = regrid(_dset(values), target, method='bilinear').a.values
+    assert np.allclose(out, [[15.]])
+
+
+def test_regrid_weights_cached():
+    target = TargetGrid(GEO_TRANSFORM, 5, 8)
+    weights = regrid_weights(GEO_TRANSFORM, (5, 8), target, method='bilinear')
+    matrix, covered = weights
+    assert matrix.shape == (40, 40) and covered.all()
+    assert regrid_weights(np.array(GEO_TRANSFORM), (5, 8),
+                          TargetGrid(list(GEO_TRANSFORM), 5, 8),
+                          method='bilinear') is weights
+    assert regrid_weights(GEO_TRANSFORM, (5, 8), target) is not weights
+
+
+def test_regrid_crs():
+    pytest.importorskip('pyproj')
+    # 1 degree cells around (0, 0) in EPSG:4326, regridded to a
+    # ~10 km web mercator grid inside the source
+    values = np.arange(100, dtype=np.float64).reshape(10, 10)
+    geo_transform = (-5., 1., 0, 5., 0, -1.)
+    target = TargetGrid((-200000., 10000., 0, 200000., 0, -10000.), 40, 40,
+                        'EPSG:3857')
+    out = regrid(_dset(values, geo_transform, crs='EPSG:4326'), target)
+    assert out.a.attrs['crs'] == 'EPSG:3857'
+    assert not np.isnan(out.a.values).any()
+    # the cell 5 km east / south of the origin is in source cell (5, 5)
+    assert out.a.values[20, 20] == values[5, 5]
+
+
+def test_regrid_bad_method():
+    with pytest.raises(ValueError):
+        regrid(_dset(np.ones((2, 2))), TargetGrid(GEO_TRANSFORM, 2, 2),
+               method='cubic')
@@ -0,0 +1,273 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+import requests
+
+from earthio.s3_landsat_util import SceneDownloader, download_file
+from earthio.tests.util import RangeHTTPServer
+
+N_SCENES = 2000
+
+
+@pytest.fixture
+def scene_list_gz(tmp_path):
+    rng = np.random.RandomState(0)
+    path = rng.randint(10, 20, N_SCENES)
+    row = rng.randint(30, 40, N_SCENES)
+    dates = (pd.Timestamp('2013-04-01') +
+             pd.to_timedelta(rng.randint(0, 1500, N_SCENES), unit='D'))
+    ids = ['LC8{:03d}{:03d}{}LGN00'.format(p, r, d.strftime('%Y%j'))
+           for p, r, d in zip(path, row, dates)]
+    df = pd.DataFrame({'entityId': ids,
+                       'acquisitionDate': dates.strftime('%Y-%m-%d %H:%M:%S.%f'),
+                       'cloudCover': np.round(rng.uniform(-1, 100, N_SCENES), 2),
+                       'processingLevel': rng.choice(['L1T', 'L1GT'], N_SCENES),
+                       'path': path,
+                       'row': row,
+                       'download_url': ['https://s3-us-west-2.amazonaws.com/landsat-pds/L8/'
+                                        '{:03d}/{:03d}/{}/index.html'.format(p, r, i)
+                                        for p, r, i in zip(path, row, ids)]})
+    fname = os.path.join(str(tmp_path), 'scene_list.gz')
+    df.to_csv(fname, index=False, compression='gzip')
+    return fname
+
+
+def _downloader(scene_list_gz, **kw):
+    s3_tif_dir = os.path.join(os.path.dirname(scene_list_gz), 'tif')
+    return SceneDownloader(scene_list_gz=scene_list_gz, s3_tif_dir=s3_tif_dir, **kw)
+
+
+def test_scene_list_cache(scene_list_gz):
+    from_csv = _downloader(scene_list_gz, use_cache=False).df
+    assert not os.path.exists(_downloader(scene_list_gz, use_cache=False).scene_list_cache)
+    first = _downloader(scene_list_gz)
+    assert os.path.exists(first.scene_list_cache)
+    cached = _downloader(scene_list_gz).df
+    assert cached['path'].dtype == np.int16 and cached['row'].dtype == np.int16
+    assert cached['processingLevel'].dtype.name == 'category'
+    pd.testing.assert_frame_equal(cached, first.df)
+    assert len(cached) == N_SCENES
+    assert (cached['entityId'] == from_csv['entityId']).all()
+    assert (cached['acquisitionDate'] == from_csv['acquisitionDate']).all()
+    assert cached['cloudCover'].dtype == np.float64
+    assert (cached['cloudCover'] == from_csv['cloudCover']).all()
+    # a newer scene_list.gz replaces the cache
+    os.utime(first.scene_list_cache, (0, 0))
+    pd.read_csv(scene_list_gz).head(10).to_csv(scene_list_gz, index=False, compression='gzip')
+    assert len(_downloader(scene_list_gz).df) == 10
+    assert len(_downloader(scene_list_gz).df) == 10
+
+
+def _expected_scenes(df, path, row, max_cloud=10, months=tuple(range(1, 13))):
+    return df[(df.path == path) & (df.row == row) &
+              (df.cloudCover < max_cloud) & (df.cloudCover >= 0) &
+              (df.acquisitionDate.dt.month.isin(months))]
+
+
+@pytest.mark.parametrize('kw', ({}, dict(max_cloud=50, months=(6, 7, 8))))
+def test_get_scene_list(scene_list_gz, kw):
+    downloader = _downloader(scene_list_gz)
+    df = downloader.df
+    path_rows = [(15, 33), (12, 31), (19, 39), (99, 99)]
+    expected = []
+    for path, row in path_rows:
+        sel = _expected_scenes(df, path, row, **kw)
+        expected.append(sel)
+        pd.testing.assert_frame_equal(downloader.get_scene_list(path=path, row=row, **kw), sel)
+        lowest = sel[sel.cloudCover == sel.cloudCover.min()]
+        pd.testing.assert_frame_equal(downloader.lowest_cloud_cover_image(path=path, row=row, **kw),
+                                      lowest)
+    batch = downloader.get_scene_lists(path_rows, **kw)
+    pd.testing.assert_frame_equal(batch, pd.concat(expected).sort_index())
+    lowest = downloader.lowest_cloud_cover_images(path_rows, **kw)
+    expected = pd.concat([sel[sel.cloudCover == sel.cloudCover.min()]
+                          for sel in expected]).sort_index()
+    assert len(expected)
+    pd.testing.assert_frame_equal(lowest, expected)
+
+
+@pytest.fixture
+def http_server():
+    server = RangeHTTPServer().start()
+    yield server
+    server.stop()
+
+
+def test_download_file_resumes(http_server, tmp_path):
+    body = os.urandom(300000)
+    http_server.files['/LC8_B1.TIF'] = body
+    http_server.fail_once.add('/LC8_B1.TIF')
+    fname = os.path.join(str(tmp_path), 'LC8_B1.TIF')
+    url = http_server.url + '/LC8_B1.TIF'
+    with pytest.raises((IOError, requests.RequestException)):
+        download_file(url, fname, chunk_size=4096)
+    assert not os.path.exists(fname)
+    partial = os.path.getsize(fname + '.part')
+    assert 0 < partial < len(body)
+    download_file(url, fname, chunk_size=4096)
+    with open(fname, 'rb') as f:
+        assert f.read() == body
+    assert not os.path.exists(fname + '.part')
+    assert http_server.requests[-1] == ('/LC8_B1.TIF', 'bytes={}-'.format(partial))
+    # a complete .part file left before the rename
+    os.rename(fname, fname + '.part')
+    download_file(url, fname)
+    with open(fname, 'rb') as f:
+        assert f.read() == body
+
+
+def test_download_file_restarts_if_changed(http_server, tmp_path):
+    http_server.files['/LC8_B1.TIF'] = os.urandom(300000)
+    http_server.fail_once.add('/LC8_B1.TIF')
+    fname = os.path.join(str(tmp_path), 'LC8_B1.TIF')
+    url = http_server.url + '/LC8_B1.TIF'
+    with pytest.raises((IOError, requests.RequestException)):
+        download_file(url, fname, chunk_size=4096)
+    partial = os.path.getsize(fname + '.part')
+    # the file changes on the server: If-Range gets all of the new file
+    body = http_server.files['/LC8_B1.TIF'] = os.urandom(300000)
+    hasher = hashlib.sha256()
+    download_file(url, fname, chunk_size=4096, hasher=hasher)
+    assert http_server.requests[-1] == ('/LC8_B1.TIF', 'bytes={}-'.format(partial))
+    with open(fname, 'rb') as f:
+        assert f.read() == body
+    assert hasher.hexdigest() == hashlib.sha256(body).hexdigest()
+    assert os.listdir(str(tmp_path)) == ['LC8_B1.TIF']
+    # a .part file without a stored validator is not resumed
+    with open(fname + '.part', 'wb') as f:
+        f.write(b'x' * 1000)
+    download_file(url, fname)
+    assert http_server.requests[-1] == ('/LC8_B1.TIF', None)
+    with open(fname, 'rb') as f:
+        assert f.read() == body
+
+
+def test_download_all_layers(scene_list_gz, http_server):
+    index = '/L8/015/033/LC80150332013207LGN00/index.html'
+    names = ['LC80150332013207LGN00_B{}.TIF'.format(band) for band in range(1, 6)]
+    names.append('LC80150332013207LGN00_MTL.txt')
+    bodies = {}
+    for name in names:
+        bodies[name] = os.urandom(50000)
+        http_server.files[index.replace('index.html', name)] = bodies[name]
+    http_server.files[index] = ''.join('<a href="{0}">{0}</a>'.format(name)
+                                       for name in names).encode()
+    downloader = _downloader(scene_list_gz)
+    local_files = downloader.download_all_layers(http_server.url + index, max_workers=3)
+    assert sorted(os.path.basename(f) for f in local_files) == sorted(names)
+    for fname in local_files:
+        assert fname.startswith(os.path.join(downloader.s3_tif_dir, 'L8', '015', '033'))
+        with open(fname, 'rb') as f:
+            assert f.read() == bodies[os.path.basename(fname)]
+    n_requests = len(http_server.requests)
+    downloader.download_all_layers(http_server.url + index)
+    assert len(http_server.requests) == n_requests + 1  # only the index page
+
+
+def test_download_all_layers_store(scene_list_gz, http_server, tmp_path):
+    index = '/L8/015/033/LC80150332013207LGN00/index.html'
+    name = 'LC80150332013207LGN00_B1.TIF'
+    http_server.files[index.replace('index.html', name)] = os.urandom(1000)
+    http_server.files[index] = '<a href="{0}">{0}</a>'.format(name).encode()
+    downloader = _downloader(scene_list_gz, store_dir=os.path.join(str(tmp_path), 'store'))
+    fname, = downloader.download_all_layers(http_server.url + index)
+    os.remove(fname)
+    with open(fname, 'wb') as f:
+        f.write(b'truncated')
+    # relinked from the store
+    fname, = downloader.download_all_layers(http_server.url + index)
+    assert os.path.getsize(fname) == 1000
+    assert len(http_server.requests) == 3  # index, file, index
+    # truncated in place, with the store's object: downloaded again
+    with open(fname, 'wb') as f:
+        pass
+    fname, = downloader.download_all_layers(http_server.url + index)
+    assert os.path.getsize(fname) == 1000
+    assert len(http_server.requests) == 5
+
+
+def test_content_store(http_server, tmp_path):
+    from earthio.s3_landsat_util import ContentStore
+    body = os.urandom(200000)
+    for path in ('/a/B1.TIF', '/b/B1.TIF'):
+        http_server.files[path] = body
+    http_server.fail_once.add('/a/B1.TIF')
+    root = os.path.join(str(tmp_path), 'store')
+    store = ContentStore(root)
+    fname_a = os.path.join(str(tmp_path), 'a_B1.TIF')
+    fname_b = os.path.join(str(tmp_path), 'b_B1.TIF')
+    with pytest.raises((IOError, requests.RequestException)):
+        store.fetch(http_server.url + '/a/B1.TIF', fname_a)
+    digest = store.fetch(http_server.url + '/a/B1.TIF', fname_a)
+    assert digest == hashlib.sha256(body).hexdigest()
+    assert store.fetch(http_server.url + '/b/B1.TIF', fname_b) == digest
+    assert os.stat(fname_a).st_ino == os.stat(fname_b).st_ino == \
+        os.stat(store.object_path(digest)).st_ino
+    assert os.listdir(os.path.join(root, 'tmp')) == []
+    # later runs check the manifest, without downloading
+    n_requests = len(http_server.requests)
+    store = ContentStore(root)
+    assert store.is_valid(http_server.url + '/a/B1.TIF', fname_a)
+    os.remove(fname_b)
+    with open(fname_b, 'wb') as f:
+        f.write(body[:1000])
+    assert not store.is_valid(http_server.url + '/b/B1.TIF', fname_b)
+    store.fetch(http_server.url + '/b/B1.TIF', fname_b)
+    assert store.is_valid(http_server.url + '/b/B1.TIF', fname_b)
+    assert len(http_server.requests) == n_requests
+    with open(fname_b, 'rb') as f:
+        assert f.read() == body
+
+
+def test_content_store_modified_link(http_server, tmp_path):
+    from earthio.s3_landsat_util import ContentStore
+    body = os.urandom(20000)
+    http_server.files['/a/B1.TIF'] = body
+    url = http_server.url + '/a/B1.TIF'
+    store = ContentStore(os.path.join(str(tmp_path), 'store'))
+    fname = os.path.join(str(tmp_path), 'B1.TIF')
+    digest = store.fetch(url, fname)
+    obj = store.object_path(digest)
+    # written in place through the hard link: the object changes too
+    os.chmod(fname, 0o644)
+    with open(fname, 'r+b') as f:
+        f.write(b'x' * 100)
+    os.utime(fname, (0, 0))
+    store = ContentStore(store.root)
+    assert not store.is_valid(url, fname)
+    assert not os.path.exists(obj)
+    n_requests = len(http_server.requests)
+    assert store.fetch(url, fname) == digest
+    assert len(http_server.requests) == n_requests + 1
+    with open(fname, 'rb') as f:
+        assert f.read() == body
+    # a file of the right size, not linked from the store
+    other = os.path.join(str(tmp_path), 'other.TIF')
+    with open(other, 'wb') as f:
+        f.write(os.urandom(len(body)))
+    assert not store.is_valid(url, other)
+    with open(other, 'wb') as f:
+        f.write(body)
+    assert store.is_valid(url, other)
+
+
+def test_content_store_threads(http_server, tmp_path):
+    from earthio.s3_landsat_util import ContentStore
+    body = os.urandom(500000)
+    http_server.files['/a/B1.TIF'] = body
+    url = http_server.url + '/a/B1.TIF'
+    store = ContentStore(os.path.join(str(tmp_path), 'store'))
+    fnames = [os.path.join(str(tmp_path), 'B1_{}.TIF'.format(idx)) for idx in range(4)]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        digests = set(executor.map(lambda fname: store.fetch(url, fname), fnames))
+    assert digests == {hashlib.sha256(body).hexdigest()}
+    assert len(http_server.requests) == 1
+    for fname in fnames:
+        with open(fname, 'rb') as f:
+            assert f.read() == body
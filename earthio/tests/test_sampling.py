@@ -0,0 +1,120 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+
+import numpy as np
+import pytest
+
+from earthio import load_layers
+from earthio.layer_sources import layer_sources, read_window
+from earthio.sampling import (extract_time_series,
+                              points_to_row_col,
+                              sample_points)
+from earthio.tests.util import NETCDF_FILES, TIF_FILES, write_netcdf
+
+if TIF_FILES:
+    from earthio.tests.test_tif import TIF_DIR, layer_specs as tif_layer_specs
+
+
+def _random_points(layer, size):
+    rng = np.random.RandomState(0)
+    rows = rng.randint(0, layer.y.size, size)
+    cols = rng.randint(0, layer.x.size, size)
+    xs = layer.x.values[cols] + layer.geo_transform[1] / 2.
+    ys = layer.y.values[rows] + layer.geo_transform[5] / 2.
+    return xs, ys, rows, cols
+
+
+def test_points_to_row_col():
+    geo_transform = (100., 10., 0, 500., 0, -10.)
+    rows, cols, inside = points_to_row_col([100., 155., 99., 199.9],
+                                           [500., 451., 450., 401.],
+                                           geo_transform, 10, 10)
+    assert inside.tolist() == [True, True, False, True]
+    assert rows[inside].tolist() == [0, 4, 9]
+    assert cols[inside].tolist() == [0, 5, 9]
+
+
+@pytest.mark.skipif(not TIF_FILES,
+                    reason='elm-data repo has not been cloned')
+def test_sample_points_tif():
+    layer_specs = tif_layer_specs[:2]
+    dset = load_layers(TIF_DIR, layer_specs=layer_specs, reader='tif')
+    layer = dset[layer_specs[0].name]
+    xs, ys, rows, cols = _random_points(layer, 1000)
+    df = sample_points(TIF_DIR, xs, ys, layer_specs=layer_specs, reader='tif')
+    assert list(df.columns) == ['x', 'y'] + [spec.name for spec in layer_specs]
+    for spec in layer_specs:
+        assert df[spec.name].dtype == dset[spec.name].dtype
+        assert np.array_equal(df[spec.name].values,
+                              dset[spec.name].values[rows, cols])
+
+
+@pytest.mark.skipif(not NETCDF_FILES,
+                    reason='elm-data repo has not been cloned')
+def test_sample_points_netcdf_outside():
+    layer_specs = ['HQobservationTime']
+    source = layer_sources(NETCDF_FILES[0], layer_specs=layer_specs,
+                           reader='netcdf')[0]
+    expected = read_window(source)
+    gt = source.geo_transform
+    rng = np.random.RandomState(0)
+    rows = rng.randint(0, source.height, 200)
+    cols = rng.randint(0, source.width, 200)
+    xs = gt[0] + (cols + .5) * gt[1]
+    ys = gt[3] + (rows + .5) * gt[5]
+    xs[:5] = gt[0] - 10 * gt[1]
+    df = sample_points(NETCDF_FILES[0], xs, ys, layer_specs=layer_specs,
+                       reader='netcdf')
+    values = df.HQobservationTime.values
+    assert np.isnan(values[:5]).all()
+    assert np.array_equal(values[5:], expected[rows[5:], cols[5:]])
+
+
+@pytest.mark.skipif(not NETCDF_FILES,
+                    reason='elm-data repo has not been cloned')
+@pytest.mark.parametrize('max_workers', (1, 3))
+def test_extract_time_series(max_workers):
+    layer_specs = ['HQobservationTime']
+    files = sorted(NETCDF_FILES)
+    points = [(-179.95, 89.95), (0.05, 0.05), (12.34, -45.67), (500., 0.)]
+    arr = extract_time_series(files, points, layer_specs=layer_specs,
+                              reader='netcdf', max_workers=max_workers)
+    assert arr.dims == ('time', 'point', 'layer')
+    assert arr.shape == (len(files), len(points), 1)
+    assert list(arr.time.values) == files
+    assert np.isnan(arr.values[:, 3]).all()
+    for idx, filename in enumerate(files):
+        df = sample_points(filename, [p[0] for p in points],
+                           [p[1] for p in points], layer_specs=layer_specs,
+                           reader='netcdf')
+        assert np.allclose(arr.values[idx, :, 0], df.HQobservationTime.values,
+                           equal_nan=True)
+
+
+def _pixel_centers(layer):
+    ys, xs = np.meshgrid(layer.y.values, layer.x.values, indexing='ij')
+    return xs.ravel(), ys.ravel()
+
+
+def test_sample_points_decoded_like_load_layers(tmp_path):
+    fname = write_netcdf(os.path.join(str(tmp_path), 'precip.nc'))
+    expected = load_layers(fname, reader='netcdf').precip
+    xs, ys = _pixel_centers(expected)
+    df = sample_points(fname, xs, ys, layer_specs=['precip'], reader='netcdf')
+    assert df.precip.dtype == expected.dtype
+    assert np.array_equal(df.precip.values, expected.values.ravel(), equal_nan=True)
+    assert np.isnan(df.precip.values[0])
+
+
+def test_extract_time_series_decoded_like_load_layers(tmp_path):
+    files = [write_netcdf(os.path.join(str(tmp_path), '{}.nc'.format(idx)),
+                          scale_factor=scale, add_offset=offset)
+             for idx, (scale, offset) in enumerate(((0.5, 1.), (2., -3.)))]
+    layer = load_layers(files[0], reader='netcdf').precip
+    xs, ys = _pixel_centers(layer)
+    arr = extract_time_series(files, np.column_stack((xs, ys)),
+                              layer_specs=['precip'], reader='netcdf')
+    for idx, filename in enumerate(files):
+        expected = load_layers(filename, reader='netcdf').precip.values.ravel()
+        assert np.array_equal(arr.values[idx, :, 0], expected, equal_nan=True)
@@ -0,0 +1,83 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import datetime
+import os
+
+import numpy as np
+import pytest
+
+from earthio.spatial_index import SpatialIndex, build_spatial_index
+from earthio.tests.util import NETCDF_FILES
+
+
+def _random_index(n=5000, node_size=8):
+    rng = np.random.RandomState(0)
+    left = rng.uniform(-180, 170, n)
+    bottom = rng.uniform(-90, 80, n)
+    bounds = np.column_stack((left, bottom,
+                              left + rng.uniform(0, 10, n),
+                              bottom + rng.uniform(0, 10, n)))
+    days = rng.randint(0, 365, n).astype('timedelta64[D]')
+    start = np.datetime64('2016-01-01') + days
+    times = np.column_stack((start, start + np.timedelta64(1, 'D')))
+    files = ['file_{}'.format(idx) for idx in range(n)]
+    return SpatialIndex(files, bounds, times=times, node_size=node_size), bounds, times
+
+
+def _brute_force(bounds, query):
+    left, right = sorted(query[::2])
+    bottom, top = sorted(query[1::2])
+    return np.flatnonzero((bounds[:, 0] <= right) & (bounds[:, 2] >= left) &
+                          (bounds[:, 1] <= top) & (bounds[:, 3] >= bottom))
+
+
+@pytest.mark.parametrize('query', ((-10., -10., 10., 10.),
+                                   (100., 50., 90., 40.),
+                                   (-180., -90., 180., 90.),
+                                   (500., 500., 600., 600.)))
+def test_files_intersecting(query):
+    index, bounds, _ = _random_index()
+    expected = ['file_{}'.format(idx) for idx in _brute_force(bounds, query)]
+    assert index.files_intersecting(query) == expected
+
+
+def test_files_intersecting_time_range(tmp_path):
+    index, bounds, times = _random_index()
+    query = (-50., -50., 50., 50.)
+    time_range = (datetime.date(2016, 3, 1), '2016-03-31')
+    idx = _brute_force(bounds, query)
+    keep = ((times[idx, 1] >= np.datetime64('2016-03-01')) &
+            (times[idx, 0] <= np.datetime64('2016-03-31')))
+    expected = ['file_{}'.format(i) for i in idx[keep]]
+    assert index.files_intersecting(query, time_range=time_range) == expected
+    path = os.path.join(str(tmp_path), 'index.npz')
+    index.save(path)
+    loaded = SpatialIndex.load(path)
+    assert len(loaded) == len(index)
+    assert loaded.files_intersecting(query, time_range=time_range) == expected
+
+
+@pytest.mark.parametrize('name', ('index', 'index.idx'))
+def test_save_load_any_suffix(tmp_path, name):
+    index = _random_index()[0]
+    path = os.path.join(str(tmp_path), name)
+    index.save(path)
+    assert os.listdir(str(tmp_path)) == [name]
+    loaded = SpatialIndex.load(path)
+    assert loaded.files.tolist() == index.files.tolist()
+
+
+def test_empty_index():
+    index = SpatialIndex([], np.empty((0, 4)))
+    assert index.files_intersecting((0, 0, 1, 1)) == []
+
+
+@pytest.mark.skipif(not NETCDF_FILES,
+                    reason='elm-data repo has not been cloned')
+def test_build_spatial_index():
+    index = build_spatial_index(NETCDF_FILES, layer_specs=['HQobservationTime'],
+                                reader='netcdf',
+                                time_func=lambda f: datetime.datetime(2016, 1, 1))
+    assert index.files_intersecting((0, 0, 1, 1)) == list(NETCDF_FILES)
+    assert index.files_intersecting((0, 0, 1, 1), time_range=('2017-01-01', None)) == []
+    assert index.files_intersecting((200, 0, 201, 1)) == []
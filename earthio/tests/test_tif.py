@@ -72,3 +72,70 @@ def test_reader_kwargs():
     for b in dset.layer_order:
         assert getattr(dset, b).values.shape == (300, 200)
 
+
+
+def _write_band(path, dn, nodata=None):
+    import rasterio as rio
+    from affine import Affine
+    with rio.open(path, 'w', driver='GTiff', height=dn.shape[0], width=dn.shape[1],
+                  count=1, dtype='uint16', nodata=nodata,
+                  transform=Affine(30., 0, 500000., 0, -30., 4300000.)) as dst:
+        dst.write(dn, 1)
+
+
+@pytest.mark.parametrize('use_numba', [True, False])
+def test_calibrated_landsat_bands(tmp_path, monkeypatch, use_numba):
+    import earthio.landsat_util as landsat_util
+    from earthio.tests.test_landsat_util import write_mtl
+    if not use_numba:
+        monkeypatch.setattr(landsat_util, '_calibrate_kernel_jit', None)
+        monkeypatch.setattr(landsat_util, 'CALIBRATE_CHUNK_SIZE', 5)
+    scene_dir = str(tmp_path)
+    dn = np.arange(1, 8 * 6 + 1, dtype=np.uint16).reshape(8, 6) * 100
+    dn[0] = 0
+    for band in (1, 2, 10):
+        _write_band(os.path.join(scene_dir, 'LC80150332013207LGN00_B{}.TIF'.format(band)), dn)
+    specs = [ls(1), ls(2), ls(10)]
+    meta = load_dir_of_tifs_meta(scene_dir, layer_specs=specs)
+    with pytest.raises(ValueError):
+        load_dir_of_tifs_array(scene_dir, meta, layer_specs=specs, calibration='reflectance')
+    mtl = write_mtl(scene_dir)
+    with pytest.raises(ValueError):
+        load_dir_of_tifs_array(scene_dir, meta, layer_specs=specs, calibration='dn')
+    dset = load_dir_of_tifs_array(scene_dir, meta, layer_specs=specs, calibration='reflectance')
+    sin_elevation = np.sin(np.radians(64.75305289))
+    expected = np.where(dn == 0, np.nan, (dn * 2e-5 - 0.1) / sin_elevation)
+    assert dset.layer_1.dtype == np.float32
+    assert np.allclose(dset.layer_1.values, expected, equal_nan=True)
+    assert dset.layer_1.attrs['calibration'] == 'reflectance'
+    expected = np.where(dn == 0, np.nan, dn * 3.342e-4 + 0.1)
+    assert np.allclose(dset.layer_10.values, expected, equal_nan=True)
+    assert dset.layer_10.attrs['calibration'] == 'radiance'
+    dset = load_dir_of_tifs_array(scene_dir, meta, layer_specs=specs[:1],
+                                  calibration='radiance', mtl=mtl)
+    expected = np.where(dn == 0, np.nan, dn * 1.2599e-2 - 62.9969)
+    assert np.allclose(dset.layer_1.values, expected, equal_nan=True)
+    dset = load_dir_of_tifs_array(scene_dir, meta, layer_specs=specs)
+    assert dset.layer_1.dtype == np.uint16 and 'calibration' not in dset.layer_1.attrs
+
+
+def test_calibration_skips_bands_without_coefficients(tmp_path):
+    from earthio.load_layers import load_layers
+    from earthio.tests.test_landsat_util import write_mtl
+    scene_dir = os.path.join(str(tmp_path), 'scene')
+    os.makedirs(scene_dir)
+    dn = np.arange(1, 8 * 6 + 1, dtype=np.uint16).reshape(8, 6) * 100
+    for suffix in ('B1', 'B61', 'BQA'):
+        _write_band(os.path.join(scene_dir, 'LE70150332013207LGN00_{}.TIF'.format(suffix)), dn)
+    mtl = write_mtl(str(tmp_path))
+    dset = load_layers(scene_dir, calibration='reflectance', mtl=mtl)
+    layers = {os.path.basename(dset[name].attrs['name'])[22:-4]: dset[name]
+              for name in dset.layer_order}
+    calibrated, b61, bqa = layers['B1'], layers['B61'], layers['BQA']
+    assert calibrated.dtype == np.float32
+    assert calibrated.attrs['calibration'] == 'reflectance'
+    for layer in (b61, bqa):
+        assert layer.dtype == np.uint16 and 'calibration' not in layer.attrs
+        assert (layer.values == dn).all()
+    with pytest.raises(ValueError):
+        load_layers(scene_dir, calibration='reflectance')
@@ -0,0 +1,186 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from earthio import util
+from earthio.meta_index import MetaKeyIndex
+from earthio.util import (extract_missing_value,
+                          extract_valid_range,
+                          grid_header_to_geo_transform,
+                          set_na_from_meta)
+
+
+def _dset(values, **attrs):
+    arr = xr.DataArray(values, dims=('y', 'x'), attrs=attrs)
+    return xr.Dataset(OrderedDict([('layer_1', arr)]))
+
+
+def _expected(values, invalid=None, valid_range=None, missing=None):
+    expected = values.astype(np.float32) if 'int' in str(values.dtype) else values.copy()
+    if invalid is not None:
+        expected[(expected > invalid[0]) & (expected < invalid[1])] = np.nan
+    if valid_range is not None:
+        expected[(expected < valid_range[0]) | (expected > valid_range[1])] = np.nan
+    if missing is not None:
+        expected[expected == missing] = np.nan
+    return expected
+
+
+@pytest.mark.parametrize('use_numba', (True, False))
+@pytest.mark.parametrize('dtype', (np.uint16, np.int32, np.float32, np.float64))
+def test_set_na_from_meta(use_numba, dtype, monkeypatch):
+    if use_numba and util.numba is None:
+        pytest.skip('numba is not installed')
+    if not use_numba:
+        monkeypatch.setattr(util, '_na_kernel_jit', None)
+        monkeypatch.setattr(util, 'NA_CHUNK_SIZE', 7)
+    values = np.arange(200, dtype=dtype).reshape(10, 20)
+    dset = _dset(values.copy(),
+                 valid_range=[10, 180],
+                 invalid_range='50,60',
+                 missing_value=100)
+    set_na_from_meta(dset)
+    expected = _expected(values, invalid=(50, 60),
+                         valid_range=(10, 180), missing=100)
+    assert dset.layer_1.values.dtype == expected.dtype
+    assert np.array_equal(np.isnan(dset.layer_1.values), np.isnan(expected))
+    assert np.allclose(dset.layer_1.values, expected, equal_nan=True)
+
+
+def test_set_na_from_meta_no_na_attrs():
+    values = np.arange(20, dtype=np.uint8).reshape(4, 5)
+    dset = _dset(values.copy())
+    set_na_from_meta(dset)
+    assert dset.layer_1.values.dtype == np.float32
+    assert np.array_equal(dset.layer_1.values, values)
+
+
+def test_set_na_from_meta_float_in_place():
+    values = np.arange(20, dtype=np.float64).reshape(4, 5)
+    dset = _dset(values, missing_value=3)
+    set_na_from_meta(dset)
+    assert np.isnan(values[0, 3])
+    assert np.isnan(dset.layer_1.values).sum() == 1
+
+
+@pytest.mark.parametrize('use_numba', (True, False))
+@pytest.mark.parametrize('na_mode', ('fill', 'mask'))
+@pytest.mark.parametrize('dtype', (np.uint16, np.int16, np.float32))
+def test_set_na_from_meta_keeps_dtype(use_numba, na_mode, dtype, monkeypatch):
+    if use_numba and util.numba is None:
+        pytest.skip('numba is not installed')
+    if not use_numba:
+        monkeypatch.setattr(util, '_na_kernel_jit', None)
+        monkeypatch.setattr(util, 'NA_CHUNK_SIZE', 7)
+    values = np.arange(203, dtype=dtype).reshape(7, 29)
+    dset = _dset(values.copy(),
+                 valid_range=[10, 180],
+                 invalid_range='50,60',
+                 missing_value=-9999 if dtype != np.uint16 else 65535)
+    set_na_from_meta(dset, na_mode=na_mode)
+    layer = dset.layer_1
+    assert layer.values.dtype == dtype
+    expected = ~np.isnan(_expected(values.astype(np.float64), invalid=(50, 60),
+                                   valid_range=(10, 180)))
+    mask = util.get_valid_mask(layer)
+    assert mask.dtype == np.bool_
+    assert np.array_equal(mask, expected)
+    if na_mode == 'mask':
+        assert np.array_equal(layer.values, values)
+    else:
+        assert np.array_equal(layer.values[expected], values[expected])
+
+
+@pytest.mark.parametrize('use_numba', (True, False))
+@pytest.mark.parametrize('na_mode', ('nan', 'fill', 'mask'))
+@pytest.mark.parametrize('rules', (None, 'range', 'single'))
+def test_set_na_from_meta_nan_input(use_numba, na_mode, rules, monkeypatch):
+    if use_numba and util.numba is None:
+        pytest.skip('numba is not installed')
+    if not use_numba:
+        monkeypatch.setattr(util, '_na_kernel_jit', None)
+        monkeypatch.setattr(util, 'NA_CHUNK_SIZE', 7)
+    values = np.arange(60, dtype=np.float32).reshape(6, 10)
+    values[1, 3] = values[4, 9] = np.nan
+    if rules == 'range':
+        attrs = dict(valid_range=[10, 50], missing_value=20)
+    elif rules == 'single':
+        # a single invalid value (invalid_range of one element)
+        attrs = dict(invalid_range=30)
+    else:
+        attrs = {}
+    dset = _dset(values.copy(), **attrs)
+    set_na_from_meta(dset, na_mode=na_mode,
+                     fill_value=-1. if na_mode == 'fill' else None)
+    expected = ~np.isnan(values)
+    if rules == 'range':
+        expected &= ~np.isnan(_expected(values, valid_range=(10, 50), missing=20))
+    elif rules == 'single':
+        expected &= values != 30
+    assert np.array_equal(util.get_valid_mask(dset.layer_1), expected)
+    if na_mode == 'fill':
+        assert np.array_equal(dset.layer_1.values == -1., ~expected)
+
+
+GRID_HEADER = {'BinMethod': 'ARITHMETIC_MEAN', 'Registration': 'CENTER',
+               'LatitudeResolution': '0.1', 'LongitudeResolution': '0.1',
+               'NorthBoundingCoordinate': '90', 'SouthBoundingCoordinate': '-90',
+               'EastBoundingCoordinate': '180', 'WestBoundingCoordinate': '-180',
+               'Origin': 'SOUTHWEST'}
+
+
+def test_grid_header_to_geo_transform():
+    meta = {'name': 'x.HDF5',
+            'meta': {'FileHeader': {'DOI': '10.5067'},
+                     'GridHeader': GRID_HEADER}}
+    assert grid_header_to_geo_transform(**meta) == (-180., .1, 0, -90., 0, .1)
+    index = MetaKeyIndex(meta)
+    assert grid_header_to_geo_transform(index=index) == (-180., .1, 0, -90., 0, .1)
+    assert grid_header_to_geo_transform(name='x.HDF5') is None
+
+
+def test_extract_from_nested_meta():
+    attrs = {'meta': {'Scale': 1, 'band': {'Missing_Value': '-9999'}},
+             'Valid-Range': '0, 100', 'valid range': '5 6'}
+    assert extract_missing_value(**attrs) == [-9999.]
+    assert extract_valid_range(**attrs) == [0., 100.]
+    index = MetaKeyIndex(attrs)
+    assert index.find(util.MISSING_VALUE_WORDS) == (('meta', 'band', 'Missing_Value'), '-9999')
+    assert index.find(('^nosuchkey',)) is None
+
+
+def test_geotransform_to_coords_writable():
+    geo_transform = (100., 30., 0, 2000., 0, -30.)
+    x, y = util.geotransform_to_coords(50, 40, geo_transform)
+    assert np.array_equal(x, np.arange(50) * 30. + 100.)
+    assert np.array_equal(y, np.arange(40) * -30. + 2000.)
+    x[0] = -1.
+    x2, y2 = util.geotransform_to_coords(50, 40, np.array(geo_transform))
+    assert x2[0] == 100.
+
+
+def test_layers_to_dataset():
+    geo_transform = np.array((100., 30., 0, 2000., 0, -30.))
+    x, y = util.geotransform_to_coords(5, 4, geo_transform)
+    data = OrderedDict()
+    for name in ('a', 'b'):
+        data[name] = xr.DataArray(np.zeros((4, 5)), coords=[('y', y), ('x', x)],
+                                  dims=('y', 'x'),
+                                  attrs={'geo_transform': geo_transform.copy()})
+    dset = util.layers_to_dataset(data, attrs={'layer_order': ['a', 'b']})
+    assert dset.identical(xr.Dataset(data, attrs={'layer_order': ['a', 'b']}))
+    assert dset.sel(x=130., y=1940.).a.shape == ()
+    assert dset.sel(x=slice(130., 190.)).x.size == 3
+    if util.RangeIndex is not None:
+        lazy = util.layers_to_dataset(data, lazy_coords=True)
+        assert isinstance(lazy.xindexes['x'], util.RangeIndex)
+        assert np.allclose(lazy.x.values, x) and np.allclose(lazy.y.values, y)
+        assert lazy.sel(x=130., y=1940., method='nearest').a.shape == ()
+    x2, y2 = util.geotransform_to_coords(5, 3, geo_transform)
+    data['c'] = xr.DataArray(np.zeros((3, 5)), coords=[('y', y2), ('x', x2)],
+                             dims=('y', 'x'), attrs={'geo_transform': geo_transform})
+    assert util.layers_to_dataset(data).y.size == 4
@@ -1,8 +1,13 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 import glob
+import hashlib
 import os
+import re
+import threading
 
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from six.moves.socketserver import ThreadingMixIn
 from xarray_filters.tests.test_data import ts_clustering_example
 
 EARTHIO_EXAMPLE_DATA_PATH = os.environ.get('EARTHIO_EXAMPLE_DATA_PATH')
@@ -62,3 +67,111 @@ def random_raster(width=100, height=200):
                                  shape=(height, width),
                                  layers=layers)
 
+
+GRID_HEADER = ('BinMethod=ARITHMETIC_MEAN;\nRegistration=CENTER;\n'
+               'LatitudeResolution=1;\nLongitudeResolution=1;\n'
+               'NorthBoundingCoordinate=46;\nSouthBoundingCoordinate=40;\n'
+               'EastBoundingCoordinate=-95;\nWestBoundingCoordinate=-100;\n'
+               'Origin=SOUTHWEST;\n')
+
+
+def write_netcdf(path, raw=None, fill_value=-999, scale_factor=0.5, add_offset=1.):
+    '''Write a small NetCDF file (6 x 5 lat / lon grid with a grid
+    header) with an int16 "precip" variable of stored values raw,
+    packed with fill_value, scale_factor and add_offset'''
+    import netCDF4 as nc
+    import numpy as np
+    if raw is None:
+        raw = np.arange(30, dtype=np.int16).reshape(6, 5)
+        raw[0, 0] = fill_value
+    with nc.Dataset(path, 'w') as ds:
+        ds.GridHeader = GRID_HEADER
+        ds.createDimension('lat', 6)
+        ds.createDimension('lon', 5)
+        ds.createVariable('lat', 'f8', ('lat',))[:] = np.arange(40.5, 46)
+        ds.createVariable('lon', 'f8', ('lon',))[:] = np.arange(-99.5, -95)
+        var = ds.createVariable('precip', 'i2', ('lat', 'lon'), fill_value=fill_value)
+        var.scale_factor = scale_factor
+        var.add_offset = add_offset
+        var.set_auto_maskandscale(False)
+        var[:] = raw
+    return path
+
+
+
+class _RangeHandler(BaseHTTPRequestHandler):
+    '''Serves server.files with ETag, If-Range and "Range:
+    bytes=start-[end]" support.  Paths in server.fail_once are cut off half way the first
+    time they are requested'''
+    def log_message(self, *args):
+        pass
+
+    def _send_headers(self):
+        server = self.server
+        body = server.files.get(self.path)
+        if body is None:
+            self.send_error(404)
+            return None, 0, 0
+        start, end = 0, len(body)
+        etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+        match = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range') or '')
+        if_range = self.headers.get('If-Range')
+        if match and (if_range is None or if_range == etag):
+            start = int(match.group(1))
+            if start >= len(body):
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */{}'.format(len(body)))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return None, 0, 0
+            if match.group(2):
+                end = min(int(match.group(2)) + 1, len(body))
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end - 1, len(body)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(end - start))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        return body, start, end
+
+    def do_HEAD(self):
+        self._send_headers()
+
+    def do_GET(self):
+        server = self.server
+        body, start, end = self._send_headers()
+        if body is None:
+            return
+        server.requests.append((self.path, self.headers.get('Range')))
+        server.bytes_sent += end - start
+        if self.path in server.fail_once:
+            server.fail_once.remove(self.path)
+            self.wfile.write(body[start:start + (end - start) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body[start:end])
+
+
+class RangeHTTPServer(ThreadingMixIn, HTTPServer):
+    '''Local HTTP server of in-memory files (server.files: path ->
+    bytes) for download / range read tests.  server.requests lists
+    (path, Range header) of GET requests'''
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), _RangeHandler)
+        self.files, self.requests, self.fail_once = {}, [], set()
+        self.bytes_sent = 0
+        self.url = 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
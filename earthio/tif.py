@@ -22,6 +22,10 @@ import numpy as np
 import rasterio as rio
 import xarray as xr
 
+from earthio.http_range import is_remote, list_remote_tifs, rio_open
+from earthio.landsat_util import (CALIBRATIONS, MTLRecord, band_number,
+                                  calibrate, calibration_coefficients,
+                                  landsat_metadata)
 from earthio.metadata_selection import match_meta
 from earthio.util import (geotransform_to_coords,
                           geotransform_to_bounds,
@@ -30,7 +34,8 @@ from earthio.util import (geotransform_to_coords,
                           READ_ARRAY_KWARGS,
                           take_geo_transform_from_meta,
                           LayerSpec,
-                          meta_strings_to_dict)
+                          meta_strings_to_dict,
+                          layers_to_dataset)
 
 from six import string_types
 
@@ -61,7 +66,7 @@ def load_tif_meta(filename):
             - **sub_dataset_name**: The filename
 
     '''
-    r = rio.open(filename, driver='GTiff')
+    r = rio_open(filename, driver='GTiff')
     if r.count != 1:
         raise ValueError('earthio.tif only reads tif files with 1 layer (shape of [1, y, x]). Found {} layers'.format(r.count))
     meta = {'meta': r.meta}
@@ -74,13 +79,15 @@ def load_tif_meta(filename):
 
 
 def ls_tif_files(dir_of_tiffs):
+    if is_remote(dir_of_tiffs):
+        return list_remote_tifs(dir_of_tiffs)
     tifs = os.listdir(dir_of_tiffs)
     tifs = [f for f in tifs if f.lower().endswith('.tif') or f.lower().endswith('.tiff')]
     return [os.path.join(dir_of_tiffs, t) for t in tifs]
 
 
-def array_template(r, meta, **reader_kwargs):
-    dtype = getattr(np, r.dtypes[0])
+def array_template(r, meta, dtype=None, **reader_kwargs):
+    dtype = dtype or getattr(np, r.dtypes[0])
 
     if not 'window' in reader_kwargs:
         if 'height' in reader_kwargs:
@@ -99,7 +106,7 @@ def array_template(r, meta, **reader_kwargs):
         if 'width' in reader_kwargs:
             width = reader_kwargs['width']
         else:
-            width = np.diff(reader_kwargs['window'][0])[0]
+            width = np.diff(reader_kwargs['window'][1])[0]
     return np.empty((1, height, width), dtype=dtype)
 
 
@@ -108,7 +115,9 @@ def load_dir_of_tifs_meta(dir_of_tiffs, layer_specs=None, **meta):
     different layers of the same image.
 
     Parameters:
-        :dir_of_tiffs: Directory with GeoTiffs
+        :dir_of_tiffs: Directory with GeoTiffs, or http(s) URL of a page
+                       linking to them (read with range requests, see
+                       earthio.http_range)
         :layer_specs:   List of earthio.LayerSpec objects
         :meta:         included in returned metadata'''
     logger.debug('load_dir_of_tif_meta {}'.format(dir_of_tiffs))
@@ -140,21 +149,68 @@ def load_dir_of_tifs_meta(dir_of_tiffs, layer_specs=None, **meta):
     meta['layer_order_info'] = [b[:-1] for b in layer_order_info]
     return meta
 
-def open_prefilter(filename, meta, **reader_kwargs):
+def open_prefilter(filename, meta, dtype=None, **reader_kwargs):
     '''Placeholder for future operations on open file rasterio
     handle like resample / aggregate or setting width, height, etc
-    on load.  TODO see optional kwargs to rasterio.open'''
+    on load.  TODO see optional kwargs to rasterio.open
+
+    dtype: read into an array of dtype (default: the file's dtype)'''
     try:
-        r = rio.open(filename)
-        raster = array_template(r, meta, **reader_kwargs)
+        r = rio_open(filename)
+        raster = array_template(r, meta, dtype=dtype, **reader_kwargs)
         logger.debug('reader_kwargs {} raster template shape {}'.format(reader_kwargs, raster.shape))
-        r.read(out=raster)
+        r.read(out=raster, window=reader_kwargs.get('window'))
         return r, raster
     except Exception as e:
         logger.info('Failed to rasterio.open {}'.format(filename))
         raise
 
-def load_dir_of_tifs_array(dir_of_tiffs, meta, layer_specs=None):
+def _landsat_mtl(dir_of_tiffs, mtl=None):
+    '''landsat_metadata of mtl (MTL file name, MTLRecord or
+    landsat_metadata) or of the "*_MTL.txt" file in dir_of_tiffs'''
+    if mtl is None:
+        if not is_remote(dir_of_tiffs):
+            mtl = sorted(f for f in os.listdir(dir_of_tiffs)
+                         if f.upper().endswith('_MTL.TXT'))
+            mtl = os.path.join(dir_of_tiffs, mtl[0]) if mtl else None
+        if mtl is None:
+            raise ValueError('No *_MTL.txt file in {}: pass mtl= to calibrate'.format(dir_of_tiffs))
+    if isinstance(mtl, string_types):
+        return landsat_metadata(mtl)
+    if isinstance(mtl, MTLRecord):
+        return landsat_metadata(mtl.filepath, record=mtl)
+    return mtl
+
+
+def _band_coefficients(filename, mtl, calibration):
+    '''(gain, offset, calibration) of a Landsat band file, or None for
+    files without a band number or coefficients in mtl (e.g. "_BQA" and
+    the Landsat 7 "_B61" / "_B62" bands), which are loaded as DNs'''
+    band = band_number(filename)
+    if band is None:
+        logger.info('Not calibrating {}: no band number (_B<n>) in its name'.format(filename))
+        return None
+    try:
+        return calibration_coefficients(mtl, band, calibration)
+    except ValueError as e:
+        logger.info('Not calibrating {}: {}'.format(filename, e))
+        return None
+
+
+def _read_calibrated(filename, layer_meta, coefficients, **reader_kwargs):
+    '''(handle, float32 array, calibration) of a Landsat band read
+    straight into float32 and calibrated in place, with fill pixels
+    (the file's nodata, else DN 0) set to NaN'''
+    gain, offset, calibration = coefficients
+    handle, np_arr = open_prefilter(filename, layer_meta, dtype=np.float32,
+                                    **reader_kwargs)
+    fill = handle.nodata if handle.nodata is not None else 0
+    calibrate(np_arr, gain, offset, fill=fill, out=np_arr)
+    return handle, np_arr, calibration
+
+
+def load_dir_of_tifs_array(dir_of_tiffs, meta, layer_specs=None,
+                           calibration=None, mtl=None):
     '''Return an xr.Dataset where each subdataset is a xr.DataArray
 
     Parameters:
@@ -164,11 +220,24 @@ def load_dir_of_tifs_array(dir_of_tiffs, meta, layer_specs=None):
         :layer_specs: list of earthio.LayerSpec objects,
                     defaulting to reading all subdatasets
                     as layers
+        :calibration: None (DNs), or for Landsat band files ("..._B4.TIF")
+                    "radiance" or "reflectance" (TOA, sun elevation
+                    corrected) as float32 with NaN for fill pixels.
+                    Files without coefficients in the MTL file (e.g.
+                    "_BQA") are loaded as DNs
+        :mtl:      MTL file name, MTLRecord or landsat_metadata used with
+                    calibration (default: the "*_MTL.txt" file of
+                    dir_of_tiffs)
     Returns:
         :dset: xr.Dataset
 
+    Calibrated layers have a "calibration" attribute ("radiance" for
+    bands without reflectance coefficients, e.g. thermal bands).
     '''
-
+    if calibration is not None:
+        if calibration not in CALIBRATIONS:
+            raise ValueError('Expected calibration in {}, got {}'.format(CALIBRATIONS, calibration))
+        mtl = _landsat_mtl(dir_of_tiffs, mtl=mtl)
     logger.debug('load_dir_of_tifs_array: {}'.format(dir_of_tiffs))
     layer_order_info = meta['layer_order_info']
     tifs = ls_tif_files(dir_of_tiffs)
@@ -197,7 +266,17 @@ def load_dir_of_tifs_array(dir_of_tiffs, meta, layer_specs=None):
             reader_kwargs['window'] = tuple(map(tuple, reader_kwargs['window']))
             # TODO multx, multy should be handled here as well?
 
-        handle, np_arr = open_prefilter(filename, layer_meta, **reader_kwargs)
+        coefficients = None
+        if calibration is not None:
+            coefficients = _band_coefficients(filename, mtl, calibration)
+        if coefficients is not None:
+            handle, np_arr, layer_calibration = _read_calibrated(
+                filename, layer_meta, coefficients, **reader_kwargs)
+            # not in meta's layer_meta, which may be loaded again uncalibrated
+            layer_meta = copy.copy(layer_meta)
+            layer_meta['calibration'] = layer_calibration
+        else:
+            handle, np_arr = open_prefilter(filename, layer_meta, **reader_kwargs)
         out = _np_arr_to_coords_dims(np_arr,
                  layer_spec,
                  reader_kwargs,
@@ -213,4 +292,4 @@ def load_dir_of_tifs_array(dir_of_tiffs, meta, layer_specs=None):
 
         attrs['layer_order'].append(layer_name)
     gc.collect()
-    return xr.Dataset(elm_store_dict, attrs=attrs)
+    return layers_to_dataset(elm_store_dict, attrs=attrs)
@@ -8,22 +8,34 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 from collections import namedtuple, OrderedDict, Sequence
-from itertools import product
 import logging
 import numbers
 import re
 
 import numpy as np
 from rasterio.coords import BoundingBox
-import scipy.interpolate as spi
+import xarray as xr
+try:
+    import numba
+except ImportError:
+    numba = None
+try:
+    from xarray.indexes import RangeIndex
+except ImportError:
+    RangeIndex = None
 
 from six import string_types, PY2
 from xarray_filters.pipeline import Step
 
+from earthio.meta_index import MetaKeyIndex, MAX_CACHED_KEYS
+from earthio.meta_parser import lazy_meta, parse_meta_string_odl
+
 __all__ = ['xy_to_row_col', 'row_col_to_xy',
            'geotransform_to_coords', 'geotransform_to_bounds',
+           'geotransform_to_axes', 'grid_axis_coords', 'grid_axis_values', 'GridAxis',
+           'layers_to_dataset',
            'VALID_X_NAMES', 'VALID_Y_NAMES',
-           'LayerSpec', 'set_na_from_meta',
+           'LayerSpec', 'set_na_from_meta', 'get_valid_mask',
            'take_geo_transform_from_meta', 'import_callable',
            'meta_strings_to_dict']
 logger = logging.getLogger(__name__)
@@ -129,8 +141,38 @@ def row_col_to_xy(row, col, geo_transform):
     return x, y
 
 
+GridAxis = namedtuple('GridAxis', ['origin', 'step', 'size'])
+
+
+def geotransform_to_axes(buf_xsize, buf_ysize, geo_transform):
+    '''GridAxis (origin, step, size) of the x and y coordinates
+    of a grid with geo_transform'''
+    return (GridAxis(float(geo_transform[0]), float(geo_transform[1]), int(buf_xsize)),
+            GridAxis(float(geo_transform[3]), float(geo_transform[5]), int(buf_ysize)))
+
+
+def grid_axis_values(axis):
+    '''Coordinate values (a new np.ndarray) of a GridAxis'''
+    return np.arange(axis.size) * axis.step + axis.origin
+
+
+def grid_axis_coords(axis, dim):
+    '''xr.Coordinates of a GridAxis along dim: a lazy RangeIndex
+    (values computed on access) if this xarray has one, else the
+    grid_axis_values array.  A RangeIndex supports .sel only with
+    method="nearest"'''
+    if RangeIndex is None or axis.size < 2:
+        return xr.Coordinates({dim: grid_axis_values(axis)})
+    stop = axis.origin + axis.step * (axis.size - 1)
+    return xr.Coordinates.from_xindex(RangeIndex.linspace(axis.origin, stop,
+                                                          axis.size, dim=dim))
+
+
 def geotransform_to_coords(buf_xsize, buf_ysize, geo_transform):
-    return row_col_to_xy(np.arange(buf_ysize), np.arange(buf_xsize), geo_transform)
+    '''Return the x and y coordinates of the upper left
+    corners of cells in a grid with geo_transform'''
+    x_axis, y_axis = geotransform_to_axes(buf_xsize, buf_ysize, geo_transform)
+    return grid_axis_values(x_axis), grid_axis_values(y_axis)
 
 
 def geotransform_to_bounds(buf_xsize, buf_ysize, geo_transform):
@@ -240,6 +282,52 @@ def _np_arr_to_coords_dims(np_arr,
     return np_arr, coords, dims, attrs
 
 
+def _grid_key(arr):
+    geo_transform = arr.attrs.get('geo_transform')
+    if geo_transform is None:
+        return None
+    return (tuple(np.asarray(geo_transform, dtype=np.float64).tolist()),
+            arr.dims, arr.shape)
+
+
+def _lazy_grid_coords(arr):
+    '''x / y coordinates of arr as lazy RangeIndex coordinates (see
+    grid_axis_coords), or None if arr has other coordinates or its
+    coordinates are not those of its geo_transform'''
+    if RangeIndex is None or set(arr.dims) != {'x', 'y'} or set(arr.coords) != {'x', 'y'}:
+        return None
+    axes = geotransform_to_axes(arr.sizes['x'], arr.sizes['y'], arr.attrs['geo_transform'])
+    for dim, axis in zip(('x', 'y'), axes):
+        values = arr.coords[dim].values
+        if not np.allclose(values[[0, -1]], grid_axis_values(axis)[[0, -1]]):
+            return None
+    coords = xr.Coordinates()
+    for dim, axis in zip(('x', 'y'), axes):
+        coords = coords.merge(grid_axis_coords(axis, dim)).coords
+    return coords
+
+
+def layers_to_dataset(data, attrs=None, lazy_coords=False):
+    '''xr.Dataset from an OrderedDict of layer name -> xr.DataArray
+
+    When all layers have the same geo_transform, dims and shape, the
+    Dataset is built with one set of coordinates, without comparing
+    every layer's coordinates to the others.  With lazy_coords and an
+    xarray that has xr.indexes.RangeIndex, those x / y coordinates are
+    lazy RangeIndex coordinates (see grid_axis_coords), which support
+    .sel only with method="nearest"'''
+    grid_keys = set(_grid_key(arr) for arr in data.values())
+    if len(grid_keys) != 1 or None in grid_keys:
+        return xr.Dataset(data, attrs=attrs)
+    first = next(iter(data.values()))
+    variables = OrderedDict((name, (arr.dims, arr.data, arr.attrs))
+                            for name, arr in data.items())
+    coords = _lazy_grid_coords(first) if lazy_coords else None
+    if coords is None:
+        coords = first.coords
+    return xr.Dataset(variables, coords=coords, attrs=attrs)
+
+
 def window_to_gdal_read_kwargs(**reader_kwargs):
     if 'window' in reader_kwargs:
         window = reader_kwargs['window']
@@ -278,32 +366,34 @@ GRID_HEADER_WORDS = ('REGISTRATION', 'BINMETHOD',
                      ('WESTBOUNDINGCOORD', 'WESTERNMOSTLON'),
                      'ORIGIN',)
 
-def grid_header_to_geo_transform(**meta):
-    '''Unwind an attrs dict, trying to find bounding box words
-    that can be used to make a geo_transform object.
+_GRID_HEADER_KEYS = {}
 
-    Parameters:
-        :meta:  some dict
-    Returns:
-        :geo_transform: tuple
-    '''
+
+def _grid_header_word(key):
+    '''The GRID_HEADER_WORDS word key contains (or None), cached per key'''
+    if key in _GRID_HEADER_KEYS:
+        return _GRID_HEADER_KEYS[key]
+    word1 = key.upper()
+    word = None
+    for g in GRID_HEADER_WORDS:
+        if isinstance(g, tuple):
+            if any(gi for gi in g if gi in word1):
+                word = g[0]
+        else:
+            if g in word1:
+                word = g
+    if len(_GRID_HEADER_KEYS) > MAX_CACHED_KEYS:
+        _GRID_HEADER_KEYS.clear()
+    _GRID_HEADER_KEYS[key] = word
+    return word
+
+
+def _grid_header_items_to_geo_transform(items):
     grid_header = {}
-    for word1, v in meta.items():
-        if isinstance(v, dict):
-            geo_transform1 = grid_header_to_geo_transform(**v)
-            if geo_transform1:
-                return geo_transform1
-            else:
-                continue
-        word1 = word1.upper()
-        word = None
-        for g in GRID_HEADER_WORDS:
-            if isinstance(g, tuple):
-                if any(gi for gi in g if gi in word1):
-                    word = g[0]
-            else:
-                if g in word1:
-                    word = g
+    for word1, v in items:
+        if not isinstance(word1, string_types):
+            continue
+        word = _grid_header_word(word1)
         if not word:
             continue
         if "RESOLUTION" in word or "COORD" in word or 'MOSTLAT' in word or 'MOSTLON' in word:
@@ -328,73 +418,265 @@ def grid_header_to_geo_transform(**meta):
     return geo_transform
 
 
+def grid_header_to_geo_transform(index=None, **meta):
+    '''Unwind an attrs dict, trying to find bounding box words
+    that can be used to make a geo_transform object.
+
+    Parameters:
+        :index: earthio.MetaKeyIndex of meta, if already built
+        :meta:  some dict
+    Returns:
+        :geo_transform: tuple
+
+    The dicts nested in a dict are tried (in order) before the dict itself.
+    '''
+    if index is None:
+        index = MetaKeyIndex(meta)
+    for path, items in index.iter_containers_post_order():
+        geo_transform = _grid_header_items_to_geo_transform(items)
+        if geo_transform:
+            return geo_transform
+    return None
+
+
 
 VALID_RANGE_WORDS = ('^valid[\s\-_]*range',)
 INVALID_RANGE_WORDS = ('invalid[\s\-_]*range',)
 MISSING_VALUE_WORDS = ('missing[\s\-_]*value', 'invalid[\s\-\_]*value',)
 
-def _case_insensitive_lookup(dic, lookup_list, has_seen):
-    for k, pattern in product(dic, lookup_list):
-        match = re.search(pattern, k, re.IGNORECASE)
-        val = dic[k]
-        if match:
-            if isinstance(val, string_types):
-                if ',' in val:
-                    val = val.split(',')
-                else:
-                    val = val.split()
-            if isinstance(val, Sequence):
-                val = [float(v) for v in val]
-            else:
-                val = float(val)
-            logger.debug('{} {}'.format(match, val))
-
-            return val
-        elif isinstance(val, dict):
-            key = tuple(val) + (k, pattern)
-            if key not in has_seen:
-                has_seen.add(key)
-                ret = _case_insensitive_lookup(val, lookup_list, has_seen)
-                if ret:
-                    return ret
-
-def extract_valid_range(**attrs):
-    return _case_insensitive_lookup(attrs, VALID_RANGE_WORDS, set())
-
-
-def extract_missing_value(**attrs):
-    return _case_insensitive_lookup(attrs, MISSING_VALUE_WORDS, set())
-
-
-def extract_invalid_range(**attrs):
-    return _case_insensitive_lookup(attrs, INVALID_RANGE_WORDS, set())
-
-
-def _set_invalid_na(values, invalid):
-    invalid = np.array(invalid, dtype=values.dtype)
-    if len(invalid) == 2:
-        values[(values > invalid[0])&(values < invalid[1])] = np.NaN
-    else:
-        values[values == invalid] = np.NaN
+
+def _meta_value_to_float(val):
+    if isinstance(val, string_types):
+        if ',' in val:
+            val = val.split(',')
+        else:
+            val = val.split()
+    if isinstance(val, (Sequence, np.ndarray)):
+        return [float(v) for v in val]
+    return float(val)
+
+
+def _index_lookup(index, lookup_list):
+    '''Search a MetaKeyIndex for the first key matching one of
+    the lookup_list patterns (case insensitive, ignoring delimiters)
+    and return its value as a float or list of floats'''
+    found = index.find(lookup_list)
+    if found is None:
+        return None
+    path, val = found
+    val = _meta_value_to_float(val)
+    logger.debug('{} {}'.format(path, val))
+    return val
 
 
-def _set_na_from_valid_range(values, valid_range):
-    logger.debug('valid_range {}'.format(valid_range))
-    valid_range = np.array(valid_range, dtype=values.dtype)
-    if len(valid_range) == 2:
-        logger.debug('==2')
-        values[~((values >= valid_range[0])&(values <= valid_range[1]))] = np.NaN
-    else:
-        logger.info('Ignoring valid range metadata (does not have length of 2)')
+def _case_insensitive_lookup(dic, lookup_list, has_seen=None):
+    return _index_lookup(MetaKeyIndex(dic), lookup_list)
+
+
+def extract_valid_range(index=None, **attrs):
+    return _index_lookup(index or MetaKeyIndex(attrs), VALID_RANGE_WORDS)
+
+
+def extract_missing_value(index=None, **attrs):
+    return _index_lookup(index or MetaKeyIndex(attrs), MISSING_VALUE_WORDS)
+
+
+def extract_invalid_range(index=None, **attrs):
+    return _index_lookup(index or MetaKeyIndex(attrs), INVALID_RANGE_WORDS)
+
+
+NA_CHUNK_SIZE = 1 << 20
+
+NA_MODES = ('nan', 'fill', 'mask')
+
+
+def _na_rule(value, dtype):
+    '''Metadata value (scalar, sequence or None) as a 1-D array
+    of dtype, the dtype comparisons are made in'''
+    if value is None:
+        return np.empty(0, dtype=dtype)
+    return np.array(np.ravel(value), dtype=dtype)
+
+
+def _na_kernel(src, dst, bits, use_bits, fill, invalid, valid_range, missing):
+    '''For each element of src that is NaN or where any of the invalid /
+    valid_range / missing rules applies, either clear its bit in bits
+    (use_bits) or write fill to dst.  Other elements are copied to dst'''
+    for i in range(src.size):
+        v = src[i]
+        bad = v != v
+        if not bad and invalid.size == 2:
+            bad = v > invalid[0] and v < invalid[1]
+        elif not bad and invalid.size == 1:
+            bad = v == invalid[0]
+        if not bad and valid_range.size == 2:
+            bad = not (v >= valid_range[0] and v <= valid_range[1])
+        if not bad:
+            for m in missing:
+                if v == m:
+                    bad = True
+                    break
+        if use_bits:
+            if bad:
+                bits[i >> 3] &= 255 - (128 >> (i & 7))
+        elif bad:
+            dst[i] = fill
+        else:
+            dst[i] = v
+
+if numba is not None:
+    _na_kernel_jit = numba.njit(nogil=True)(_na_kernel)
+else:
+    _na_kernel_jit = None
+
+
+def _na_numpy_chunked(src, dst, bits, use_bits, fill, invalid, valid_range,
+                      missing, inplace=False, chunk_size=NA_CHUNK_SIZE):
+    '''Pure numpy version of _na_kernel, working on chunks
+    of chunk_size elements with one reused boolean buffer'''
+    chunk_size = -(-chunk_size // 8) * 8
+    buf = np.empty(min(chunk_size, src.size), dtype=np.bool_)
+    tmp = np.empty_like(buf)
+    for start in range(0, src.size, chunk_size):
+        stop = min(start + chunk_size, src.size)
+        s, d = src[start:stop], dst[start:stop]
+        mask, tmp2 = buf[:stop - start], tmp[:stop - start]
+        if not inplace:
+            d[...] = s
+        mask[...] = False
+        if invalid.size == 2:
+            np.greater(s, invalid[0], out=mask)
+            np.less(s, invalid[1], out=tmp2)
+            mask &= tmp2
+        elif invalid.size == 1:
+            np.equal(s, invalid[0], out=mask)
+        if s.dtype.kind == 'f':
+            np.isnan(s, out=tmp2)
+            mask |= tmp2
+        if valid_range.size == 2:
+            np.less(s, valid_range[0], out=tmp2)
+            mask |= tmp2
+            np.greater(s, valid_range[1], out=tmp2)
+            mask |= tmp2
+        for m in missing:
+            np.equal(s, m, out=tmp2)
+            mask |= tmp2
+        if use_bits:
+            np.logical_not(mask, out=mask)
+            packed = np.packbits(mask)
+            bits[start // 8:start // 8 + packed.size] = packed
+        else:
+            d[mask] = fill
 
 
+def _default_fill_value(dtype):
+    if 'float' in str(dtype):
+        return np.nan
+    if 'uint' in str(dtype):
+        return np.iinfo(dtype).max
+    return np.iinfo(dtype).min
 
-def set_na_from_meta(dset, **kwargs):
+
+def _fused_set_na(values, invalid=None, valid_range=None, missing=None,
+                  na_mode='nan', fill_value=None):
+    '''Apply in one pass over values the invalid range or value,
+    the valid_range, and the missing value(s) rules.  NaN elements are
+    invalid in every na_mode.
+
+    na_mode:
+        - "nan": Integer arrays are written to a new float32 array, float
+          arrays are modified in place (when C contiguous).  NaN marks
+          invalid elements
+        - "fill": values are modified in place, keeping their dtype, with
+          fill_value (default: _default_fill_value) marking invalid elements
+        - "mask": values are not modified
+
+    Returns:
+        :(out, bits): the result array and, for "mask", a np.packbits
+                      array with a set bit for each valid element
+    '''
+    if na_mode not in NA_MODES:
+        raise ValueError('na_mode {} not in {}'.format(na_mode, NA_MODES))
+    is_int = 'int' in str(values.dtype)
+    if na_mode == 'nan' and is_int:
+        out = np.empty(values.shape, dtype=np.float32)
+    elif values.flags.c_contiguous:
+        out = values
+    else:
+        out = np.ascontiguousarray(values)
+        values = out
+    inplace = out is values
+    # compare integers to float metadata without wrapping or truncating them
+    rule_dtype = np.float64 if is_int and na_mode != 'nan' else out.dtype
+    use_bits = na_mode == 'mask'
+    bits = np.full(-(-values.size // 8) if use_bits else 0, 255, dtype=np.uint8)
+    if na_mode == 'nan':
+        fill = np.nan
+    else:
+        fill = _default_fill_value(out.dtype) if fill_value is None else fill_value
+        if is_int and np.array(fill).astype(out.dtype) != fill:
+            raise ValueError('fill_value {} cannot be stored as {}'.format(fill, out.dtype))
+    src = np.ascontiguousarray(values).reshape(-1)
+    dst = out.reshape(-1)
+    invalid = _na_rule(invalid, rule_dtype)
+    valid_range = _na_rule(valid_range, rule_dtype)
+    if valid_range.size not in (0, 2):
+        logger.info('Ignoring valid range metadata (does not have length of 2)')
+        valid_range = valid_range[:0]
+    missing = _na_rule(missing, rule_dtype)
+    if not src.size:
+        return out, bits
+    # NaN is invalid: only "nan" mode can skip the pass over floats
+    nan_rule = src.dtype.kind == 'f' and na_mode != 'nan'
+    if not (invalid.size or valid_range.size or missing.size or nan_rule):
+        if not inplace:
+            dst[...] = src
+        return out, bits
+    if _na_kernel_jit is not None:
+        _na_kernel_jit(src, dst, bits, use_bits, fill,
+                       invalid, valid_range, missing)
+    else:
+        _na_numpy_chunked(src, dst, bits, use_bits, fill,
+                          invalid, valid_range, missing,
+                          inplace=inplace, chunk_size=NA_CHUNK_SIZE)
+    return out, bits
+
+
+def get_valid_mask(layer_arr):
+    '''Boolean array, True where layer_arr (an xr.DataArray after
+    set_na_from_meta) is valid, without converting it to float.
+
+    Uses (in order of preference) the "valid_bits" packed mask of
+    na_mode="mask", the "_FillValue" of na_mode="fill", or NaNs'''
+    attrs = layer_arr.attrs
+    values = layer_arr.values
+    if 'valid_bits' in attrs:
+        mask = np.unpackbits(attrs['valid_bits'])[:values.size]
+        return mask.reshape(values.shape).astype(np.bool_)
+    if '_FillValue' in attrs and not np.isnan(attrs['_FillValue']):
+        return values != np.array(attrs['_FillValue'], dtype=values.dtype)
+    if 'float' in str(values.dtype):
+        return ~np.isnan(values)
+    return np.ones(values.shape, dtype=np.bool_)
+
+
+def set_na_from_meta(dset, na_mode='nan', fill_value=None, **kwargs):
     '''Set NaNs based on "valid_range" "invalid_range" and/or "missing"
      in xr.Dataset attrs or xr.DataArray attrs
 
     Parameters:
         :dset: xr.Dataset
+        :na_mode: how invalid values are marked:
+
+            - "nan" (default): integer layers are converted to float32
+              and invalid values are NaN
+            - "fill": layers keep their dtype, invalid values are set
+              to fill_value and attrs["_FillValue"] is set
+            - "mask": layers are not modified, attrs["valid_bits"] is a
+              np.packbits array of the validity mask (see get_valid_mask)
+
+        :fill_value: for na_mode="fill" (default: largest unsigned /
+                     smallest signed integer of the dtype, NaN for float)
         :kwargs: ignored
 
     Recursively searches dset's attrs for keys loosely matching:
@@ -409,53 +691,47 @@ def set_na_from_meta(dset, **kwargs):
     would be NaN. With ``dset.attrs.valid_range == [0, 1]`` all values in all layers
     outside of (0, 1) would be assigned NaN.
 
+    The three rules are applied in a single pass (a numba kernel if numba
+    is installed, else chunked numpy) without full-size boolean temporaries.
     '''
-    attrs = dset.attrs
     for layer in dset.data_vars:
         layer_arr = getattr(dset, layer)
-        if 'int' in str(layer_arr.values.dtype):
-            layer_arr.values = layer_arr.values.astype(np.float32)
-    for idx, layer in enumerate(dset.data_vars):
-        layer_arr = getattr(dset, layer)
-        val = layer_arr.values
-        invalid_range_b = extract_invalid_range(**layer_arr.attrs)
+        index = MetaKeyIndex(layer_arr.attrs)
+        invalid_range_b = extract_invalid_range(index=index)
         if invalid_range_b is not None:
             logger.debug('Invalid range {}'.format(invalid_range_b))
-            _set_invalid_na(val, invalid_range_b)
-        valid_range_b = extract_valid_range(**layer_arr.attrs)
+        valid_range_b = extract_valid_range(index=index)
         if valid_range_b is not None:
             logger.debug('Valid range {}'.format(valid_range_b))
-            _set_na_from_valid_range(val, valid_range_b)
-        missing_value_b = extract_missing_value(**layer_arr.attrs)
+        missing_value_b = extract_missing_value(index=index)
         if missing_value_b is not None:
             logger.debug('Missing value {}'.format(missing_value_b))
-            val[val == np.array([missing_value_b], dtype=val.dtype)[0]] = np.NaN
-
-
-def _meta_strings_to_dict(s):
-    if ';' in s and '=' in s and s.index('=') < s.index(';'):
-        items = [_.strip() for _ in s.split(';')]
-        items = [tuple(item.split('=')) for item in items]
-        items = [(item if len(item) == 2 else item + (None,))
-                 for item in items]
-        return dict(items)
-    return s
-
-
-def meta_strings_to_dict(meta):
+        val = layer_arr.values
+        out, bits = _fused_set_na(val,
+                                  invalid=invalid_range_b,
+                                  valid_range=valid_range_b,
+                                  missing=missing_value_b,
+                                  na_mode=na_mode,
+                                  fill_value=fill_value)
+        if out is not val:
+            layer_arr.values = out
+        if na_mode == 'fill':
+            layer_arr.attrs['_FillValue'] = out.dtype.type(
+                _default_fill_value(out.dtype) if fill_value is None else fill_value)
+        elif na_mode == 'mask':
+            layer_arr.attrs['valid_bits'] = bits
+
+
+def meta_strings_to_dict(meta, odl=False):
     '''Parses strings within old GDAL meta like:
     {u'HDF5_GLOBAL.FileHeader': u'DOI=Realtime;\nDOIshortName=3IMERGHH;\n}
 
     Splitting on ";" for items then on "="
     for key/value.  Value isNone where empty string is right of =
-    '''
-    if hasattr(meta, 'items'):
-        for k, v in meta.items():
-            if is_string(v):
-                meta[k] = _meta_strings_to_dict(v)
-            else:
-                meta[k] = meta_strings_to_dict(v)
-    elif isinstance(meta, Sequence) and not is_string(meta):
-        meta = [meta_strings_to_dict(item) for item in meta]
-    return meta
+    With odl=True, ODL strings (GROUP = ... END_GROUP = ...) also become
+    nested dicts (by default they are left as strings).
 
+    Parsing is lazy: dicts are returned as earthio.LazyMetaDict, which
+    parses each string value on its first access
+    '''
+    return lazy_meta(meta, parse=parse_meta_string_odl if odl else None)